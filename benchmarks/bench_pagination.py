@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+# ============================================================================
+
+# Benchmark: cost of accumulating a paginated user timeline
+
+# ============================================================================
+"""Times `GetTweetsFromUser.main` over canned timelines of growing length.
+
+Pages are served from memory by a stand-in transport, so only the cost of
+accumulating pages is measured. With `PageBuffer` the time per page stays flat
+as the timeline grows; the legacy page-by-page concatenation is timed next to
+it for comparison. With `--arrow`, pages are decoded straight into Arrow
+instead of going through `json_normalize`.
+
+    python benchmarks/bench_pagination.py --pages 2000 --page-size 100 [--arrow]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+
+from pandas import json_normalize
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tweetple.TwitterFullArchive import GetTweetsFromUser  # noqa: E402
+
+
+def tweet(i):
+    return {
+        'id': str(1000000000000000000 + i),
+        'author_id': '308131814',
+        'conversation_id': str(1000000000000000000 + i),
+        'created_at': '2021-11-17T22:03:01.000Z',
+        'lang': 'es',
+        'source': 'Twitter for iPhone',
+        'text': 'tweet number {}'.format(i),
+        'public_metrics': {'retweet_count': i % 7, 'reply_count': i % 3, 'like_count': i % 11, 'quote_count': 0},
+    }
+
+
+class Response:
+
+    status_code = 200
+    headers = {}
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    @property
+    def content(self):
+        return json.dumps(self.payload).encode('utf-8')
+
+    def json(self):
+        return self.payload
+
+
+class CannedTransport:
+
+    """Serves `pages` pages of `page_size` tweets from memory"""
+
+    def __init__(self, pages, page_size):
+        self.pages = pages
+        self.page_size = page_size
+
+    def headers(self, bearer_token):
+        return {}
+
+    def get(self, url, headers=None, params=None):
+        page = int(params.get('next_token', 0))
+        start = page * self.page_size
+        meta = {'result_count': self.page_size}
+        if page + 1 < self.pages:
+            meta['next_token'] = str(page + 1)
+        data = [tweet(i) for i in range(start, start + self.page_size)]
+        return Response({'data': data, 'meta': meta})
+
+
+def buffered(pages, page_size, arrow=False):
+    collector = GetTweetsFromUser(
+        'benchmark', 'token', '2006-03-26T00:00:00Z', '2021-11-18T00:00:00Z',
+        'https://api.twitter.com/2/tweets/search/all', CannedTransport(pages, page_size),
+        arrow=arrow
+    )
+    return collector.main()
+
+
+def arrow(pages, page_size):
+    return buffered(pages, page_size, arrow=True)
+
+
+def legacy(pages, page_size):
+    transport = CannedTransport(pages, page_size)
+    query = {}
+    json_response = transport.get(None, params=query).json()
+    df = json_normalize(json_response['data']).sort_index(axis=1)
+    while 'next_token' in json_response['meta']:
+        query['next_token'] = json_response['meta']['next_token']
+        json_response = transport.get(None, params=query).json()
+        df = pd.concat([df, json_normalize(json_response['data']).sort_index(axis=1)])
+    return df.reset_index(drop=True)
+
+
+def timed(func, pages, page_size):
+    start = time.perf_counter()
+    rows = len(func(pages, page_size))
+    return time.perf_counter() - start, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=2000)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--skip-legacy', action='store_true')
+    parser.add_argument('--arrow', action='store_true', help='decode pages into Arrow tables')
+    args = parser.parse_args()
+
+    sizes = sorted({max(args.pages // 8, 1), max(args.pages // 4, 1), max(args.pages // 2, 1), args.pages})
+
+    print('{:>8} {:>10} {:>14} {:>12} {:>14} {:>12}'.format(
+        'pages', 'rows', 'buffered (s)', 'ms/page', 'legacy (s)', 'ms/page'))
+
+    for pages in sizes:
+        seconds, rows = timed(arrow if args.arrow else buffered, pages, args.page_size)
+        line = '{:>8} {:>10} {:>14.2f} {:>12.3f}'.format(pages, rows, seconds, 1000 * seconds / pages)
+        if not args.skip_legacy:
+            seconds, _ = timed(legacy, pages, args.page_size)
+            line += ' {:>14.2f} {:>12.3f}'.format(seconds, 1000 * seconds / pages)
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+# ============================================================================
+
+# Benchmark: streamers end to end against the local mock API
+
+# ============================================================================
+"""Runs every `TweetStreamer` and `TweepleStreamer` entry point end to end
+against `mock_server.py` and reports pages/s, rows/s, peak RSS and the time
+spent sleeping on rate limits.
+
+Each entry point runs in a fresh process, so its peak RSS is its own; pages
+and rows are counted by the server. With `--json`, results are also written
+to a file, to compare runs before and after an upgrade.
+
+    python benchmarks/bench_streamers.py --items 20 --pages 10 --latency 0.01 \
+        [--limit 50 --window 2] [--concurrency 4] [--pipeline 2] [--only followers,threads] [--json out.json]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mock_server import BASE_ID, MockTwitterServer  # noqa: E402
+
+
+def handles(n):
+    return ['handle{}'.format(i) for i in range(n)]
+
+
+def tweet_ids(n):
+    return [str(BASE_ID + i) for i in range(n)]
+
+
+def user_ids(n):
+    return [str(10 ** 9 + i) for i in range(n)]
+
+
+def links(n):
+    return ['https://www.example.com/article/{}'.format(i) for i in range(n)]
+
+
+def run_handles(options, transport):
+    from tweetple.TweetPle import TweetStreamer
+    TweetStreamer(handles(options['items']), 'token', transport=transport, concurrency=options['concurrency'], flush_pages=options['flush_pages'], pipeline=options['pipeline']).streamer_handles()
+
+
+def run_tweetids(options, transport):
+    from tweetple.TweetPle import TweetStreamer
+    TweetStreamer(tweet_ids(100 * options['items']), 'token', transport=transport, concurrency=options['concurrency'], flush_pages=options['flush_pages'], pipeline=options['pipeline']).streamer_tweetids()
+
+
+def run_links(options, transport):
+    from tweetple.TweetPle import TweetStreamer
+    TweetStreamer(links(options['items']), 'token', transport=transport, concurrency=options['concurrency'], flush_pages=options['flush_pages'], pipeline=options['pipeline']).streamer_links()
+
+
+def run_users(options, transport):
+    from tweetple.TweetPle import TweepleStreamer
+    TweepleStreamer(user_ids(100 * options['items']), 'token', save=True, transport=transport, concurrency=options['concurrency'], flush_pages=options['flush_pages'], pipeline=options['pipeline']).user_lookup()
+
+
+def run_followers(options, transport):
+    from tweetple.TweetPle import TweepleStreamer
+    TweepleStreamer(user_ids(options['items']), 'token', transport=transport, concurrency=options['concurrency'], flush_pages=options['flush_pages'], pipeline=options['pipeline']).followers_lookup()
+
+
+def run_likes(options, transport):
+    from tweetple.TweetPle import TweepleStreamer
+    TweepleStreamer(tweet_ids(options['items']), 'token', transport=transport, concurrency=options['concurrency'], flush_pages=options['flush_pages'], pipeline=options['pipeline']).likes_lookup()
+
+
+def run_retweets(options, transport):
+    from tweetple.TweetPle import TweepleStreamer
+    TweepleStreamer(tweet_ids(options['items']), 'token', transport=transport, concurrency=options['concurrency'], flush_pages=options['flush_pages'], pipeline=options['pipeline']).retweet_lookup()
+
+
+def run_threads(options, transport):
+    from tweetple.TweetPle import get_threads
+    get_threads(tweet_ids(options['items']), 'token', './', transport, options['concurrency'], flush_pages=options['flush_pages'], pipeline=options['pipeline'])
+
+
+CASES = {
+    'handles': run_handles,
+    'tweetids': run_tweetids,
+    'links': run_links,
+    'users': run_users,
+    'followers': run_followers,
+    'likes': run_likes,
+    'retweets': run_retweets,
+    'threads': run_threads,
+}
+
+
+def peak_rss():
+    """Peak resident memory of this process, in MB"""
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # bytes on macOS, kilobytes elsewhere
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def child(name, options, url, results):
+    """Runs one entry point in a scratch directory, reports time, sleep and RSS"""
+
+    import tweetple.TweetPle  # noqa: F401 imported before the clock starts
+    from tweetple.RateLimitTweetPle import RateLimiter
+    from tweetple.TransportTweetPle import Transport
+
+    # budgets are learned from the server's headers rather than the real API's
+    transport = Transport(base_url=url, rate_limiter=RateLimiter(limits={}))
+
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        start = time.perf_counter()
+        CASES[name](options, transport)
+        seconds = time.perf_counter() - start
+
+    results.put({'seconds': seconds, 'slept': transport.rate_limiter.slept, 'peak_rss_mb': peak_rss()})
+
+
+def bench(name, options, server):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    before = server.totals()
+
+    process = context.Process(target=child, args=(name, options, server.url, results))
+    process.start()
+    process.join()
+
+    if process.exitcode != 0:
+        raise RuntimeError('{} failed with exit code {}'.format(name, process.exitcode))
+
+    result = results.get()
+    after = server.totals()
+    served = {key: after[key] - before[key] for key in after}
+
+    return dict(
+        result,
+        case=name,
+        pages=served['requests'] - served['throttled'],
+        rows=served['rows'],
+        throttled=served['throttled'],
+        megabytes=served['bytes'] / 1024 ** 2,
+        pages_per_s=(served['requests'] - served['throttled']) / result['seconds'],
+        rows_per_s=served['rows'] / result['seconds'],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=10,
+                        help='handles, links, accounts or conversations per case (x100 for lookups)')
+    parser.add_argument('--pages', type=int, default=5, help='pages of every paginated collection')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--limit', type=int, default=None, help='requests per endpoint and window')
+    parser.add_argument('--window', type=float, default=2.0, help='seconds of a rate-limit window')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--pipeline', type=int, default=None, help='workers normalizing and writing pages')
+    parser.add_argument('--flush-pages', type=int, default=50, help='pages per written batch')
+    parser.add_argument('--only', default=None, help='comma-separated cases, e.g. followers,threads')
+    parser.add_argument('--json', default=None, help='file results are written to')
+    args = parser.parse_args()
+
+    names = args.only.split(',') if args.only else list(CASES)
+    options = {'items': args.items, 'concurrency': args.concurrency, 'pipeline': args.pipeline, 'flush_pages': args.flush_pages}
+    rows = []
+
+    print('{:>10} {:>9} {:>7} {:>9} {:>9} {:>11} {:>10} {:>9} {:>8}'.format(
+        'case', 'time (s)', 'pages', 'pages/s', 'rows', 'rows/s', 'RSS (MB)', 'slept (s)', '429s'))
+
+    with MockTwitterServer(pages=args.pages, latency=args.latency, limit=args.limit, window=args.window) as server:
+        for name in names:
+            result = bench(name, options, server)
+            rows.append(result)
+            print('{case:>10} {seconds:>9.2f} {pages:>7} {pages_per_s:>9.1f} {rows:>9} {rows_per_s:>11.0f} '
+                  '{peak_rss_mb:>10.1f} {slept:>9.2f} {throttled:>8}'.format(**result))
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'options': vars(args), 'results': rows}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+# ============================================================================
+
+# Local stand-in for the Twitter API v2 endpoints tweetple calls
+
+# ============================================================================
+"""Serves synthetic tweets and users over HTTP, with pagination, latency and
+rate-limit headers shaped like the real API's.
+
+Endpoints:
+
+    /2/tweets/search/all                       from:, url:"..." and conversation_id: queries
+    /2/tweets/counts/all                       tweets per day or hour, a quarter of them non-empty
+    /2/tweets?ids=...                          tweet lookup
+    /2/users?ids=...                           user lookup
+    /2/users/:id/followers                     followers, paginated
+    /2/tweets/:id/liking_users|retweeted_by    users interacting, paginated
+
+Point a `Transport` at it with `Transport(base_url=server.url)`. Run it on its
+own to benchmark against it from another process:
+
+    python benchmarks/mock_server.py --port 8000 --latency 0.02
+"""
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+BASE_ID = 1400000000000000000
+
+
+def _seed(text):
+    """Stable integer derived from a query, so reruns serve the same ids"""
+
+    return int(hashlib.md5(text.encode('utf-8')).hexdigest()[:8], 16)
+
+
+def make_user(id):
+    id = int(id)
+    return {
+        'id': str(id),
+        'username': 'user{}'.format(id % 10 ** 9),
+        'name': 'User {}'.format(id % 10 ** 9),
+        'created_at': '2012-03-0{}T10:00:00.000Z'.format(1 + id % 9),
+        'description': 'synthetic account {} #tweetple'.format(id),
+        'location': 'Santiago',
+        'protected': False,
+        'verified': id % 13 == 0,
+        'profile_image_url': 'https://pbs.twimg.com/profile_images/{}/a.jpg'.format(id),
+        'url': '',
+        'public_metrics': {
+            'followers_count': id % 5000, 'following_count': id % 700,
+            'tweet_count': id % 20000, 'listed_count': id % 40
+        },
+    }
+
+
+def make_tweet(id, author_id, conversation_id=None, parent_id=None, url=None):
+    id = int(id)
+    tweet = {
+        'id': str(id),
+        'author_id': str(author_id),
+        'conversation_id': str(conversation_id or id),
+        'created_at': '2021-11-{:02d}T{:02d}:03:01.000Z'.format(1 + id % 28, id % 24),
+        'lang': ('es', 'en', 'pt')[id % 3],
+        'source': ('Twitter for iPhone', 'Twitter for Android', 'Twitter Web App')[id % 3],
+        'reply_settings': 'everyone',
+        'possibly_sensitive': False,
+        'text': 'synthetic tweet {} #tweetple'.format(id),
+        'public_metrics': {
+            'retweet_count': id % 7, 'reply_count': id % 3, 'like_count': id % 11, 'quote_count': id % 2
+        },
+        'entities': {'hashtags': [{'start': 20, 'end': 29, 'tag': 'tweetple'}]},
+    }
+
+    if parent_id is not None:
+        tweet['referenced_tweets'] = [{'type': 'replied_to', 'id': str(parent_id)}]
+        tweet['in_reply_to_user_id'] = str(author_id)
+
+    if url is not None:
+        tweet['entities']['urls'] = [{
+            'start': 0, 'end': 23, 'url': 'https://t.co/{}'.format(id % 10 ** 6),
+            'expanded_url': url, 'display_url': url[:20]
+        }]
+
+    return tweet
+
+
+class MockTwitterServer:
+
+    """Threaded HTTP server answering like the Twitter API v2
+
+    ...
+    Attributes
+    ----------
+    pages : int
+        pages every paginated collection has
+    latency : float
+        seconds every response is delayed by
+    limit : int or None
+        requests per endpoint and window before answering 429
+    window : float
+        seconds of a rate-limit window
+    stats : dict
+        endpoint -> requests, rows and bytes served, and 429s
+
+    Methods
+    -------
+    start()
+        Serves requests from a background thread
+    stop()
+        Shuts the server down
+    totals()
+        Requests, rows and bytes served across endpoints
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, pages=5, latency=0.0, limit=None, window=15 * 60):
+        self.pages = pages
+        self.latency = latency
+        self.limit = limit
+        self.window = window
+        self.stats = {}
+        self.windows = {}
+        self.lock = threading.Lock()
+
+        server = self
+
+        class Handler(MockHandler):
+            mock = server
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        """
+        Serve requests from a background thread
+        """
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+        return self
+
+    def stop(self):
+        """
+        Shut the server down
+        """
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def throttle(self, endpoint):
+        """Rate-limit headers of a request, and whether it is over the limit"""
+
+        if self.limit is None:
+            return {}, False
+
+        now = time.time()
+
+        with self.lock:
+            start, used = self.windows.get(endpoint, (now, 0))
+            if now >= start + self.window:
+                start, used = now, 0
+            used += 1
+            self.windows[endpoint] = (start, used)
+
+        headers = {
+            'x-rate-limit-limit': str(self.limit),
+            'x-rate-limit-remaining': str(max(self.limit - used, 0)),
+            'x-rate-limit-reset': str(int(start + self.window) + 1),
+        }
+
+        return headers, used > self.limit
+
+    def record(self, endpoint, rows, size, status):
+        with self.lock:
+            stats = self.stats.setdefault(endpoint, {'requests': 0, 'rows': 0, 'bytes': 0, 'throttled': 0})
+            stats['requests'] += 1
+            stats['rows'] += rows
+            stats['bytes'] += size
+            stats['throttled'] += status == 429
+
+    def totals(self):
+        """
+        Requests, rows and bytes served across endpoints, and 429s
+        """
+        with self.lock:
+            totals = {'requests': 0, 'rows': 0, 'bytes': 0, 'throttled': 0}
+            for stats in self.stats.values():
+                for key in totals:
+                    totals[key] += stats[key]
+
+        return totals
+
+    def page(self, page, next_token):
+        """meta of a page, pointing to the next one unless it is the last"""
+
+        meta = {}
+        if page + 1 < self.pages:
+            meta['next_token'] = next_token(page + 1)
+
+        return meta
+
+    def search(self, params):
+        query = params.get('query', '')
+        size = int(params.get('max_results', 100))
+        page = int(params.get('next_token', 0))
+        seed = _seed(query)
+        ids = [BASE_ID + seed * 10 ** 6 + page * size + i for i in range(size)]
+
+        handles = re.findall(r'from:(\w+)', query)
+        urls = re.findall(r'url:"([^"]+)"', query)
+        conversation = re.search(r'conversation_id:(\d+)', query)
+
+        users = {}
+        tweets = []
+
+        for n, id in enumerate(ids):
+            position = page * size + n
+            if conversation:
+                root = int(conversation.group(1))
+                # each reply answers the root or one of the replies before it
+                parent = root if position == 0 else BASE_ID + seed * 10 ** 6 + _seed(str(position)) % position
+                tweets.append(make_tweet(id, 1000 + position % 50, root, parent))
+            elif handles:
+                handle = handles[position % len(handles)]
+                author = 10 ** 6 + _seed(handle.lower())
+                users[author] = dict(make_user(author), username=handle)
+                tweets.append(make_tweet(id, author))
+            else:
+                url = urls[position % len(urls)] if urls else None
+                tweets.append(make_tweet(id, 1000 + position % 500, url=url))
+
+        body = {'data': tweets}
+        if users:
+            body['includes'] = {'users': list(users.values())}
+
+        body['meta'] = dict(self.page(page, str), result_count=len(tweets),
+                            newest_id=tweets[0]['id'], oldest_id=tweets[-1]['id'])
+
+        return body
+
+    def counts(self, params):
+        query = params.get('query', '')
+        step = timedelta(hours=1) if params.get('granularity') == 'hour' else timedelta(days=1)
+        parse = lambda value: datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S')
+        start = parse(params.get('start_time', '2021-01-01T00:00:00Z'))
+        end = parse(params.get('end_time', '2021-02-01T00:00:00Z'))
+        page = int(params.get('next_token', 0))
+
+        # 31 buckets a page, like the API's daily counts
+        edges = []
+        edge = start + step * 31 * page
+        while edge < end and len(edges) < 31:
+            edges.append(edge)
+            edge += step
+
+        buckets = []
+        for left in edges:
+            right = min(left + step, end)
+            seed = _seed(query + left.isoformat())
+            buckets.append({
+                'start': left.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                'end': right.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                'tweet_count': seed % 300 if seed % 4 == 0 else 0
+            })
+
+        meta = {'total_tweet_count': sum(bucket['tweet_count'] for bucket in buckets)}
+        if edges and edges[-1] + step < end:
+            meta['next_token'] = str(page + 1)
+
+        return {'data': buckets, 'meta': meta}
+
+    def users_page(self, params, seed):
+        size = int(params.get('max_results', 100))
+        page = int(params.get('pagination_token', 0))
+        ids = [10 ** 9 + seed % 10 ** 6 * 10 ** 4 + page * size + i for i in range(size)]
+
+        return {'data': [make_user(id) for id in ids],
+                'meta': dict(self.page(page, str), result_count=len(ids))}
+
+    def respond(self, path, params):
+        """Endpoint template and body of a request"""
+
+        if path == '/2/tweets/search/all':
+            return path, self.search(params)
+
+        if path == '/2/tweets/counts/all':
+            return path, self.counts(params)
+
+        if path == '/2/tweets':
+            ids = params.get('ids', '').split(',')
+            return path, {'data': [make_tweet(id, 1000 + int(id) % 500) for id in ids if id]}
+
+        if path == '/2/users':
+            ids = params.get('ids', '').split(',')
+            return path, {'data': [make_user(id) for id in ids if id]}
+
+        match = re.fullmatch(r'/2/users/(\d+)/followers', path)
+        if match:
+            return '/2/users/:id/followers', self.users_page(params, int(match.group(1)))
+
+        match = re.fullmatch(r'/2/tweets/(\d+)/(liking_users|retweeted_by)', path)
+        if match:
+            return '/2/tweets/:id/' + match.group(2), self.users_page(params, _seed(path))
+
+        return None, None
+
+
+class MockHandler(BaseHTTPRequestHandler):
+
+    mock = None
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        endpoint, body = self.mock.respond(parsed.path.rstrip('/'), params)
+
+        if endpoint is None:
+            return self.reply(404, {'title': 'Not Found Error'}, {}, parsed.path)
+
+        headers, throttled = self.mock.throttle(endpoint)
+
+        if self.mock.latency:
+            time.sleep(self.mock.latency)
+
+        if throttled:
+            return self.reply(429, {'title': 'Too Many Requests'}, headers, endpoint)
+
+        self.reply(200, body, headers, endpoint, len(body.get('data', [])))
+
+    def reply(self, status, body, headers, endpoint, rows=0):
+        content = json.dumps(body).encode('utf-8')
+        self.mock.record(endpoint, rows, len(content), status)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--pages', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--limit', type=int, default=None, help='requests per endpoint and window')
+    parser.add_argument('--window', type=float, default=15 * 60, help='seconds of a rate-limit window')
+    args = parser.parse_args()
+
+    server = MockTwitterServer(port=args.port, pages=args.pages, latency=args.latency,
+                               limit=args.limit, window=args.window)
+    print('Serving on {}'.format(server.url))
+
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
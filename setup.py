@@ -46,6 +46,10 @@ setup(
         'validators==0.18.2',
         'wheel==0.37.0'
     ],
+    extras_require={
+        # faster decoding of responses, used when installed
+        'fast': ['orjson>=3.6.5']
+    },
     url='https://github.com/dapivei/tweetple',
     zip_safe=False
 )
@@ -5,8 +5,16 @@
 # ============================================================================
 import math
 import pandas as pd
+import pyarrow.dataset as ds
 
-from functools import reduce
+from pandas import json_normalize
+from .DecodeTweetPle import RawPage, decode_pages, read_json, read_meta, records_to_table, add_constants, drop_duplicates
+from .RetryTweetPle import check_page
+from .SchemaTweetPle import TWEET_SCHEMA, USER_SCHEMA, blank_frame, conform, to_table
+from .MetricsTweetPle import timed
+
+# Expansions returned in `includes` and the field identifying their objects
+INCLUDES = {'users': 'id', 'tweets': 'id', 'media': 'media_key', 'places': 'id'}
 
 
 def twitter_df(column_link):
@@ -14,7 +22,7 @@ def twitter_df(column_link):
     Creates blank dataframe of stats associated to a link/tweet/conversation_id shared through
     Twitter's api.
     """
-    df_stats = pd.DataFrame(
+    df_stats = blank_frame(
         columns=['author_id', 'created_at',
                  'entities.annotations', 'entities.hashtags',
                  'entities.mentions', 'entities.urls', 'id', 'lang',
@@ -23,10 +31,421 @@ def twitter_df(column_link):
                  'public_metrics.retweet_count', 'conversation_id',
                  'referenced_tweets', 'reply_settings',
                  'source', 'text', column_link,
-                 'date_consulted'])
+                 'date_consulted'],
+        schema=TWEET_SCHEMA)
     return df_stats
 
 
+class PageBuffer:
+
+    """Accumulates the records of paginated responses
+
+    Pages are appended to a plain list of records, an O(1) operation, and the
+    dataframe is built once when `frame()` is called. Growing a dataframe page
+    by page copies it on every page, which is O(pages^2).
+
+    Given a sink, the buffer hands it a dataframe every `sink.flush_pages`
+    pages and forgets those records, so memory stays bounded by the flush
+    size instead of growing with the account. Given a checkpoint store too,
+    every flush records the token of the next page, so an interrupted job
+    resumes after the last page written.
+
+    The `includes` expansions of each page (users, referenced tweets, media,
+    places) are kept once per object; given `side_sinks`, they are written
+    as side tables next to the records on every flush.
+
+    Pages handed over as responses (`read()`) are parsed on the sink's
+    pipeline when it has one: the fetching thread only reads their `meta`.
+
+    Given a `layout` (`DecodeTweetPle.TWEET` or `USER`), records are decoded
+    straight into Arrow against it and the buffer materializes
+    `pyarrow.Table`s instead of dataframes. Given a `schema`, frames and
+    tables are conformed to its types.
+
+    ...
+    Attributes
+    ----------
+    records : list
+        records added since the last flush
+    pages : int
+        number of pages added
+    normalize : Boolean
+        flatten nested fields (e.g. `public_metrics.like_count`)
+        Defaults to True
+    sink : ParquetSink or None
+        where flushed pages are written
+    columns : dict
+        constant columns added to every frame, e.g. the handle searched
+    unique : str or None
+        column rows are deduplicated on
+    rows : int
+        rows written to the sink
+    checkpoint : CheckpointStore or None
+        journal progress is recorded in after every flush
+    job : str
+        key of the job in the checkpoint store
+    token : str or None
+        pagination token of the page following the last one added
+    included : dict
+        records of the requested `includes` expansions (e.g. 'users'),
+        keyed by expansion, each object once
+    side_sinks : dict
+        expansion -> ParquetSink its side table is written to
+    layout : pyarrow.StructType or None
+        layout records are decoded against into Arrow tables
+    schema : pyarrow.Schema or None
+        typed schema frames are conformed to, e.g. `TWEET_SCHEMA`
+
+    Methods
+    -------
+    add()
+        Adds the records of a page
+    read()
+        Adds the page of a response
+    frame()
+        Materializes the buffered records into a dataframe or table
+    side_frame()
+        Materializes the objects of an expansion into a dataframe
+    flush()
+        Writes the buffered records to the sink
+    wait()
+        Waits for the batches queued on the sink's pipeline
+    finish()
+        Returns the dataframe, or flushes what is left to the sink
+    """
+
+    def __init__(self, normalize=True, sink=None, columns=None, unique=None, checkpoint=None, job=None, state=None, includes=(), side_sinks=None, layout=None, schema=None):
+        self.records = []
+        self.pages = state['pages'] if state else 0
+        self.normalize = normalize
+        self.sink = sink
+        self.columns = dict(columns or {})
+        self.unique = unique
+        self.rows = state['rows'] if state else 0
+        self.checkpoint = checkpoint if sink is not None else None
+        self.job = job
+        self.token = None
+        self.layout = layout
+        self.schema = schema
+        self.side_sinks = dict(side_sinks or {}) if sink is not None else {}
+        self.included = {key: [] for key in list(includes) + list(self.side_sinks)}
+        self._seen = {key: set() for key in self.included}
+        self._pending = 0
+        self._writes = []
+        self._failed = False
+
+    def __len__(self):
+        return len(self.records)
+
+    def add(self, records, token=None, includes=None):
+        """
+        Add the records of a page, the token of the page following it and
+        the page's `includes` expansions
+        """
+        self.records.extend(records)
+        self.token = token
+
+        for key, included in self.included.items():
+            field, seen = INCLUDES.get(key, 'id'), self._seen[key]
+            for record in (includes or {}).get(key, []):
+                if record.get(field) not in seen:
+                    seen.add(record.get(field))
+                    included.append(record)
+
+        self.pages += 1
+        self._pending += 1
+
+        if self.sink is not None and self._pending >= self.sink.flush_pages:
+            self.flush()
+
+    def read(self, response):
+        """
+        Add the page of response, returning the part of it pagination needs
+
+        With a pipeline, and no expansions to keep, the body is parsed with
+        the rest of its batch on the pipeline's threads and only its `meta`
+        is read here; bodies whose `meta` cannot be read on its own are
+        parsed here whole.
+        """
+        meta = None
+
+        if getattr(self.sink, 'pipeline', None) is not None and not self.included:
+            check_page(response)
+            meta = read_meta(response.content)
+
+        if meta is None:
+            page = check_page(response, read_json(response))
+            self.add(page.get('data', []), page.get('meta', {}).get('next_token'), page.get('includes'))
+            return page
+
+        self.add([RawPage(response)], meta.get('next_token'))
+
+        return {'meta': meta}
+
+    def frame(self, records=None):
+        """
+        Materialize the buffered records (or the given ones) into a dataframe
+        with sorted columns, or into a table with the columns of `layout`
+        """
+        with timed('normalize'):
+            return self._frame(self.records if records is None else records)
+
+    def _frame(self, records):
+        if self.layout is not None:
+            table = add_constants(records_to_table(records, self.layout), self.columns)
+            if self.schema is not None:
+                table = to_table(table, self.schema)
+            if self.unique is not None:
+                table = drop_duplicates(table, self.unique)
+            return table
+
+        if self.normalize:
+            df = json_normalize(records)
+        else:
+            df = pd.DataFrame(records)
+
+        df = df.sort_index(axis=1)
+
+        for name, value in self.columns.items():
+            df[name] = value
+
+        if self.schema is not None:
+            df = conform(df, self.schema)
+
+        if self.unique is not None and self.unique in df.columns:
+            df = df.drop_duplicates(subset=self.unique).reset_index(drop=True)
+
+        return df
+
+    def side_frame(self, key, objects=None):
+        """
+        Materialize the objects of expansion `key` (or the given ones) into a
+        dataframe
+        """
+        with timed('normalize'):
+            return json_normalize(self.included[key] if objects is None else objects).sort_index(axis=1)
+
+    def flush(self):
+        """
+        Write the buffered records, and their side tables, to the sinks
+
+        When the sink has a pipeline, the batch is normalized and written on
+        its threads and this returns as soon as the batch is queued.
+        """
+        records, token, pages = self.records, self.token, self.pages
+        included = {key: self.included[key] for key in self.side_sinks if self.included[key]}
+
+        self.records = []
+        self._pending = 0
+        for key in included:
+            self.included[key] = []
+
+        def normalize():
+            try:
+                decoded = decode_pages(records)
+                frame = self.frame(decoded) if decoded else None
+                return frame, {key: self.side_frame(key, objects) for key, objects in included.items()}
+            except BaseException:
+                self._failed = True
+                raise
+
+        def write(frames):
+            # batches are written in order: once one failed, saving a later
+            # checkpoint would make a rerun resume past the lost pages
+            if self._failed:
+                return
+            try:
+                frame, side_frames = frames
+                if frame is not None:
+                    self.rows += self.sink.write(frame)
+                for key, side_frame in side_frames.items():
+                    self.side_sinks[key].write(side_frame)
+                if self.checkpoint is not None:
+                    # without a next token the last page is on disk: the job is over
+                    self.checkpoint.save(self.job, token, pages, self.rows, done=token is None)
+            except BaseException:
+                self._failed = True
+                raise
+
+        pipeline = getattr(self.sink, 'pipeline', None)
+
+        if pipeline is None:
+            write(normalize())
+            return
+
+        self._writes.append(pipeline.submit(normalize, write))
+        self.wait(block=False)
+
+    def wait(self, block=True):
+        """
+        Wait for the batches queued on the pipeline to be written, raising
+        the error of a batch that failed; with block=False only finished
+        batches are checked
+        """
+        pending = []
+
+        for write in self._writes:
+            if block or write.done():
+                write.result()
+            else:
+                pending.append(write)
+
+        self._writes = pending
+
+    def finish(self):
+        """
+        Dataframe (or table) of every record added, or, with a sink, flush
+        what is left and return the number of rows written
+        """
+        if self.sink is None:
+            return self.frame()
+
+        self.flush()
+        self.wait()
+
+        if self.checkpoint is not None:
+            self.checkpoint.finish(self.job, self.pages, self.rows)
+
+        return self.rows
+
+
+def concat_frames(frames, blank=None):
+    """Concatenates dataframes in one pass, on top of an optional blank frame"""
+
+    frames = [frame for frame in frames if frame is not None]
+
+    if blank is not None:
+        frames = [blank] + frames
+
+    if not frames:
+        return pd.DataFrame()
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def split_time_range(start_time, end_time, windows):
+    """Splits start_time..end_time into `windows` consecutive time windows
+
+    Parameters
+    ----------
+    start_time : str
+        start of the range, e.g. `2006-03-26T00:00:00Z`
+    end_time : str
+        end of the range
+    windows : int
+        number of windows of equal length
+
+    Returns
+    -------
+    bounds : list
+        (start_time, end_time) of each window, formatted for the API
+    """
+    start = pd.Timestamp(start_time)
+    end = pd.Timestamp(end_time)
+    step = (end - start) / max(int(windows), 1)
+    edges = [start + step * i for i in range(int(windows))] + [end]
+    edges = [edge.strftime('%Y-%m-%dT%H:%M:%SZ') for edge in edges]
+
+    return [(left, right) for left, right in zip(edges, edges[1:]) if left < right]
+
+
+def pack_queries(items, operator, max_length=1024):
+    """Packs items into as few OR queries as fit the query-length limit
+
+    Parameters
+    ----------
+    items : list
+        handles, links...
+    operator : str
+        clause of a single item, e.g. `from:{}` or `url:"{}"`
+    max_length : int
+        maximum length of a query
+        Defaults to 1024, the limit of the Academic Research track
+
+    Returns
+    -------
+    packs : list
+        (query, items) of each packed query
+    """
+    packs = []
+    members = []
+
+    for item in items:
+        if members and len(or_query(members + [item], operator)) > max_length:
+            packs.append((or_query(members, operator), members))
+            members = []
+        members.append(item)
+
+    if members:
+        packs.append((or_query(members, operator), members))
+
+    return packs
+
+
+def or_query(items, operator):
+    """Query matching any of items, e.g. `(from:a OR from:b)`"""
+
+    return '(' + ' OR '.join(operator.format(item) for item in items) + ')'
+
+
+def normalize_link(url):
+    """Lowercased link without scheme, `www.` or trailing slash, for matching"""
+
+    url = str(url).strip().lower()
+
+    for prefix in ('https://', 'http://'):
+        if url.startswith(prefix):
+            url = url[len(prefix):]
+
+    if url.startswith('www.'):
+        url = url[len('www.'):]
+
+    return url.rstrip('/')
+
+
+def match_links(entities_urls, links):
+    """Links among `links` a tweet's `entities.urls` point to
+
+    Parameters
+    ----------
+    entities_urls : list
+        the tweet's `entities.urls`
+    links : dict
+        normalized link -> link as searched
+
+    Returns
+    -------
+    matched : list
+        links as searched
+    """
+    if not isinstance(entities_urls, (list, tuple)) and not hasattr(entities_urls, 'tolist'):
+        return []
+
+    candidates = []
+
+    for entity in entities_urls:
+        if isinstance(entity, dict):
+            for key in ('expanded_url', 'unwound_url', 'url', 'display_url'):
+                if entity.get(key):
+                    candidates.append(normalize_link(entity[key]))
+
+    return [
+        link for normalized, link in links.items()
+        if any(_within(candidate, normalized) for candidate in candidates)
+    ]
+
+
+def _within(candidate, normalized):
+    """Whether candidate is normalized, or a page under it: the prefix must
+    end at a path, query or fragment boundary, so `/article/1` does not
+    match `/article/10`"""
+
+    if not candidate.startswith(normalized):
+        return False
+
+    return len(candidate) == len(normalized) or candidate[len(normalized)] in '/?#'
+
+
 def roundup(x):
     """Rounds up to the next nearest 100"""
 
@@ -38,15 +457,16 @@ def df_tweets_stats():
     Creates blank dataframe of stats associated to a **LIST OF TWEETS** shared through
     Twitter's api.
     """
-    df_stats = pd.DataFrame(
+    df_stats = blank_frame(
         columns=['created_at', 'possibly_sensitive', 'id', 'reply_settings',
-                 'conversation_id', 'lang', 'text', 'conversation_id',
+                 'conversation_id', 'lang', 'text',
                  'source', 'author_id', 'public_metrics.retweet_count',
                  'public_metrics.reply_count', 'public_metrics.like_count',
                  'public_metrics.quote_count', 'in_reply_to_user_id',
                  'referenced_tweets', 'entities.mentions', 'entities.hashtags',
                  'entities.annotations', 'entities.urls', 'attachments.media_keys',
-                 'date_consulted']
+                 'date_consulted'],
+        schema=TWEET_SCHEMA
     )
     return df_stats
 
@@ -56,52 +476,125 @@ def df_users_stats():
     Creates blank dataframe of stats associated to a **LIST OF TWEETS** shared through
     Twitter's api.
     """
-    df_stats = pd.DataFrame(
+    df_stats = blank_frame(
         columns=['location', 'profile_image_url', 'protected', 'username', 'id',
                  'verified', 'description', 'created_at', 'name', 'url',
                  'public_metrics.followers_count', 'public_metrics.following_count',
                  'public_metrics.tweet_count', 'public_metrics.listed_count',
                  'pinned_tweet_id', 'entities.url.urls', 'entities.description.mentions',
-                 'entities.description.urls', 'entities.description.hashtags']
+                 'entities.description.urls', 'entities.description.hashtags'],
+        schema=USER_SCHEMA
     )
 
     return df_stats
 
 
-def aggregate_twitter_metrics(df, column):
+def aggregate_twitter_metrics(data, column, batch_size=1000000):
     """Computes aggregated Twitter metrics from disaggregated metrics
 
+    The tweets are scanned in batches of `batch_size` rows and only partial
+    aggregates are kept between batches (one row per link, plus the distinct
+    authors and consultations of each link), so the output of
+    `TweetStreamer.streamer_links`, or of many of its runs, is aggregated in
+    bounded memory.
+
     Parameters
     ----------
-    df : dataframe
-        Dataframe with disaggregated metrics
+    data : dataframe, str or list
+        Dataframe with disaggregated metrics, or Parquet file(s) or
+        directories holding them
     column : str
         Column with links searched
+    batch_size : int
+        Rows read from Parquet at a time
 
     Returns
     -------
     engagements : dataframe
-        Dataframe with aggregated engagement metrics
+        Dataframe with aggregated engagement metrics: whether the link was
+        shared, the sum of each metric, the number of distinct users sharing
+        it, the total interactions and the number of successful calls
     """
+    if isinstance(data, pd.DataFrame):
+        batches = [data]
+    else:
+        batches = scan_parquet(data, batch_size)
 
-    df['shared'] = df['id'].notna().astype(int)
-    shared_twitter = df[[column, 'shared']].drop_duplicates()
-    metrics_columns = [col for col in df.columns if 'public_metrics' in col]
-    df[metrics_columns] = df[metrics_columns].fillna(value=0)
-    metrics = df.groupby(column).sum().reset_index().drop(columns='shared')
-    num_users = df[df.shared == 1].groupby([column]).count().reset_index()
-    num_users = num_users.rename(columns={'author_id': 'num_users'})
-    engagements = reduce(
-        lambda left, right: pd.merge(left, right, on=column, how='left'),
-        [shared_twitter, metrics, num_users[[column, 'num_users']]]
-    )
-    engagements["total_interactions"] = engagements[
-        [x for x in engagements.columns if 'public_metrics' in x]
-    ].sum(axis="columns")
-    engagements.columns = engagements.columns.str.replace(
-        'public_metrics.', '')
-    engagements['n_calls'] = df['response']/200
-    cols = [str(col) + '_twitter' for col in engagements.columns if col != column]
-    engagements.columns = [column] + cols
-
-    return engagements.fillna(0)
+    sums, users, calls = None, None, None
+
+    for df in batches:
+        found = df['id'].notna()
+        metrics_columns = [col for col in df.columns if col.startswith('public_metrics.')]
+
+        partial = df[[column] + metrics_columns].copy()
+        partial[metrics_columns] = partial[metrics_columns].fillna(value=0).astype('int64')
+        partial['shared'] = found.astype('int64')
+        partial = partial.groupby(column, sort=False, observed=True).agg(
+            {**{col: 'sum' for col in metrics_columns}, 'shared': 'max'})
+        sums = _combine(sums, partial)
+
+        users = _distinct(users, df.loc[found, [column, 'author_id']])
+        if 'response' in df.columns:
+            consulted = df['date_consulted'] if 'date_consulted' in df.columns else 0
+            calls = _distinct(calls, pd.DataFrame({
+                column: df[column], 'consulted': consulted
+            }).loc[(df['response'] == 200).fillna(False).to_numpy()])
+
+    if sums is None:
+        return pd.DataFrame(columns=[column])
+
+    metrics_columns = [col for col in sums.columns if col != 'shared']
+    engagements = sums[['shared'] + sorted(metrics_columns)].fillna(0).astype('int64')
+    engagements['num_users'] = _count(users, column, engagements.index)
+    engagements['total_interactions'] = engagements[metrics_columns].sum(axis='columns')
+    engagements['n_calls'] = _count(calls, column, engagements.index)
+
+    engagements.columns = engagements.columns.str.replace('public_metrics.', '', regex=False)
+    engagements.columns = [str(col) + '_twitter' for col in engagements.columns]
+
+    return engagements.rename_axis(column).reset_index()
+
+
+def scan_parquet(paths, batch_size=1000000, columns=None):
+    """Dataframes of `batch_size` rows read from Parquet file(s) or directories"""
+
+    dataset = ds.dataset(paths, format='parquet')
+
+    if columns is not None:
+        columns = [col for col in columns if col in dataset.schema.names]
+
+    for batch in dataset.to_batches(columns=columns, batch_size=batch_size):
+        yield batch.to_pandas()
+
+
+def _combine(sums, partial):
+    """Sums (and max of `shared`) of two partial aggregates indexed by link"""
+
+    if sums is None:
+        return partial
+
+    combined = pd.concat([sums, partial]).fillna(0)
+    how = {col: 'max' if col == 'shared' else 'sum' for col in combined.columns}
+
+    return combined.groupby(level=0, sort=False).agg(how)
+
+
+def _distinct(seen, pairs):
+    """Distinct (link, value) pairs seen so far"""
+
+    pairs = pairs.dropna().drop_duplicates()
+    pairs.columns = ['link', 'value']
+
+    if seen is not None:
+        pairs = pd.concat([seen, pairs], ignore_index=True).drop_duplicates()
+
+    return pairs
+
+
+def _count(pairs, column, links):
+    """Number of distinct values of each link, aligned on links"""
+
+    if pairs is None:
+        return 0
+
+    return pairs.groupby('link', observed=True).size().reindex(links, fill_value=0).astype('int64').to_numpy()
@@ -0,0 +1,199 @@
+# ============================================================================
+
+# On-disk cache of tweet and user lookups
+
+# ============================================================================
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class ResponseCache:
+
+    """Content-addressed on-disk cache of looked-up objects
+
+    Every tweet or user returned by a lookup is stored in its own file, named
+    after the hash of the endpoint, the object's id and the fields requested.
+    Entries older than `ttl` seconds are treated as missing, and when the
+    cache outgrows `max_bytes` the least recently read entries are evicted.
+
+    ...
+    Attributes
+    ----------
+    path : str
+        directory holding the cache
+    ttl : float
+        seconds an entry stays fresh
+    max_bytes : int
+        size the cache is trimmed back to
+    size : int
+        bytes currently used
+
+    Methods
+    -------
+    key()
+        File name of an entry
+    get()
+        Fresh cached object, or None
+    put()
+        Stores an object
+    partition()
+        Splits ids into those missing from the cache and those in it
+    evict()
+        Removes least recently read entries until the cache fits
+    """
+
+    def __init__(self, path='.tweetple_cache', ttl=24 * 3600, max_bytes=1024 ** 3):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self.size = sum(os.path.getsize(entry) for entry, _ in self._entries())
+
+    def key(self, endpoint, id, fields):
+        """
+        File name of an entry: hash of endpoint, id and requested fields
+        """
+        content = json.dumps([endpoint, str(id), sorted((fields or {}).items())])
+
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], key + '.json')
+
+    def get(self, endpoint, id, fields=None):
+        """
+        Fresh cached object, None when missing or expired
+        """
+        entry = self._file(self.key(endpoint, id, fields))
+
+        try:
+            stored = os.path.getmtime(entry)
+            if time.time() - stored > self.ttl:
+                return None
+            with open(entry, encoding='utf-8') as f:
+                record = json.load(f)
+            # the access time orders entries for eviction
+            os.utime(entry, (time.time(), stored))
+        except (OSError, ValueError):
+            return None
+
+        return record
+
+    def put(self, endpoint, id, fields, record):
+        """
+        Store an object
+        """
+        entry = self._file(self.key(endpoint, id, fields))
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp = '{}.{}.tmp'.format(entry, threading.get_ident())
+
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(record, f)
+
+        previous = os.path.getsize(entry) if os.path.exists(entry) else 0
+        os.replace(tmp, entry)
+
+        with self.lock:
+            self.size += os.path.getsize(entry) - previous
+            full = self.size > self.max_bytes
+
+        if full:
+            self.evict()
+
+    def partition(self, endpoint, ids, fields=None):
+        """
+        Split ids into those missing from the cache and those fresh in it
+        """
+        missing, cached = [], []
+
+        for id in ids:
+            entry = self._file(self.key(endpoint, id, fields))
+            try:
+                fresh = time.time() - os.path.getmtime(entry) <= self.ttl
+            except OSError:
+                fresh = False
+            (cached if fresh else missing).append(id)
+
+        return missing, cached
+
+    def evict(self):
+        """
+        Remove least recently read entries until the cache is back under
+        90% of `max_bytes`
+        """
+        with self.lock:
+            entries = sorted(self._entries(), key=lambda item: item[1])
+            target = 0.9 * self.max_bytes
+            for entry, _ in entries:
+                if self.size <= target:
+                    break
+                try:
+                    size = os.path.getsize(entry)
+                    os.remove(entry)
+                except OSError:
+                    continue
+                self.size -= size
+
+    def _entries(self):
+        """(file, last access) of every entry"""
+
+        for directory, _, names in os.walk(self.path):
+            for name in names:
+                if name.endswith('.json'):
+                    entry = os.path.join(directory, name)
+                    try:
+                        yield entry, os.stat(entry).st_atime
+                    except OSError:
+                        continue
+
+
+def open_cache(cache):
+    """ResponseCache from a cache or a directory, None when caching is off"""
+
+    if cache is None or isinstance(cache, ResponseCache):
+        return cache
+
+    return ResponseCache(cache)
+
+
+def cached_lookup(cache, endpoint, ids, fields, fetch):
+    """Looks up objects by id, serving fresh ones from the cache
+
+    Parameters
+    ----------
+    cache : ResponseCache
+        cache read from and written to
+    endpoint : str
+        endpoint the objects come from, e.g. `/2/tweets`
+    ids : list
+        ids looked up
+    fields : dict
+        fields requested, part of the cache key
+    fetch : callable
+        called with the ids missing from the cache, returns the API's json
+
+    Returns
+    -------
+    records : list
+        objects found, in the order of ids
+    """
+    records = {}
+    missing = []
+
+    for id in ids:
+        record = cache.get(endpoint, id, fields)
+        if record is None:
+            missing.append(id)
+        else:
+            records[str(id)] = record
+
+    if missing:
+        for record in fetch(missing).get('data', []):
+            cache.put(endpoint, record['id'], fields, record)
+            records[str(record['id'])] = record
+
+    return [records[str(id)] for id in ids if str(id) in records]
@@ -0,0 +1,197 @@
+# ============================================================================
+
+# Durable pagination checkpoints for long crawls
+
+# ============================================================================
+import sqlite3
+import threading
+import time
+
+
+class CheckpointStore:
+
+    """SQLite journal of pagination progress
+
+    For every job (a handle, an account's followers, a conversation...) the
+    store keeps the pagination token of the first page not yet written to
+    disk, along with the pages and rows written so far. A rerun starts from
+    that token instead of page one.
+
+    For incremental collections it also keeps, per handle or conversation,
+    the newest tweet id already collected, so the next run only asks for
+    tweets posted after it (`since_id`).
+
+    ...
+    Attributes
+    ----------
+    path : str
+        SQLite file holding the journal
+
+    Methods
+    -------
+    get()
+        Saved state of a job
+    save()
+        Records the progress of a job
+    finish()
+        Marks a job as completed
+    reset()
+        Forgets a job
+    since()
+        Newest tweet id collected for a handle or conversation
+    hold()
+        Notes the newest tweet id of a collection still running
+    advance()
+        Moves the since id forward once that collection is complete
+    """
+
+    def __init__(self, path='tweetple_checkpoints.sqlite'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS checkpoints (
+                    job TEXT PRIMARY KEY,
+                    token TEXT,
+                    pages INTEGER NOT NULL DEFAULT 0,
+                    rows INTEGER NOT NULL DEFAULT 0,
+                    done INTEGER NOT NULL DEFAULT 0,
+                    updated REAL
+                )"""
+            )
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS since_ids (
+                    key TEXT PRIMARY KEY,
+                    since_id TEXT,
+                    pending TEXT,
+                    updated REAL
+                )"""
+            )
+
+    def get(self, job):
+        """
+        Saved state of a job as a dict, None if it never wrote anything
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT token, pages, rows, done FROM checkpoints WHERE job = ?", (job,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        return {'token': row[0], 'pages': row[1], 'rows': row[2], 'done': bool(row[3])}
+
+    def save(self, job, token, pages, rows, done=False):
+        """
+        Record that every page before `token` of job is on disk
+        """
+        with self.lock, self.connection:
+            self.connection.execute(
+                """INSERT INTO checkpoints (job, token, pages, rows, done, updated)
+                   VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(job) DO UPDATE SET
+                   token = excluded.token, pages = excluded.pages, rows = excluded.rows,
+                   done = excluded.done, updated = excluded.updated""",
+                (job, token, pages, rows, int(done), time.time())
+            )
+
+    def finish(self, job, pages, rows):
+        """
+        Mark job as completed
+        """
+        self.save(job, None, pages, rows, done=True)
+
+    def reset(self, job):
+        """
+        Forget job, so the next run starts it from page one
+        """
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM checkpoints WHERE job = ?", (job,))
+
+    def since(self, key):
+        """
+        Newest tweet id collected for key, None if it was never collected
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT since_id FROM since_ids WHERE key = ?", (key,)
+            ).fetchone()
+
+        return row[0] if row else None
+
+    def hold(self, key, newest_id):
+        """
+        Note the newest tweet id seen by a collection of key still running;
+        it only becomes the since id once the collection is complete
+        """
+        if newest_id is None:
+            return
+
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT since_id, pending FROM since_ids WHERE key = ?", (key,)
+            ).fetchone()
+            since_id, pending = row if row else (None, None)
+            self.connection.execute(
+                """INSERT OR REPLACE INTO since_ids (key, since_id, pending, updated)
+                   VALUES (?, ?, ?, ?)""",
+                (key, since_id, _newest(pending, newest_id), time.time())
+            )
+
+    def advance(self, key):
+        """
+        Move the since id of key up to the newest tweet id held
+        """
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT since_id, pending FROM since_ids WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] is None:
+                return
+            self.connection.execute(
+                "UPDATE since_ids SET since_id = ?, pending = NULL, updated = ? WHERE key = ?",
+                (_newest(row[0], row[1]), time.time(), key)
+            )
+
+    def close(self):
+        self.connection.close()
+
+
+def open_checkpoint(checkpoint):
+    """CheckpointStore from a store or a path, None when checkpointing is off"""
+
+    if checkpoint is None or isinstance(checkpoint, CheckpointStore):
+        return checkpoint
+
+    return CheckpointStore(checkpoint)
+
+
+def resume(checkpoint, job, sink, append=False, side_sinks=None):
+    """Saved state of job, clearing the partial output of a job that has none
+
+    Checkpoints only make sense when pages are streamed to a sink: the state
+    is returned only then. A job with no saved state starts over, so output
+    left at the sink (and at the sinks of its side tables) by an earlier run
+    is dropped first, unless the job only `append`s to it (an incremental
+    collection).
+    """
+    if checkpoint is None or sink is None:
+        return None
+
+    state = checkpoint.get(job)
+
+    if state is None and not append:
+        for output in [sink] + list((side_sinks or {}).values()):
+            output.reset()
+
+    return state
+
+
+def _newest(*ids):
+    """Largest of several tweet ids, compared as integers"""
+
+    ids = [id for id in ids if id is not None]
+
+    return str(max(ids, key=int)) if ids else None
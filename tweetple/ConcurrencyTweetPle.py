@@ -0,0 +1,67 @@
+# ============================================================================
+
+# Thread pool running collectors with bounded concurrency
+
+# ============================================================================
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tqdm import tqdm
+
+
+def gather_bounded(func, items, concurrency=8, on_error=None, progress=True):
+    """Runs `func` over `items` with at most `concurrency` calls in flight
+
+    Collectors are blocking, so each call runs on one of `concurrency` worker
+    threads; the pool's size is the bound. Whatever `func` does with its
+    result (e.g. writing it to disk) happens as soon as that item finishes.
+
+    Parameters
+    ----------
+    func : callable
+        function called with each item
+    items : list
+        handles, links, tweet ids or conversation ids
+    concurrency : int
+        maximum number of items processed at once
+    on_error : callable
+        called as `on_error(item)` from within the exception handler when
+        `func` fails; when None the exception propagates
+    progress : Boolean
+        show a progress bar
+
+    Returns
+    -------
+    results : list
+        result of `func` for each item, in input order, None for failures
+    """
+    results = [None] * len(items)
+
+    def work(item):
+        try:
+            return func(item)
+        except Exception:
+            if on_error is None:
+                raise
+            on_error(item)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor, \
+            tqdm(total=len(items), disable=not progress) as bar:
+        futures = {executor.submit(work, item): index for index, item in enumerate(items)}
+        try:
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                bar.update(1)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    return results
+
+
+def run_concurrently(func, items, concurrency=8, on_error=None, progress=True):
+    """Blocking entry point to `gather_bounded`, taking any iterable of items
+
+    It only starts threads, so it runs the same from plain scripts and from
+    notebooks, where an event loop is already running.
+    """
+    return gather_bounded(func, list(items), max(int(concurrency), 1), on_error, progress)
@@ -0,0 +1,362 @@
+# ============================================================================
+
+# Hive-partitioned dataset output, compaction and id index
+
+# ============================================================================
+import argparse
+import os
+import re
+import shutil
+import time
+
+from datetime import date
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from .SinkTweetPle import part_files
+
+PARTITIONING = ds.partitioning(pa.schema([('kind', pa.string()), ('date', pa.string())]), flavor='hive')
+
+INDEXED = ('id', 'author_id', 'conversation_id')
+
+INDEX = '_index.parquet'
+
+
+class TweetDataset:
+
+    """Collections stored as one dataset, partitioned by kind and date
+
+    Every handle, account, tweet or conversation collected goes to its own
+    `ParquetSink` directory, under the kind of collection and the day it was
+    collected:
+
+        root/kind=handles/date=2022-01-31/zorroyanez.parquet/part-00000.parquet
+        root/kind=followers/date=2022-01-31/783214.parquet/part-00000.parquet
+
+    `compact()` merges the directories of each kind and day into a few large
+    files sorted by id, with large row groups, and records which row groups
+    hold each tweet id, author_id and conversation_id in a sidecar index
+    (`root/_index.parquet`). Point lookups then read only the row groups
+    they need, and scans filtered on kind and date only the matching
+    partitions.
+
+    ...
+    Attributes
+    ----------
+    root : str
+        directory holding the dataset
+
+    Methods
+    -------
+    path()
+        Output directory of a collection
+    dataset()
+        The whole dataset, or some kinds and days of it, as a pyarrow dataset
+    scan()
+        Rows of some kinds and days
+    compact()
+        Merges the outputs of each kind and day into large sorted files
+    index()
+        Sidecar index of ids to files and row groups
+    lookup()
+        Rows holding some ids, reading only their row groups
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, kind, key, day=None):
+        """
+        Output directory of the collection of key (a handle, account, tweet
+        or conversation id) of a kind, collected on day (defaults to today)
+        """
+        key = re.sub(r'[^\w@.-]', '_', str(key))
+
+        return os.path.join(
+            self.root, 'kind={}'.format(kind), 'date={}'.format(day or date.today().isoformat()), key + '.parquet'
+        )
+
+    def partitions(self, kinds=None, start=None, end=None):
+        """(kind, date) directories of the dataset, filtered on kind and date"""
+
+        found = []
+
+        for kind_dir in sorted(os.listdir(self.root)):
+            if not kind_dir.startswith('kind='):
+                continue
+            kind = kind_dir[len('kind='):]
+            if kinds is not None and kind not in kinds:
+                continue
+            for date_dir in sorted(os.listdir(os.path.join(self.root, kind_dir))):
+                day = date_dir[len('date='):]
+                if not date_dir.startswith('date=') or (start and day < start) or (end and day > end):
+                    continue
+                found.append((kind, day, os.path.join(self.root, kind_dir, date_dir)))
+
+        return found
+
+    def files(self, kinds=None, start=None, end=None):
+        """Parquet files of the dataset, filtered on kind and date"""
+
+        files = []
+
+        for _, _, directory in self.partitions(kinds, start, end):
+            for name in sorted(os.listdir(directory)):
+                path = os.path.join(directory, name)
+                files.extend(part_files(path) if os.path.isdir(path) else [path] if _compacted(name) else [])
+
+        return files
+
+    def dataset(self, kinds=None, start=None, end=None):
+        """
+        The dataset, or the kinds and days between start and end
+        (`YYYY-MM-DD`, inclusive), with `kind` and `date` columns
+        """
+        files = self.files(kinds, start, end)
+        schema = _unify_schemas([pq.read_schema(file) for file in files] + [PARTITIONING.schema])
+
+        return ds.dataset(files, schema=schema, format='parquet', partitioning=PARTITIONING,
+                          partition_base_dir=self.root)
+
+    def scan(self, kinds=None, start=None, end=None, columns=None, filter=None):
+        """
+        Table of the rows of some kinds collected between start and end,
+        reading only their partitions
+        """
+        dataset = self.dataset(kinds, start, end)
+
+        if columns is not None:
+            columns = [column for column in columns if column in dataset.schema.names]
+
+        return dataset.to_table(columns=columns, filter=filter)
+
+    def compact(self, kinds=None, start=None, end=None, rows_per_file=5000000, row_group_size=131072):
+        """
+        Merge the outputs of each kind and day into large files sorted by id
+
+        Each kind and day is read in batches of `rows_per_file` rows; every
+        batch is sorted and written as one file, first under a temporary
+        name. Once a partition is compacted its original outputs are removed
+        and the index is updated.
+
+        Returns
+        -------
+        compacted : list
+            files written
+        """
+        written = []
+
+        for kind, day, directory in self.partitions(kinds, start, end):
+            sources = [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+                       if os.path.isdir(os.path.join(directory, name))]
+            files = [file for source in sources for file in part_files(source)]
+
+            if not files:
+                continue
+
+            schema = _unify_schemas([pq.read_schema(file) for file in files])
+            dataset = ds.dataset(files, schema=schema, format='parquet')
+            number = len([name for name in os.listdir(directory) if _compacted(name)])
+            pending, rows = [], 0
+            new = []
+
+            def flush():
+                nonlocal number
+                table = pa.Table.from_batches(pending, schema=schema)
+                if 'id' in table.column_names:
+                    table = _sort(table, [('id', 'ascending')])
+                path = os.path.join(directory, 'compacted-{:05d}.parquet'.format(number))
+                tmp = os.path.join(directory, '.compacted-{:05d}.tmp'.format(number))
+                pq.write_table(table, tmp, row_group_size=row_group_size)
+                os.replace(tmp, path)
+                number += 1
+                new.append(path)
+
+            for batch in dataset.to_batches():
+                pending.append(batch)
+                rows += batch.num_rows
+                if rows >= rows_per_file:
+                    flush()
+                    pending, rows = [], 0
+
+            if pending:
+                flush()
+
+            for source in sources:
+                shutil.rmtree(source)
+
+            self._index_files(kind, new)
+            written.extend(new)
+
+        return written
+
+    def index(self):
+        """
+        Sidecar index: field (id, author_id or conversation_id), value,
+        kind, file (relative to root) and row group of every compacted row
+        group holding the value
+        """
+        path = os.path.join(self.root, INDEX)
+
+        if not os.path.exists(path):
+            return pa.table({
+                'field': pa.array([], pa.string()), 'value': pa.array([], pa.int64()),
+                'kind': pa.array([], pa.string()), 'file': pa.array([], pa.string()),
+                'row_group': pa.array([], pa.int32())
+            })
+
+        return pq.read_table(path)
+
+    def _index_files(self, kind, files):
+        """Adds the row groups of compacted files to the index"""
+
+        entries = [self.index()]
+
+        for file in files:
+            parquet = pq.ParquetFile(file)
+            relative = os.path.relpath(file, self.root)
+            for row_group in range(parquet.num_row_groups):
+                columns = [name for name in INDEXED if name in parquet.schema_arrow.names]
+                table = parquet.read_row_group(row_group, columns=columns)
+                for name in columns:
+                    values = pc.unique(pc.drop_null(table.column(name).cast(pa.int64())))
+                    entries.append(pa.table({
+                        'field': pa.array([name] * len(values), pa.string()),
+                        'value': values,
+                        'kind': pa.array([kind] * len(values), pa.string()),
+                        'file': pa.array([relative] * len(values), pa.string()),
+                        'row_group': pa.array([row_group] * len(values), pa.int32()),
+                    }))
+
+        index = _sort(pa.concat_tables(entries), [('field', 'ascending'), ('value', 'ascending')])
+
+        tmp = os.path.join(self.root, '.index.{}.tmp'.format(os.getpid()))
+        pq.write_table(index, tmp, row_group_size=1048576)
+        os.replace(tmp, os.path.join(self.root, INDEX))
+
+    def lookup(self, values, field='id', kinds=None, columns=None):
+        """
+        Rows whose field (id, author_id or conversation_id) is one of values,
+        reading only the row groups the index points to. Only compacted
+        files are indexed
+
+        Returns
+        -------
+        rows : pyarrow.Table
+            matching rows, with `kind` and `file` columns
+        """
+        values = pa.array([int(value) for value in values], pa.int64())
+        index = pq.read_table(
+            os.path.join(self.root, INDEX),
+            filters=[('field', '=', field)]
+        ) if os.path.exists(os.path.join(self.root, INDEX)) else self.index()
+
+        index = index.filter(pc.is_in(index.column('value'), value_set=values))
+        if kinds is not None:
+            index = index.filter(pc.is_in(index.column('kind'), value_set=pa.array(list(kinds), pa.string())))
+
+        tables = []
+
+        for file, row_groups in _groups(index):
+            parquet = pq.ParquetFile(os.path.join(self.root, file))
+            table = parquet.read_row_groups(sorted(row_groups), columns=columns and list(set(columns) | {field}))
+            table = table.filter(pc.is_in(table.column(field).cast(pa.int64()), value_set=values))
+            kind = re.search(r'kind=([^/\\]+)', file).group(1)
+            table = table.append_column('kind', pa.array([kind] * table.num_rows, pa.string()))
+            tables.append(table.append_column('file', pa.array([file] * table.num_rows, pa.string())))
+
+        if not tables:
+            return pa.table({})
+
+        schema = _unify_schemas([table.schema for table in tables])
+
+        return pa.concat_tables([_conform(table, schema) for table in tables])
+
+
+def _unify_schemas(schemas):
+    """
+    Schema with every field of schemas, typed as where it is first found
+    with a type other than null: outputs written without a schema may type
+    a column differently, and are cast to it when read
+    """
+    fields = {}
+
+    for schema in schemas:
+        for field in schema:
+            if field.name not in fields or pa.types.is_null(fields[field.name].type):
+                fields[field.name] = field
+
+    return pa.schema(list(fields.values()))
+
+
+def _conform(table, schema):
+    """Table with the columns of schema, cast to its types, null where missing"""
+
+    return pa.table([
+        table.column(field.name).cast(field.type) if field.name in table.column_names
+        else pa.nulls(table.num_rows, field.type)
+        for field in schema
+    ], schema=schema)
+
+
+def _sort(table, keys):
+    """Table sorted on keys, (column, 'ascending' or 'descending') pairs"""
+
+    return table.take(pc.sort_indices(table, sort_keys=keys))
+
+
+def _compacted(name):
+    return name.startswith('compacted-') and name.endswith('.parquet')
+
+
+def _groups(index):
+    """file -> row groups of the entries of an index"""
+
+    groups = {}
+
+    for file, row_group in zip(index.column('file').to_pylist(), index.column('row_group').to_pylist()):
+        groups.setdefault(file, set()).add(row_group)
+
+    return sorted(groups.items())
+
+
+def open_dataset(dataset):
+    """TweetDataset at a directory, the given dataset, or None"""
+
+    if dataset is None or isinstance(dataset, TweetDataset):
+        return dataset
+
+    return TweetDataset(dataset)
+
+
+def run_key():
+    """Key of the output of one lookup run, e.g. `run-20220131T120501`"""
+
+    return time.strftime('run-%Y%m%dT%H%M%S')
+
+
+def main():
+    """Compacts a dataset: `python -m tweetple.DatasetTweetPle ROOT [--kinds handles,threads] [--start] [--end]`"""
+
+    parser = argparse.ArgumentParser(description='Merge the outputs of a TweetDataset into large sorted files')
+    parser.add_argument('root', help='directory holding the dataset')
+    parser.add_argument('--kinds', default=None, help='comma-separated kinds, e.g. handles,threads')
+    parser.add_argument('--start', default=None, help='first day compacted, YYYY-MM-DD')
+    parser.add_argument('--end', default=None, help='last day compacted, YYYY-MM-DD')
+    parser.add_argument('--rows-per-file', type=int, default=5000000)
+    parser.add_argument('--row-group-size', type=int, default=131072)
+    args = parser.parse_args()
+
+    written = TweetDataset(args.root).compact(
+        args.kinds.split(',') if args.kinds else None, args.start, args.end, args.rows_per_file, args.row_group_size)
+
+    for path in written:
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
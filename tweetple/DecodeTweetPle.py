@@ -0,0 +1,276 @@
+# ============================================================================
+
+# Fast decoding of API responses into Arrow tables
+
+# ============================================================================
+import json
+
+import pandas as pd
+import pyarrow as pa
+
+from .MetricsTweetPle import get_metrics, timed
+from .RetryTweetPle import check_page
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_DECODER = json.JSONDecoder()
+
+
+_SPAN = [('start', pa.int64()), ('end', pa.int64())]
+
+URL = pa.struct(_SPAN + [
+    ('url', pa.string()), ('expanded_url', pa.string()), ('display_url', pa.string()),
+    ('unwound_url', pa.string()), ('status', pa.int64()), ('title', pa.string()),
+    ('description', pa.string()), ('media_key', pa.string())
+])
+TAG = pa.struct(_SPAN + [('tag', pa.string())])
+MENTION = pa.struct(_SPAN + [('username', pa.string()), ('id', pa.string())])
+ANNOTATION = pa.struct(_SPAN + [
+    ('probability', pa.float64()), ('type', pa.string()), ('normalized_text', pa.string())
+])
+
+# Nested layout of the tweet and user objects tweetple requests. Records are
+# decoded against it, then struct fields are flattened into the dotted names
+# `json_normalize` gives, e.g. `public_metrics.like_count`.
+TWEET = pa.struct([
+    ('attachments', pa.struct([
+        ('media_keys', pa.list_(pa.string())), ('poll_ids', pa.list_(pa.string()))
+    ])),
+    ('author_id', pa.string()),
+    ('conversation_id', pa.string()),
+    ('created_at', pa.string()),
+    ('entities', pa.struct([
+        ('annotations', pa.list_(ANNOTATION)), ('cashtags', pa.list_(TAG)),
+        ('hashtags', pa.list_(TAG)), ('mentions', pa.list_(MENTION)), ('urls', pa.list_(URL))
+    ])),
+    ('geo', pa.struct([
+        ('coordinates', pa.struct([('type', pa.string()), ('coordinates', pa.list_(pa.float64()))])),
+        ('place_id', pa.string())
+    ])),
+    ('id', pa.string()),
+    ('in_reply_to_user_id', pa.string()),
+    ('lang', pa.string()),
+    ('possibly_sensitive', pa.bool_()),
+    ('public_metrics', pa.struct([
+        ('like_count', pa.int64()), ('quote_count', pa.int64()),
+        ('reply_count', pa.int64()), ('retweet_count', pa.int64())
+    ])),
+    ('referenced_tweets', pa.list_(pa.struct([('id', pa.string()), ('type', pa.string())]))),
+    ('reply_settings', pa.string()),
+    ('source', pa.string()),
+    ('text', pa.string()),
+    ('withheld', pa.struct([('copyright', pa.bool_()), ('country_codes', pa.list_(pa.string()))])),
+])
+
+USER = pa.struct([
+    ('created_at', pa.string()),
+    ('description', pa.string()),
+    ('entities', pa.struct([
+        ('description', pa.struct([
+            ('cashtags', pa.list_(TAG)), ('hashtags', pa.list_(TAG)),
+            ('mentions', pa.list_(MENTION)), ('urls', pa.list_(URL))
+        ])),
+        ('url', pa.struct([('urls', pa.list_(URL))]))
+    ])),
+    ('id', pa.string()),
+    ('location', pa.string()),
+    ('name', pa.string()),
+    ('pinned_tweet_id', pa.string()),
+    ('profile_image_url', pa.string()),
+    ('protected', pa.bool_()),
+    ('public_metrics', pa.struct([
+        ('followers_count', pa.int64()), ('following_count', pa.int64()),
+        ('listed_count', pa.int64()), ('tweet_count', pa.int64())
+    ])),
+    ('url', pa.string()),
+    ('username', pa.string()),
+    ('verified', pa.bool_()),
+    ('withheld', pa.struct([('country_codes', pa.list_(pa.string()))])),
+])
+
+
+def loads(content):
+    """Parses a JSON document, with orjson when it is installed"""
+
+    if orjson is not None:
+        return orjson.loads(content)
+
+    return json.loads(content)
+
+
+def read_json(response):
+    """Body of a response, parsed straight from its bytes"""
+
+    with timed('decode'):
+        body = loads(response.content)
+
+    metrics = get_metrics()
+
+    if metrics is not None and isinstance(body, dict):
+        metrics.page(getattr(response, 'url', ''), len(body.get('data') or []))
+
+    return body
+
+
+def read_meta(content):
+    """
+    `meta` object of a response body (pagination token, result count), read
+    without parsing the records before it. None when `meta` is not the last
+    key of the body, the layout the API uses, so the body must be parsed
+    whole
+    """
+    start = content.rfind(b'"meta"')
+
+    if start < 0:
+        return None
+
+    try:
+        text = content[content.index(b':', start) + 1:].decode('utf-8').lstrip()
+        meta, end = _DECODER.raw_decode(text)
+    except ValueError:
+        return None
+
+    # only the brace closing the body may follow a top-level `meta`
+    if not isinstance(meta, dict) or text[end:].strip() != '}':
+        return None
+
+    return meta
+
+
+class RawPage:
+
+    """Undecoded body of a page, parsed when its records are needed
+
+    Pagination only needs the `meta` of a page to request the next one: the
+    records are parsed later, on the threads that normalize them.
+
+    ...
+    Attributes
+    ----------
+    content : bytes
+        body of the response
+    url : str
+        url the page was requested from
+    status_code : int
+        status of the response
+
+    Methods
+    -------
+    records()
+        Parses the body, returning its `data`
+    """
+
+    def __init__(self, response):
+        self.content = response.content
+        self.url = getattr(response, 'url', '')
+        self.status_code = response.status_code
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+    def records(self):
+        """Records of the page, raising a CollectionError if it holds only errors"""
+
+        return check_page(self, read_json(self)).get('data', [])
+
+
+def decode_pages(records):
+    """Records, with the records of every RawPage among them parsed in place"""
+
+    decoded = []
+
+    for record in records:
+        if isinstance(record, RawPage):
+            decoded.extend(record.records())
+        else:
+            decoded.append(record)
+
+    return decoded
+
+
+def records_to_table(records, layout=TWEET):
+    """Decodes API objects into a flat Arrow table
+
+    The objects are converted against `layout` in a single pass: fields it
+    does not list are ignored and missing ones are null, so every table has
+    the same columns. Structs are then flattened into dotted column names.
+
+    Parameters
+    ----------
+    records : list
+        tweets or users, as found in a response's `data`
+    layout : pyarrow.StructType
+        nested layout of the objects, `TWEET` or `USER`
+
+    Returns
+    -------
+    table : pyarrow.Table
+        one row per object
+    """
+    array = pa.array(records, type=layout)
+    table = pa.Table.from_arrays(array.flatten(), names=[field.name for field in layout])
+
+    while any(pa.types.is_struct(field.type) for field in table.schema):
+        table = table.flatten()
+
+    return table
+
+
+def add_constants(table, columns):
+    """Table with a constant column for every name -> value of columns,
+    replacing a column of that name, as a dataframe assignment does"""
+
+    for name, value in columns.items():
+        column = pa.array([value] * table.num_rows)
+        if name in table.column_names:
+            table = table.set_column(table.column_names.index(name), name, column)
+        else:
+            table = table.append_column(name, column)
+
+    return table
+
+
+def drop_duplicates(table, unique):
+    """Table keeping the first row of every value of the `unique` column(s)"""
+
+    if table.num_rows == 0:
+        return table
+
+    keys = [unique] if isinstance(unique, str) else list(unique)
+
+    if not all(key in table.column_names for key in keys):
+        return table
+
+    first = ~table.select(keys).to_pandas().duplicated().to_numpy()
+
+    return table.filter(pa.array(first))
+
+
+def concat_tables(tables):
+    """Concatenates tables decoded against the same layout"""
+
+    tables = [table for table in tables if table is not None]
+
+    if not tables:
+        return pa.table({})
+
+    return pa.concat_tables(tables)
+
+
+def to_frame(table):
+    """Dataframe view of a table
+
+    With pandas >= 2 the columns stay backed by the Arrow buffers
+    (`pd.ArrowDtype`), so nothing is copied; older pandas converts the table
+    column by column without consolidating it into blocks.
+    """
+    arrow_dtype = getattr(pd, 'ArrowDtype', None)
+
+    if arrow_dtype is not None:
+        return table.to_pandas(types_mapper=arrow_dtype)
+
+    return table.to_pandas(split_blocks=True)
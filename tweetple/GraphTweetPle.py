@@ -0,0 +1,280 @@
+# ============================================================================
+
+# Compact follower-graph store
+
+# ============================================================================
+import os
+
+import numpy as np
+import pandas as pd
+from .SchemaTweetPle import USER_SCHEMA
+from .SinkTweetPle import ParquetSink, part_files, read_parquet_parts
+
+# edges copied at once when the edge arrays are rewritten
+CHUNK = 1 << 22
+
+
+class FollowerGraph:
+
+    """Follower graph kept as sorted int64 edge arrays
+
+    Each (follower, followee) edge is stored once, in two memory-mapped
+    arrays sorted by followee then follower, so the followers of an account
+    are found by binary search. A crawl rewrites the arrays by streaming
+    the edges it keeps into new files, never loading the graph. Profiles are stored once per user in a
+    separate table, however many accounts they follow. Every crawl of an
+    account already in the graph is recorded as a diff: the edges added and
+    removed since the previous crawl.
+
+    Layout of `path`:
+
+        followee.npy, follower.npy   edges
+        crawled.npy                  accounts whose followers were crawled
+        users.npy, users.parquet/    ids and profiles of the users seen
+        changes.parquet/             edges added (+1) or removed (-1)
+
+    ...
+    Attributes
+    ----------
+    path : str
+        directory holding the store
+    followee : numpy.ndarray
+        followed account of each edge
+    follower : numpy.ndarray
+        follower of each edge
+
+    Methods
+    -------
+    followers()
+        Followers of an account
+    following()
+        Accounts a user follows
+    update()
+        Replaces the followers of crawled accounts, recording the diffs
+    add_users()
+        Stores the profiles of users not seen before
+    ingest()
+        Adds the output of `followers_lookup` to the store
+    users()
+        Profiles of every user seen
+    changes()
+        Edges added and removed by later crawls
+    """
+
+    def __init__(self, path='follower_graph'):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.followee = self._load('followee')
+        self.follower = self._load('follower')
+        self.crawled = self._load('crawled')
+        self.user_ids = self._load('users')
+        self.user_sink = ParquetSink(os.path.join(path, 'users.parquet'), schema=USER_SCHEMA, mode='a')
+        self.change_sink = ParquetSink(os.path.join(path, 'changes.parquet'), mode='a')
+
+    def __len__(self):
+        return len(self.followee)
+
+    def _file(self, name):
+        return os.path.join(self.path, name + '.npy')
+
+    def _load(self, name):
+        if not os.path.exists(self._file(name)):
+            return np.empty(0, dtype=np.int64)
+
+        return np.load(self._file(name), mmap_mode='r')
+
+    def _save(self, name, array):
+        """Write an array under a temporary name, then rename it into place"""
+
+        tmp = os.path.join(self.path, '.{}.tmp.npy'.format(name))
+        np.save(tmp, np.ascontiguousarray(array, dtype=np.int64))
+        os.replace(tmp, self._file(name))
+
+        return self._load(name)
+
+    def _replace(self, accounts, followers):
+        """
+        Rewrite the edge arrays with the followers of accounts (sorted)
+        replaced, streaming the edges kept into the new files a chunk at a
+        time, so memory is bounded by the crawl rather than by the graph
+        """
+        spans = [self._span(account) for account in accounts]
+        size = len(self.followee) + sum(
+            len(followers[account]) - int(end - start) for account, (start, end) in zip(accounts, spans))
+        tmp = {name: os.path.join(self.path, '.{}.tmp.npy'.format(name)) for name in ('followee', 'follower')}
+
+        if size == 0:
+            self.followee = self._save('followee', np.empty(0, dtype=np.int64))
+            self.follower = self._save('follower', np.empty(0, dtype=np.int64))
+            return
+
+        followee = np.lib.format.open_memmap(tmp['followee'], mode='w+', dtype=np.int64, shape=(size,))
+        follower = np.lib.format.open_memmap(tmp['follower'], mode='w+', dtype=np.int64, shape=(size,))
+        written = 0
+
+        def copy(start, end):
+            nonlocal written
+            for offset in range(start, end, CHUNK):
+                stop = min(offset + CHUNK, end)
+                followee[written:written + stop - offset] = self.followee[offset:stop]
+                follower[written:written + stop - offset] = self.follower[offset:stop]
+                written += stop - offset
+
+        kept = 0
+        for account, (start, end) in zip(accounts, spans):
+            copy(kept, start)
+            ids = followers[account]
+            followee[written:written + len(ids)] = account
+            follower[written:written + len(ids)] = ids
+            written += len(ids)
+            kept = end
+        copy(kept, len(self.followee))
+
+        followee.flush()
+        follower.flush()
+        del followee, follower
+
+        for name in tmp:
+            os.replace(tmp[name], self._file(name))
+
+        self.followee = self._load('followee')
+        self.follower = self._load('follower')
+
+    def _span(self, followee):
+        return (
+            np.searchsorted(self.followee, followee, side='left'),
+            np.searchsorted(self.followee, followee, side='right')
+        )
+
+    def followers(self, followee):
+        """
+        Followers of an account, sorted
+        """
+        start, end = self._span(int(followee))
+
+        return np.asarray(self.follower[start:end])
+
+    def following(self, follower):
+        """
+        Accounts a user follows
+        """
+        return np.asarray(self.followee[np.flatnonzero(self.follower == int(follower))])
+
+    def update(self, crawl, crawled_at=None):
+        """
+        Replace the followers of the accounts of a crawl
+
+        Parameters
+        ----------
+        crawl : dict
+            followee id -> follower ids found by the crawl
+        crawled_at : str
+            time of the crawl, defaults to now
+
+        Returns
+        -------
+        changes : dataframe
+            edges added (+1) and removed (-1) for accounts crawled before
+        """
+        if not crawl:
+            return pd.DataFrame(columns=['followee', 'follower', 'change', 'crawled_at'])
+
+        crawled_at = crawled_at or pd.Timestamp.now(tz='UTC').isoformat()
+        accounts = np.array(sorted(int(followee) for followee in crawl), dtype=np.int64)
+        followers = {int(followee): np.unique(np.asarray(ids, dtype=np.int64)) for followee, ids in crawl.items()}
+
+        diffs = []
+        for followee in accounts[np.isin(accounts, self.crawled)]:
+            old, new = self.followers(followee), followers[followee]
+            for change, ids in ((1, np.setdiff1d(new, old, True)), (-1, np.setdiff1d(old, new, True))):
+                if len(ids):
+                    diffs.append(pd.DataFrame({'followee': followee, 'follower': ids, 'change': change}))
+
+        self._replace(accounts, followers)
+        self.crawled = self._save('crawled', np.union1d(self.crawled, accounts))
+
+        changes = pd.concat(diffs, ignore_index=True) if diffs else pd.DataFrame(
+            columns=['followee', 'follower', 'change'])
+        changes['crawled_at'] = crawled_at
+
+        self.change_sink.write(changes)
+
+        return changes
+
+    def add_users(self, df):
+        """
+        Store the profiles of users not seen before, returns how many
+        """
+        if df is None or len(df) == 0:
+            return 0
+
+        ids = pd.to_numeric(df['id'], errors='coerce')
+        df = df[ids.notna().to_numpy()]
+        ids = ids.dropna().astype('int64').to_numpy()
+
+        new = ~np.isin(ids, self.user_ids) & ~pd.Series(ids).duplicated().to_numpy()
+
+        if not new.any():
+            return 0
+
+        self.user_sink.write(df[new].reset_index(drop=True))
+        self.user_ids = self._save('users', np.union1d(self.user_ids, ids[new]))
+
+        return int(new.sum())
+
+    def ingest(self, paths, crawled_at=None, accounts=None):
+        """
+        Add the output of `followers_lookup` (one Parquet output per account)
+        to the store: edges to the graph and profiles to the user table
+
+        `accounts` gives the account of each output. An account collected
+        without followers has no rows telling whose output it is; given its
+        id, it is recorded as followed by nobody, and its former followers
+        as removed.
+
+        Returns
+        -------
+        changes : dataframe
+            edges added and removed for accounts crawled before
+        """
+        crawl = {}
+        accounts = [None] * len(paths) if accounts is None else list(accounts)
+
+        for path, account in zip(paths, accounts):
+            df = read_parquet_parts(path) if part_files(path) else None
+            if df is None or len(df) == 0 or 'author_id_following' not in df.columns:
+                if account is not None:
+                    crawl[int(account)] = np.array([], dtype=np.int64)
+                continue
+            followee = int(df['author_id_following'].iloc[0])
+            crawl[followee] = pd.to_numeric(df['id'], errors='coerce').dropna().astype('int64').to_numpy()
+            self.add_users(df.drop(columns=['author_id_following', 'date_consulted', 'response'], errors='ignore'))
+
+        return self.update(crawl, crawled_at)
+
+    def users(self):
+        """
+        Profiles of every user seen
+        """
+        if not part_files(self.user_sink.path):
+            return pd.DataFrame(columns=USER_SCHEMA.names)
+
+        return read_parquet_parts(self.user_sink.path)
+
+    def changes(self):
+        """
+        Edges added and removed by later crawls
+        """
+        if not part_files(self.change_sink.path):
+            return pd.DataFrame(columns=['followee', 'follower', 'change', 'crawled_at'])
+
+        return read_parquet_parts(self.change_sink.path)
+
+
+def open_graph(graph):
+    """FollowerGraph from a store or a directory, None when it is off"""
+
+    if graph is None or isinstance(graph, FollowerGraph):
+        return graph
+
+    return FollowerGraph(graph)
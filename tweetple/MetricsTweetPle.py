@@ -0,0 +1,280 @@
+# ============================================================================
+
+# Per-request metrics and stage timings
+
+# ============================================================================
+import logging
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+from .RateLimitTweetPle import endpoint_key
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+STAGES = ('fetch', 'decode', 'normalize', 'write')
+
+
+class Metrics:
+
+    """Where the time of a collection goes, per endpoint and per stage
+
+    The transport records every request: latency, response bytes, status,
+    seconds waited on the rate limiter and retries. Decoding records pages
+    and rows, and the page buffer and sinks time the normalize and write
+    stages. Every observation is also handed to `callback`, and the totals
+    can be written as an OpenMetrics text file, e.g. for node exporter's
+    textfile collector.
+
+    ...
+    Attributes
+    ----------
+    path : str or None
+        OpenMetrics file refreshed every `interval` seconds
+    callback : callable or None
+        called with a dict describing each observation
+    interval : float
+        minimum seconds between two refreshes of `path`
+    endpoints : dict
+        endpoint template -> totals of its requests
+    stages : dict
+        stage -> [seconds, calls]
+
+    Methods
+    -------
+    request()
+        Records a response
+    page()
+        Records the rows of a decoded page
+    stage()
+        Records the time spent in a stage
+    snapshot()
+        Totals per endpoint and per stage
+    render()
+        Totals as OpenMetrics text
+    write()
+        Writes the OpenMetrics text to `path`
+    """
+
+    def __init__(self, path=None, callback=None, interval=15.0, buckets=LATENCY_BUCKETS):
+        self.path = path
+        self.callback = callback
+        self.interval = interval
+        self.buckets = tuple(buckets)
+        self.endpoints = {}
+        self.stages = {stage: [0.0, 0] for stage in STAGES}
+        self.lock = threading.Lock()
+        self.written = 0.0
+
+    def _endpoint(self, endpoint):
+        if endpoint not in self.endpoints:
+            self.endpoints[endpoint] = {
+                'requests': {}, 'latency': [0] * (len(self.buckets) + 1), 'seconds': 0.0,
+                'bytes': 0, 'pages': 0, 'rows': 0, 'waited': 0.0, 'retries': 0
+            }
+
+        return self.endpoints[endpoint]
+
+    def _emit(self, event):
+        if self.callback is not None:
+            self.callback(event)
+
+        if self.path is None:
+            return
+
+        with self.lock:
+            # one thread claims each refresh
+            due = time.time() - self.written >= self.interval
+            if due:
+                self.written = time.time()
+
+        if due:
+            try:
+                self.write()
+            except OSError:
+                # metrics never fail a collection
+                logging.exception('Failed to write metrics to {}'.format(self.path))
+
+    def request(self, url, status, seconds, size, waited=0.0, retry=False):
+        """
+        Record a response: its latency, bytes and status ('timeout' when
+        the request timed out or lost its connection), the seconds the
+        request waited on the rate limiter and whether it was a retry
+        """
+        endpoint = endpoint_key(url)
+
+        with self.lock:
+            totals = self._endpoint(endpoint)
+            totals['requests'][status] = totals['requests'].get(status, 0) + 1
+            totals['latency'][_bucket(self.buckets, seconds)] += 1
+            totals['seconds'] += seconds
+            totals['bytes'] += size
+            totals['waited'] += waited
+            totals['retries'] += bool(retry)
+            self.stages['fetch'][0] += seconds
+            self.stages['fetch'][1] += 1
+
+        self._emit({
+            'event': 'request', 'endpoint': endpoint, 'status': status, 'seconds': seconds,
+            'bytes': size, 'waited': waited, 'retry': bool(retry)
+        })
+
+    def page(self, url, rows):
+        """
+        Record a decoded page and its rows
+        """
+        endpoint = endpoint_key(url)
+
+        with self.lock:
+            totals = self._endpoint(endpoint)
+            totals['pages'] += 1
+            totals['rows'] += rows
+
+        self._emit({'event': 'page', 'endpoint': endpoint, 'rows': rows})
+
+    def stage(self, stage, seconds):
+        """
+        Record seconds spent in a stage (decode, normalize or write)
+        """
+        with self.lock:
+            totals = self.stages.setdefault(stage, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += 1
+
+        self._emit({'event': 'stage', 'stage': stage, 'seconds': seconds})
+
+    def snapshot(self):
+        """
+        Totals per endpoint and per stage
+        """
+        with self.lock:
+            endpoints = {
+                endpoint: dict(totals, requests=dict(totals['requests']), latency=list(totals['latency']))
+                for endpoint, totals in self.endpoints.items()
+            }
+            stages = {stage: {'seconds': seconds, 'calls': calls} for stage, (seconds, calls) in self.stages.items()}
+
+        return {'endpoints': endpoints, 'stages': stages}
+
+    def render(self):
+        """
+        Totals as OpenMetrics text
+        """
+        snapshot = self.snapshot()
+        endpoints = sorted(snapshot['endpoints'].items())
+        lines = []
+
+        def family(name, type, help, samples):
+            lines.append('# TYPE {} {}'.format(name, type))
+            lines.append('# HELP {} {}'.format(name, help))
+            for suffix, labels, value in samples:
+                lines.append('{}{}{{{}}} {}'.format(name, suffix, _labels(labels), _number(value)))
+
+        family('tweetple_requests', 'counter', 'Requests sent, by response status (timeout when none came).', [
+            ('_total', {'endpoint': endpoint, 'status': status}, count)
+            for endpoint, totals in endpoints for status, count in sorted(totals['requests'].items(), key=lambda item: str(item[0]))
+        ])
+
+        latency = []
+        for endpoint, totals in endpoints:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), totals['latency']):
+                cumulative += count
+                latency.append(('_bucket', {'endpoint': endpoint, 'le': _number(bound)}, cumulative))
+            latency.append(('_count', {'endpoint': endpoint}, cumulative))
+            latency.append(('_sum', {'endpoint': endpoint}, totals['seconds']))
+        family('tweetple_request_latency_seconds', 'histogram', 'Seconds from request to response.', latency)
+
+        for name, key, help in (
+            ('tweetple_response_bytes', 'bytes', 'Bytes of response bodies.'),
+            ('tweetple_pages', 'pages', 'Pages decoded.'),
+            ('tweetple_rows', 'rows', 'Tweets or users decoded.'),
+            ('tweetple_rate_limit_wait_seconds', 'waited', 'Seconds requests waited on the rate limiter.'),
+            ('tweetple_retries', 'retries', 'Requests sent again after a 429, a 5xx, a timeout or a revoked token.'),
+        ):
+            family(name, 'counter', help, [('_total', {'endpoint': endpoint}, totals[key]) for endpoint, totals in endpoints])
+
+        stages = sorted(snapshot['stages'].items())
+        family('tweetple_stage_seconds', 'summary', 'Seconds spent fetching, decoding, normalizing and writing.', [
+            sample for stage, totals in stages for sample in (
+                ('_count', {'stage': stage}, totals['calls']),
+                ('_sum', {'stage': stage}, totals['seconds'])
+            )
+        ])
+
+        lines.append('# EOF')
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path=None):
+        """
+        Write the OpenMetrics text to path (defaults to `path`), atomically
+        so a scrape never reads a partial file
+        """
+        path = path or self.path
+        self.written = time.time()
+
+        tmp = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(tmp, 'w') as file:
+            file.write(self.render())
+        os.replace(tmp, path)
+
+        return path
+
+
+def _bucket(buckets, seconds):
+    for i, bound in enumerate(buckets):
+        if seconds <= bound:
+            return i
+
+    return len(buckets)
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(labels):
+    return ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for name, value in labels.items())
+
+
+_metrics = None
+
+
+def get_metrics():
+    """Returns the metrics every collector records to, None when off"""
+
+    return _metrics
+
+
+def set_metrics(metrics):
+    """Makes every collector record to metrics (None turns recording off)"""
+
+    global _metrics
+
+    _metrics = metrics
+
+    return metrics
+
+
+@contextmanager
+def timed(stage):
+    """Times the block as `stage` when metrics are on"""
+
+    metrics = _metrics
+
+    if metrics is None:
+        yield
+        return
+
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        metrics.stage(stage, time.perf_counter() - start)
@@ -0,0 +1,105 @@
+# ============================================================================
+
+# Pipelined normalize and write stages
+
+# ============================================================================
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Pipeline:
+
+    """Normalizes and writes pages while the next ones are fetched
+
+    Pagination is sequential, since every page carries the token of the
+    next one, so pages are fetched on the collector's thread. Each batch a
+    page buffer flushes is normalized by a pool of workers and written by a
+    single writer thread, in the order the batches were flushed, so
+    checkpoints are still only saved once everything before them is on disk.
+    At most `depth` batches are in flight: when the workers or the writer
+    fall behind, fetching waits for them.
+
+    ...
+    Attributes
+    ----------
+    workers : int
+        threads normalizing batches
+    depth : int
+        batches fetched but not yet written before fetching blocks
+
+    Methods
+    -------
+    submit()
+        Queues a batch to be normalized, then written
+    close()
+        Waits for queued batches and stops the threads
+    """
+
+    def __init__(self, workers=2, depth=8):
+        self.workers = workers
+        self.depth = depth
+        self.slots = threading.BoundedSemaphore(depth)
+        self.normalizers = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tweetple-normalize')
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tweetple-write')
+
+    def submit(self, normalize, write):
+        """
+        Queue a batch: `normalize()` runs on a worker, then `write(result)`
+        on the writer thread. Blocks while `depth` batches are in flight
+
+        Returns
+        -------
+        future : concurrent.futures.Future
+            done once the batch is written, holding what `write` returned
+            or the exception either stage raised
+        """
+        self.slots.acquire()
+
+        try:
+            normalized = self.normalizers.submit(normalize)
+        except BaseException:
+            self.slots.release()
+            raise
+
+        def persist():
+            try:
+                return write(normalized.result())
+            finally:
+                self.slots.release()
+
+        return self.writer.submit(persist)
+
+    def close(self):
+        """
+        Wait for queued batches, then stop the threads
+        """
+        self.normalizers.shutdown(wait=True)
+        self.writer.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_pipeline(pipeline):
+    """Pipeline with that many workers, the given pipeline, or None"""
+
+    if pipeline is None or pipeline is False:
+        return None
+
+    if isinstance(pipeline, Pipeline):
+        return pipeline
+
+    return Pipeline(workers=int(pipeline))
+
+
+def close_pipeline(opened, pipeline):
+    """
+    Close opened, the result of `open_pipeline(pipeline)`, unless pipeline
+    was a Pipeline of the caller's, left open for its next runs
+    """
+    if opened is not None and opened is not pipeline:
+        opened.close()
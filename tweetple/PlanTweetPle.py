@@ -0,0 +1,249 @@
+# ============================================================================
+
+# Query planner driven by the counts endpoint
+
+# ============================================================================
+import math
+
+import numpy as np
+import pandas as pd
+from requests import RequestException
+
+from .DecodeTweetPle import read_json
+from .RetryTweetPle import CollectionError, check_page, describe
+from .RateLimitTweetPle import TokenPool, WINDOW, endpoint_key, token_pool
+from .TransportTweetPle import get_transport
+
+COUNTS_URL = 'https://api.twitter.com/2/tweets/counts/all'
+SEARCH_URL = 'https://api.twitter.com/2/tweets/search/all'
+
+
+class QueryPlanner:
+
+    """Estimates what full-archive searches cost before they run
+
+    Every query is first sent to `/2/tweets/counts/all`, which tells how
+    many tweets it matches per day (or hour, or minute) for a fraction of
+    the cost of searching. From those counts the planner drops periods
+    without tweets, cuts the rest into time windows holding about the same
+    number of pages, and estimates the requests, tweets and time each query
+    will take at the current rate limits.
+
+    ...
+    Attributes
+    ----------
+    bearer_token : str, list or TokenPool
+        credentials the counts are requested with
+    start_time : str
+        start of the range planned
+    end_time : str
+        end of the range planned
+    transport : Transport
+        pooled HTTP transport used for every call
+    granularity : str
+        'day', 'hour' or 'minute' buckets of the counts
+    page_size : int
+        tweets per search page (`max_results` of the search)
+    pages_per_window : int
+        pages each window should hold; sets the number of windows of a query
+    max_windows : int
+        most windows a query is split into
+    cap : int or None
+        tweets left in the monthly cap; queries beyond it are flagged
+
+    Methods
+    -------
+    counts()
+        Tweets matched by a query, per bucket
+    plan()
+        Windows, requests, tweets and time of a query
+    plan_queries()
+        Plans of several queries, as a report
+    """
+
+    def __init__(self, bearer_token, start_time, end_time, transport=None, granularity='day', page_size=500, pages_per_window=20, max_windows=8, cap=None):
+        self.bearer_token = token_pool(bearer_token)
+        self.start_time = start_time
+        self.end_time = end_time
+        self.transport = transport or get_transport()
+        self.granularity = granularity
+        self.page_size = page_size
+        self.pages_per_window = pages_per_window
+        self.max_windows = max_windows
+        self.cap = cap
+
+    def counts(self, query):
+        """
+        Tweets matched by query in each bucket of start_time..end_time
+
+        Returns
+        -------
+        counts : dataframe
+            start, end and tweet_count of every bucket, and the number of
+            counts requests made, in `attrs['requests']`
+        """
+        headers = self.transport.headers(self.bearer_token)
+        params = {
+            'query': query,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'granularity': self.granularity
+        }
+
+        buckets = []
+        requests = 0
+
+        while True:
+            response = self.transport.get(COUNTS_URL, headers=headers, params=params)
+            requests += 1
+            json_response = check_page(response, read_json(response))
+
+            buckets.extend(json_response.get('data', []))
+            next_token = json_response.get('meta', {}).get('next_token')
+            if next_token is None:
+                break
+            params['next_token'] = next_token
+
+        counts = pd.DataFrame(buckets, columns=['start', 'end', 'tweet_count'])
+        counts['tweet_count'] = counts['tweet_count'].astype('int64')
+        counts = counts.sort_values('start', ignore_index=True)
+        counts.attrs['requests'] = requests
+
+        return counts
+
+    def plan(self, query):
+        """
+        Plan of a query
+
+        Returns
+        -------
+        plan : dict
+            query, tweets, search requests, windows ((start_time, end_time)
+            of each, empty when the query matches nothing), counts requests
+            made and estimated seconds at the current rate limits
+        """
+        counts = self.counts(query)
+        windows = balance_windows(
+            counts, self.page_size, pages_per_window=self.pages_per_window, max_windows=self.max_windows)
+
+        tweets = int(counts['tweet_count'].sum())
+        requests = sum(max(math.ceil(window_tweets / self.page_size), 1) for _, _, window_tweets in windows)
+
+        return {
+            'query': query,
+            'tweets': tweets,
+            'requests': requests,
+            'windows': [(start, end) for start, end, _ in windows],
+            'counts_requests': counts.attrs['requests'],
+            'seconds': self.seconds(requests),
+        }
+
+    def seconds(self, requests, url=SEARCH_URL):
+        """
+        Least time `requests` requests to url take at the rate limits of the
+        transport's rate limiter, spread across every token of the pool
+        """
+        if requests == 0:
+            return 0.0
+
+        capacity, min_interval = self.transport.rate_limiter.limits.get(endpoint_key(url), (None, 0.0))
+        tokens = len(self.bearer_token) if isinstance(self.bearer_token, TokenPool) else 1
+
+        rates = [rate for rate in (
+            capacity / WINDOW if capacity else None,
+            1 / min_interval if min_interval else None
+        ) if rate]
+
+        if not rates:
+            return 0.0
+
+        return requests / (min(rates) * max(tokens, 1))
+
+    def plan_queries(self, queries):
+        """
+        Plans of several queries, in order
+
+        A query whose counts cannot be collected is left unplanned, with the
+        failure class in `error`, instead of failing the whole report.
+
+        Returns
+        -------
+        report : dataframe
+            one row per query: tweets, requests, windows, estimated seconds,
+            the failure class of its counts (None when planned) and, with a
+            `cap`, whether the query fits in what the queries admitted
+            before it left
+        """
+        plans = []
+
+        for query in queries:
+            try:
+                plans.append(dict(self.plan(query), error=None))
+            except (CollectionError, RequestException) as error:
+                plans.append({'query': query, 'error': describe(error)[0]})
+
+        report = pd.DataFrame(plans, columns=['query', 'tweets', 'requests', 'windows', 'counts_requests', 'seconds', 'error'])
+
+        report['cumulative_tweets'] = report['tweets'].cumsum()
+
+        if self.cap is not None:
+            # queries are admitted in order while what they add fits in the cap
+            admitted, within_cap = 0, []
+            for tweets in report['tweets']:
+                within_cap.append(admitted + tweets <= self.cap)
+                admitted += tweets if within_cap[-1] else 0
+            report['within_cap'] = within_cap
+
+        return report
+
+
+def balance_windows(counts, page_size=500, windows=None, pages_per_window=None, max_windows=None):
+    """Time windows holding about the same number of pages
+
+    Buckets without tweets are left out: a window starts at its first
+    bucket with tweets and ends with its last one, so empty periods between
+    windows are never searched.
+
+    Parameters
+    ----------
+    counts : dataframe
+        start, end and tweet_count of consecutive buckets
+    page_size : int
+        tweets per search page
+    windows : int
+        number of windows, derived from pages_per_window when None
+    pages_per_window : int
+        pages each window should hold
+    max_windows : int
+        most windows returned
+
+    Returns
+    -------
+    windows : list
+        (start_time, end_time, tweets) of each window
+    """
+    counts = counts[counts['tweet_count'] > 0]
+
+    if counts.empty:
+        return []
+
+    tweet_count = counts['tweet_count'].to_numpy()
+    total = int(tweet_count.sum())
+    pages = math.ceil(total / page_size)
+
+    if windows is None:
+        windows = math.ceil(pages / pages_per_window) if pages_per_window else 1
+    windows = max(1, min(windows, max_windows or windows, len(counts), pages))
+
+    # each bucket goes to the window its first tweet falls in
+    before = np.cumsum(tweet_count) - tweet_count
+    group = np.minimum(before * windows // total, windows - 1)
+
+    bounds = []
+
+    for window in np.unique(group):
+        members = counts[group == window]
+        bounds.append((members['start'].iloc[0], members['end'].iloc[-1], int(members['tweet_count'].sum())))
+
+    return bounds
+
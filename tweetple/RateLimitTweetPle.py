@@ -0,0 +1,312 @@
+# ============================================================================
+
+# Rate-limit scheduler driven by Twitter's response headers
+
+# ============================================================================
+import re
+import threading
+import time
+
+from urllib.parse import urlparse
+
+# Requests per 15-minute window and minimum seconds between requests for the
+# endpoints tweetple calls. They seed each bucket until the first response
+# tells us the real budget through its `x-rate-limit-*` headers.
+RATE_LIMITS = {
+    '/2/tweets/search/all': (300, 1.0),
+    '/2/tweets/counts/all': (300, 1.0),
+    '/2/tweets': (300, 0.0),
+    '/2/tweets/:id': (300, 0.0),
+    '/2/tweets/:id/liking_users': (75, 0.0),
+    '/2/tweets/:id/retweeted_by': (75, 0.0),
+    '/2/users': (300, 0.0),
+    '/2/users/:id': (300, 0.0),
+    '/2/users/:id/followers': (15, 0.0),
+}
+
+WINDOW = 15 * 60
+
+
+def endpoint_key(url):
+    """Endpoint template of a url, e.g. `/2/users/:id/followers`"""
+
+    path = urlparse(url).path.rstrip('/')
+
+    return re.sub(r'/(users|tweets)/\d+', r'/\1/:id', path)
+
+
+class TokenBucket:
+
+    """Request budget of a single endpoint
+
+    The bucket holds `capacity` requests and refills completely when the
+    rate-limit window resets, mirroring Twitter's fixed 15-minute windows.
+
+    ...
+    Attributes
+    ----------
+    capacity : int or None
+        requests allowed per window, None while unknown
+    remaining : int or None
+        requests left in the current window
+    reset_at : float or None
+        epoch seconds at which the window resets
+    min_interval : float
+        minimum seconds between two requests
+
+    Methods
+    -------
+    reserve()
+        Takes a request from the bucket or tells how long to wait
+    update()
+        Corrects the budget with the values reported by the API
+    exhaust()
+        Empties the bucket until the window resets
+    headroom()
+        Requests left at a given time
+    """
+
+    def __init__(self, capacity=None, min_interval=0.0, window=WINDOW):
+        self.capacity = capacity
+        self.remaining = capacity
+        self.reset_at = None
+        self.min_interval = min_interval
+        self.window = window
+        self.last = None
+
+    def reserve(self, now):
+        """
+        Take a request from the bucket, returns the seconds to wait first
+        (0 when the request can go out right away)
+        """
+        if self.reset_at is not None and now >= self.reset_at:
+            self.remaining = self.capacity
+            self.reset_at = None
+
+        if self.remaining is not None and self.remaining < 1:
+            return max(self.reset_at - now, 0.01) if self.reset_at else self.window
+
+        if self.last is not None and now < self.last + self.min_interval:
+            return self.last + self.min_interval - now
+
+        if self.remaining is not None:
+            self.remaining -= 1
+            if self.reset_at is None:
+                self.reset_at = now + self.window
+
+        self.last = now
+
+        return 0
+
+    def update(self, limit, remaining, reset):
+        """
+        Correct the budget with the values reported by the API
+        """
+        if limit is not None:
+            self.capacity = limit
+
+        if remaining is not None:
+            if reset is not None and reset != self.reset_at:
+                # a new window started since we last heard from the API
+                self.remaining = remaining
+            elif self.remaining is None:
+                self.remaining = remaining
+            else:
+                self.remaining = min(self.remaining, remaining)
+
+        if reset is not None:
+            self.reset_at = reset
+
+    def exhaust(self, reset):
+        """
+        Empty the bucket until `reset`
+        """
+        self.remaining = 0
+        self.reset_at = reset
+
+    def headroom(self, now):
+        """
+        Requests left at `now`, infinite while the budget is unknown
+        """
+        if self.reset_at is not None and now >= self.reset_at:
+            remaining = self.capacity
+        else:
+            remaining = self.remaining
+
+        return float('inf') if remaining is None else remaining
+
+
+class RateLimiter:
+
+    """Per-endpoint token-bucket scheduler
+
+    Requests go out as fast as their bucket allows and only wait when it is
+    empty. Buckets are kept per endpoint and per credential, as Twitter
+    budgets each app separately.
+
+    ...
+    Attributes
+    ----------
+    limits : dict
+        endpoint template -> (requests per window, minimum interval)
+    buckets : dict
+        (endpoint, credential) -> TokenBucket
+    slept : float
+        total seconds spent waiting on empty buckets
+
+    Methods
+    -------
+    acquire()
+        Blocks until a request to url may be sent
+    acquire_any()
+        Blocks until one of several credentials may send a request to url
+    update()
+        Feeds a response's rate-limit headers back into its bucket
+    """
+
+    def __init__(self, limits=None, clock=time.time, sleep=time.sleep):
+        self.limits = RATE_LIMITS if limits is None else limits
+        self.buckets = {}
+        self.slept = 0.0
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+
+    def bucket(self, url, credential=None):
+        """
+        Bucket of the endpoint url belongs to, created on first use
+        """
+        key = (endpoint_key(url), credential)
+
+        if key not in self.buckets:
+            capacity, min_interval = self.limits.get(key[0], (None, 0.0))
+            self.buckets[key] = TokenBucket(capacity, min_interval)
+
+        return self.buckets[key]
+
+    def acquire(self, url, credential=None):
+        """
+        Block until a request to url may be sent, returns the seconds waited
+        """
+        waited = 0.0
+
+        while True:
+
+            with self.lock:
+                wait = self.bucket(url, credential).reserve(self.clock())
+                if wait <= 0:
+                    self.slept += waited
+                    return waited
+
+            self.sleep(wait)
+            waited += wait
+
+    def acquire_any(self, url, credentials):
+        """
+        Block until one of credentials may send a request to url, returns
+        the credential with the most requests left for its endpoint
+        """
+        waited = 0.0
+
+        while True:
+
+            with self.lock:
+                now = self.clock()
+                ranked = sorted(
+                    credentials, key=lambda credential: self.bucket(url, credential).headroom(now), reverse=True
+                )
+                waits = []
+                for credential in ranked:
+                    wait = self.bucket(url, credential).reserve(now)
+                    if wait <= 0:
+                        self.slept += waited
+                        return credential
+                    waits.append(wait)
+
+            self.sleep(min(waits))
+            waited += min(waits)
+
+    def update(self, url, response, credential=None):
+        """
+        Feed the rate-limit headers of a response back into its bucket
+        """
+        headers = response.headers
+        limit = _header(headers, 'x-rate-limit-limit')
+        remaining = _header(headers, 'x-rate-limit-remaining')
+        reset = _header(headers, 'x-rate-limit-reset')
+
+        with self.lock:
+
+            bucket = self.bucket(url, credential)
+
+            if response.status_code == 429:
+                bucket.exhaust(reset if reset is not None else self.clock() + 60)
+            else:
+                bucket.update(limit, remaining, reset)
+
+
+class TokenPool:
+
+    """Several bearer tokens used as a single credential
+
+    Pass a pool wherever a bearer token is expected: each request is sent
+    with the token that has the most requests left for its endpoint, so a
+    job gets the combined budget of every app. A token throttled with a 429
+    is skipped until its window resets, and a revoked one (401) is dropped
+    from the pool.
+
+    ...
+    Attributes
+    ----------
+    tokens : list
+        bearer tokens of the pool
+    revoked : set
+        tokens the API rejected
+
+    Methods
+    -------
+    credentials()
+        Authorization values of the tokens still usable
+    revoke()
+        Drops a token from the pool
+    """
+
+    def __init__(self, bearer_tokens):
+        self.tokens = list(dict.fromkeys(bearer_tokens))
+        self.revoked = set()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.tokens) - len(self.revoked)
+
+    def credentials(self):
+        """
+        Authorization values of the tokens still usable
+        """
+        with self.lock:
+            return ['Bearer {}'.format(token) for token in self.tokens if token not in self.revoked]
+
+    def revoke(self, credential):
+        """
+        Drop the token of an Authorization value from the pool
+        """
+        with self.lock:
+            self.revoked.add(credential[len('Bearer '):])
+
+
+def token_pool(bearer_token):
+    """TokenPool of a list of bearer tokens, a single token as it is"""
+
+    if isinstance(bearer_token, (list, tuple)):
+        return TokenPool(bearer_token)
+
+    return bearer_token
+
+
+def _header(headers, name):
+    """Integer value of a header, None when missing or malformed"""
+
+    try:
+        return int(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
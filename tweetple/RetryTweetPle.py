@@ -0,0 +1,282 @@
+# ============================================================================
+
+# Failure classification, jittered retries and dead letters
+
+# ============================================================================
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+import requests
+
+TRANSIENT = ('rate_limited', 'server_error', 'timeout')
+
+PERMANENT = ('unauthorized', 'forbidden', 'not_found', 'suspended', 'bad_request', 'client_error')
+
+STATUSES = {400: 'bad_request', 401: 'unauthorized', 403: 'forbidden', 404: 'not_found', 429: 'rate_limited'}
+
+
+class CollectionError(Exception):
+
+    """A page that could not be collected
+
+    ...
+    Attributes
+    ----------
+    kind : str
+        failure class, one of `TRANSIENT` or `PERMANENT`
+    status : int or None
+        status code of the response, None when there was none
+    detail : str
+        what the API (or the connection) said
+    """
+
+    def __init__(self, kind, status=None, detail=''):
+        super().__init__('{} ({}): {}'.format(kind, status, detail))
+        self.kind = kind
+        self.status = status
+        self.detail = detail
+
+    @property
+    def transient(self):
+        return self.kind in TRANSIENT
+
+
+class RetryPolicy:
+
+    """Which failures are retried, and how long to wait before each retry
+
+    Only transient failures (throttling, 5xx and timeouts) are worth sending
+    again; a 404 or a suspended account fails the same way every time. The
+    wait doubles with every attempt, up to `max_backoff`, and is drawn
+    uniformly below that bound ("full jitter"), so collectors failing
+    together do not retry together.
+
+    ...
+    Attributes
+    ----------
+    backoff : float
+        upper bound of the first wait, in seconds
+    max_backoff : float
+        upper bound of any wait, in seconds
+    transient : tuple
+        failure classes retried
+
+    Methods
+    -------
+    retryable()
+        Whether a failure class is retried
+    delay()
+        Seconds to wait before a retry
+    """
+
+    def __init__(self, backoff=1.0, max_backoff=60.0, transient=TRANSIENT):
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.transient = tuple(transient)
+
+    def retryable(self, kind):
+        """Whether failures of class kind are retried"""
+
+        return kind in self.transient
+
+    def delay(self, attempt):
+        """Seconds to wait before retry number attempt + 1"""
+
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+def classify_status(status):
+    """Failure class of a status code, None for a success"""
+
+    if status == 200:
+        return None
+
+    if status in STATUSES:
+        return STATUSES[status]
+
+    return 'server_error' if status >= 500 else 'client_error'
+
+
+def classify_error(error):
+    """Failure class of an entry of a response's `errors` array"""
+
+    detail = '{} {}'.format(error.get('title', ''), error.get('detail', '')).lower()
+
+    if 'suspended' in detail:
+        return 'suspended'
+
+    if error.get('type', '').endswith('resource-not-found') or 'not found' in detail:
+        return 'not_found'
+
+    if error.get('type', '').endswith('not-authorized-for-resource') or 'forbidden' in detail:
+        return 'forbidden'
+
+    return 'client_error'
+
+
+def check_page(response, page=None):
+    """
+    The decoded page of response, raising a CollectionError when the request
+    failed, or when the page holds only `errors` (e.g. the followers of a
+    suspended account)
+    """
+    kind = classify_status(response.status_code)
+
+    if kind is not None:
+        raise CollectionError(kind, response.status_code, response.text[:200])
+
+    if page is not None and 'data' not in page and page.get('errors'):
+        error = page['errors'][0]
+        raise CollectionError(classify_error(error), response.status_code, error.get('detail', error.get('title', '')))
+
+    return page
+
+
+def page_errors(page):
+    """
+    (id, failure class, detail) of every entry of the `errors` array of a
+    page, e.g. the ids of a lookup that were not found
+    """
+    return [
+        (error.get('resource_id', error.get('value')), classify_error(error), error.get('detail', ''))
+        for error in page.get('errors', [])
+    ]
+
+
+def describe(error):
+    """(failure class, status, detail) of an exception"""
+
+    if isinstance(error, CollectionError):
+        return error.kind, error.status, error.detail
+
+    if isinstance(error, (requests.Timeout, requests.ConnectionError)):
+        return 'timeout', None, str(error)
+
+    return 'error', None, repr(error)
+
+
+class DeadLetters:
+
+    """File of the items a collection could not get
+
+    Every failed handle, account, tweet or conversation is appended as a JSON
+    line with its collection (e.g. `followers`), failure class, status and
+    detail. Items that later succeed are marked resolved, so `pending()`
+    gives what is still missing, ready to be passed back to a streamer:
+
+        dead = DeadLetters('dead_letters.jsonl')
+        TweepleStreamer(dead.pending('followers'), token, dead_letters=dead).followers_lookup()
+
+    ...
+    Attributes
+    ----------
+    path : str
+        JSON lines file the failures are appended to
+
+    Methods
+    -------
+    add()
+        Records a failure
+    resolve()
+        Marks items as collected
+    entries()
+        Last failure of every item still failing
+    pending()
+        Items of a collection still failing
+    """
+
+    def __init__(self, path='dead_letters.jsonl'):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def _append(self, records):
+        with self.lock, open(self.path, 'a') as file:
+            for record in records:
+                file.write(json.dumps(record) + '\n')
+
+    def add(self, collection, item, kind, status=None, detail=''):
+        """
+        Record that item of collection failed with kind
+        """
+        self._append([{
+            'collection': collection, 'item': str(item), 'kind': kind, 'status': status,
+            'detail': detail, 'time': time.time()
+        }])
+
+    def resolve(self, collection, items):
+        """
+        Mark the items of collection that were failing as collected
+        """
+        failing = set(self.pending(collection))
+        resolved = [str(item) for item in items if str(item) in failing]
+
+        self._append([{'collection': collection, 'item': item, 'kind': 'resolved', 'time': time.time()}
+                      for item in resolved])
+
+        return resolved
+
+    def entries(self, collection=None, kinds=None):
+        """
+        Last failure of every item still failing, with the number of times
+        it failed (`failures`), oldest first
+        """
+        if not os.path.exists(self.path):
+            return []
+
+        latest = {}
+
+        with self.lock, open(self.path) as file:
+            for line in file:
+                record = json.loads(line)
+                key = (record['collection'], record['item'])
+                if record['kind'] == 'resolved':
+                    latest.pop(key, None)
+                else:
+                    record['failures'] = latest[key]['failures'] + 1 if key in latest else 1
+                    latest[key] = record
+
+        return [
+            record for record in latest.values()
+            if (collection is None or record['collection'] == collection)
+            and (kinds is None or record['kind'] in kinds)
+        ]
+
+    def pending(self, collection, kinds=None):
+        """
+        Items of collection still failing, optionally only those failing
+        with one of kinds (e.g. `TRANSIENT`)
+        """
+        return [record['item'] for record in self.entries(collection, kinds)]
+
+
+def open_dead_letters(dead_letters):
+    """DeadLetters at a path, the default file for True, the given one, or None"""
+
+    if dead_letters is None or dead_letters is False:
+        return None
+
+    if isinstance(dead_letters, DeadLetters):
+        return dead_letters
+
+    if dead_letters is True:
+        return DeadLetters()
+
+    return DeadLetters(dead_letters)
+
+
+def record_failure(dead_letters, collection, item, error=None):
+    """
+    Record the exception being handled (or error) as a failure of item, in
+    dead_letters when there are some. Returns its failure class
+    """
+    error = error if error is not None else sys.exc_info()[1]
+    kind, status, detail = describe(error)
+
+    if dead_letters is not None:
+        dead_letters.add(collection, item, kind, status, detail)
+
+    return kind
@@ -0,0 +1,139 @@
+# ============================================================================
+
+# Typed schemas of tweets and users
+
+# ============================================================================
+import pandas as pd
+import pyarrow as pa
+
+from .DecodeTweetPle import TWEET, USER
+
+DICTIONARY = pa.dictionary(pa.int32(), pa.string())
+TIMESTAMP = pa.timestamp('ms', tz='UTC')
+
+# Columns whose type differs from the layout they are decoded against: ids
+# are integers, dates are timestamps and low-cardinality strings are
+# dictionary-encoded.
+TWEET_TYPES = {
+    'id': pa.int64(),
+    'author_id': pa.int64(),
+    'conversation_id': pa.int64(),
+    'in_reply_to_user_id': pa.int64(),
+    'created_at': TIMESTAMP,
+    'lang': DICTIONARY,
+    'reply_settings': DICTIONARY,
+    'source': DICTIONARY,
+}
+
+USER_TYPES = {
+    'id': pa.int64(),
+    'pinned_tweet_id': pa.int64(),
+    'created_at': TIMESTAMP,
+}
+
+_PANDAS_TYPES = {pa.int64(): pd.Int64Dtype(), pa.bool_(): pd.BooleanDtype()}
+
+
+def flat_fields(layout, prefix=''):
+    """(dotted name, type) of every non-struct field of a nested layout"""
+
+    for field in layout:
+        name = prefix + field.name
+        if pa.types.is_struct(field.type):
+            yield from flat_fields(field.type, name + '.')
+        else:
+            yield name, field.type
+
+
+def flat_schema(layout, types):
+    """Flat schema of a layout, with the column types overridden by types"""
+
+    return pa.schema([(name, types.get(name, type)) for name, type in flat_fields(layout)])
+
+
+TWEET_SCHEMA = flat_schema(TWEET, TWEET_TYPES)
+USER_SCHEMA = flat_schema(USER, USER_TYPES)
+
+
+def _nested(type):
+    return pa.types.is_list(type) or pa.types.is_struct(type)
+
+
+def convert(values, type):
+    """Arrow array of a column (pandas Series or Arrow array) of the given type
+
+    Ids given as strings are parsed, timestamps as ISO 8601 strings too.
+    Nested values (entities, referenced tweets...) are converted from their
+    Python objects; fields the type does not list are dropped.
+    """
+    if isinstance(values, pd.Series):
+        if _nested(type):
+            return pa.array(
+                [value if isinstance(value, (list, dict)) or hasattr(value, 'tolist') else None
+                 for value in values],
+                type=type
+            )
+        try:
+            values = pa.array(values, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            values = pa.array([None if pd.isna(value) else str(value) for value in values])
+
+    if values.type == type:
+        return values
+
+    try:
+        return values.cast(type)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        if type != TIMESTAMP:
+            raise
+        # ISO 8601 variants Arrow does not parse
+        return pa.array(pd.to_datetime(values.to_pandas(), utc=True)).cast(type)
+
+
+def to_table(data, schema):
+    """Arrow table of a dataframe or table, conformed to schema
+
+    Columns listed in schema get its type, other columns (e.g. `handle` or
+    `date_consulted`) keep the type inferred from their values.
+    """
+    if isinstance(data, pa.Table):
+        columns = {name: data.column(name).combine_chunks() for name in data.column_names}
+    else:
+        columns = {name: data[name] for name in data.columns}
+
+    arrays = []
+
+    for name, values in columns.items():
+        if name in schema.names:
+            arrays.append(convert(values, schema.field(name).type))
+        elif isinstance(values, pd.Series):
+            arrays.append(pa.array(values, from_pandas=True))
+        else:
+            arrays.append(values)
+
+    return pa.Table.from_arrays(arrays, names=list(columns))
+
+
+def conform(df, schema):
+    """Dataframe with the columns listed in schema converted to its types
+
+    Ids and metrics become nullable integers, dates timezone-aware
+    timestamps and dictionary-encoded strings categoricals. Nested columns
+    keep their Python objects.
+    """
+    df = df.copy(deep=False)
+
+    for field in schema:
+        if field.name in df.columns and not _nested(field.type):
+            array = convert(df[field.name], field.type)
+            column = pa.table({'column': array}).to_pandas(types_mapper=_PANDAS_TYPES.get)['column']
+            column.index = df.index
+            df[field.name] = column
+
+    return df
+
+
+def blank_frame(columns, schema):
+    """Empty dataframe with the given columns, typed after schema"""
+
+    return conform(pd.DataFrame(columns=columns), schema)
@@ -0,0 +1,172 @@
+# ============================================================================
+
+# Index of the ids already collected
+
+# ============================================================================
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+class SeenIndex:
+
+    """Persistent set of the tweet or user ids already collected
+
+    Ids are snowflakes, kept as a sorted int64 array in a `.npy` file that
+    is memory-mapped on load; membership of a batch of ids is one binary
+    search over it.
+
+    ...
+    Attributes
+    ----------
+    path : str
+        `.npy` file holding the index, None to keep it in memory
+    ids : numpy.ndarray
+        sorted ids collected so far
+
+    Methods
+    -------
+    contains()
+        Whether each id was already collected
+    partition()
+        Splits ids into new ones, repeated ones and ones already collected
+    add()
+        Records ids as collected
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+        if path is not None and os.path.exists(path):
+            self.ids = np.load(path, mmap_mode='r')
+        else:
+            self.ids = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id):
+        return bool(self.contains(np.array([int(id)], dtype=np.int64))[0])
+
+    def contains(self, ids):
+        """
+        Whether each id of an int64 array was already collected
+        """
+        if len(self.ids) == 0:
+            return np.zeros(len(ids), dtype=bool)
+
+        position = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+
+        return np.asarray(self.ids[position]) == ids
+
+    def partition(self, ids):
+        """
+        Split ids into those to request, repeated ones and collected ones
+
+        Ids that are not numeric are never considered collected.
+
+        Parameters
+        ----------
+        ids : list
+            tweet or user ids, in the order they were given
+
+        Returns
+        -------
+        fresh : list
+            first occurrence of each id not collected yet, in input order
+        duplicates : list
+            later occurrences of an id
+        seen : list
+            ids collected by a previous run
+        """
+        ids = pd.Series([str(id) for id in ids], dtype=object)
+        repeated = ids.duplicated().to_numpy()
+
+        numeric, numbers = _parse_ids(ids)
+        collected = np.zeros(len(ids), dtype=bool)
+        collected[numeric] = self.contains(numbers)
+        collected &= ~repeated
+
+        fresh = ~repeated & ~collected
+
+        return ids[fresh].tolist(), ids[repeated].tolist(), ids[collected].tolist()
+
+    def add(self, ids):
+        """
+        Record ids as collected and save the index, returns how many were new
+        """
+        ids = np.unique(_parse_ids(ids)[1])
+
+        with self.lock:
+            new = ids[~self.contains(ids)]
+            if len(new) == 0:
+                return 0
+
+            merged = np.union1d(self.ids, new)
+            if self.path is None:
+                self.ids = merged
+                return len(new)
+
+            tmp = self.path + '.tmp.npy'
+            np.save(tmp, merged)
+            os.replace(tmp, self.path)
+            self.ids = np.load(self.path, mmap_mode='r')
+
+        return len(new)
+
+
+def _parse_ids(ids):
+    """
+    Mask of the ids made of decimal digits that fit an int64, and their
+    values, parsed one by one: going through floats rounds snowflake ids
+    """
+    texts = [str(id) for id in ids]
+    numeric = np.array([text.isascii() and text.isdigit() and int(text) < 2 ** 63 for text in texts], dtype=bool)
+    numbers = np.array([int(text) for text, keep in zip(texts, numeric) if keep], dtype=np.int64)
+
+    return numeric, numbers
+
+
+def open_seen(seen, path):
+    """SeenIndex at path when seen is True, the given index, or None"""
+
+    if seen is None or seen is False:
+        return None
+
+    if isinstance(seen, SeenIndex):
+        return seen
+
+    if isinstance(seen, str):
+        path = seen
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    return SeenIndex(path)
+
+
+def drop_repeated(ids, seen=None):
+    """Ids left to request once repeated and collected ones are dropped
+
+    Parameters
+    ----------
+    ids : list
+        ids given to a lookup
+    seen : SeenIndex
+        ids collected by previous runs, None to only drop repeated ids
+
+    Returns
+    -------
+    ids : list
+        ids to request
+    dropped : dict
+        `duplicates` and `seen` ids that were dropped
+    """
+    if seen is None:
+        seen = SeenIndex(None)
+
+    ids, duplicates, collected = seen.partition(ids)
+
+    return ids, {'duplicates': duplicates, 'seen': collected}
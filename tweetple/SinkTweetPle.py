@@ -0,0 +1,188 @@
+# ============================================================================
+
+# Bounded-memory Parquet output
+
+# ============================================================================
+import os
+import shutil
+import threading
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .SchemaTweetPle import to_table
+from .MetricsTweetPle import timed
+
+PART = 'part-{:05d}.parquet'
+
+
+class ParquetSink:
+
+    """Streams collected pages to Parquet in bounded memory
+
+    Collectors hand the sink a dataframe every `flush_pages` pages. Each flush
+    is written through a `pyarrow.parquet.ParquetWriter` as a complete part
+    file, first under a temporary name and then renamed into place, so the
+    dataset at `path` is readable at any time, even if the process is killed
+    halfway through an account.
+
+    ...
+    Attributes
+    ----------
+    path : str
+        directory holding the part files, e.g. `./zorroyanez.parquet`
+    flush_pages : int
+        number of pages buffered in memory before they are written
+    schema : pyarrow.Schema or None
+        schema every part is conformed to (e.g. `TWEET_SCHEMA`), columns it
+        does not list keep their inferred type; when None each part keeps
+        the schema inferred from its own rows
+    compression : str
+        Parquet compression codec
+    parts : int
+        number of part files in `path`
+    rows : int
+        rows written through this sink
+    pipeline : Pipeline or None
+        threads page buffers normalize and write this sink's pages on
+
+    Methods
+    -------
+    write()
+        Writes a dataframe as a new part file
+    reset()
+        Removes previous output at `path`
+    close()
+        Removes leftovers of interrupted writes
+    """
+
+    def __init__(self, path, flush_pages=50, schema=None, compression='snappy', mode='w', pipeline=None):
+        """
+        Parameters
+        ----------
+        path : str
+            directory the part files are written to
+        flush_pages : int
+            number of pages buffered before they are written
+        schema : pyarrow.Schema
+            schema every part is conformed to
+        compression : str
+            Parquet compression codec
+        mode : str
+            'w' replaces previous output at `path`, 'a' adds parts to it
+        pipeline : Pipeline
+            when given, page buffers flushing to this sink normalize and
+            write on the pipeline's threads instead of the collector's
+        """
+        self.path = path
+        self.pipeline = pipeline
+        self.flush_pages = flush_pages
+        self.schema = schema
+        self.compression = compression
+        self.rows = 0
+        self.lock = threading.Lock()
+
+        if mode == 'w':
+            self.reset()
+
+        self.parts = len(part_files(path))
+
+    def write(self, df):
+        """
+        Write a dataframe, or a pyarrow Table, as a new part file
+        """
+        if df is None or len(df) == 0:
+            return 0
+
+        with timed('write'):
+            return self._write(df)
+
+    def _write(self, df):
+        if self.schema is not None:
+            table = to_table(df, self.schema)
+        elif isinstance(df, pa.Table):
+            table = df
+        else:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+
+        os.makedirs(self.path, exist_ok=True)
+
+        # several collectors (e.g. time windows of one handle) may share a sink
+        with self.lock:
+            name = PART.format(self.parts)
+            self.parts += 1
+
+        tmp = os.path.join(self.path, '.{}.tmp'.format(name))
+
+        with pq.ParquetWriter(tmp, table.schema, compression=self.compression) as writer:
+            writer.write_table(table)
+
+        os.replace(tmp, os.path.join(self.path, name))
+
+        with self.lock:
+            self.rows += len(df)
+
+        return len(df)
+
+    def reset(self):
+        """
+        Remove previous output at `path`
+        """
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+
+        self.parts = 0
+
+    def close(self):
+        """
+        Remove leftovers of interrupted writes
+        """
+        if not os.path.isdir(self.path):
+            return
+
+        for name in os.listdir(self.path):
+            if name.endswith('.tmp'):
+                os.remove(os.path.join(self.path, name))
+
+
+def write_parquet(df, path, schema=None):
+    """Writes a dataframe to a single Parquet file, conformed to schema"""
+
+    with timed('write'):
+        if schema is None:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+        else:
+            table = to_table(df, schema)
+
+        pq.write_table(table, path)
+
+
+def part_files(path):
+    """Sorted part files written by a `ParquetSink` at path"""
+
+    if not os.path.isdir(path):
+        return []
+
+    return sorted(
+        os.path.join(path, name) for name in os.listdir(path)
+        if name.startswith('part-') and name.endswith('.parquet')
+    )
+
+
+def read_parquet_parts(path):
+    """Reads the output of a `ParquetSink` into one dataframe
+
+    Parts are read one by one, so parts whose inferred schemas differ (e.g. a
+    column that is empty in the first pages) are still combined.
+    """
+    if not os.path.isdir(path):
+        return pd.read_parquet(path)
+
+    frames = [pd.read_parquet(part) for part in part_files(path)]
+
+    if not frames:
+        return pd.DataFrame()
+
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,284 @@
+# ============================================================================
+
+# Array-backed conversation trees built from get_threads output
+
+# ============================================================================
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from concurrent.futures import ProcessPoolExecutor
+from .SchemaTweetPle import TWEET_SCHEMA, to_table
+from .SinkTweetPle import part_files
+
+
+class ConversationTree:
+
+    """Reply tree of a conversation held in flat numpy arrays
+
+    Node 0 is the tweet that started the conversation; it is added when the
+    collection does not include it. Every other node is a reply, attached to
+    the tweet it `replied_to`, or to the root when that tweet was not
+    collected (e.g. it was deleted). Children of node i are
+    `children[offsets[i]:offsets[i + 1]]`.
+
+    ...
+    Attributes
+    ----------
+    conversation_id : int
+        id of the tweet that started the conversation
+    ids : numpy.ndarray
+        tweet id of each node
+    parent : numpy.ndarray
+        index of each node's parent, -1 for the root
+    offsets : numpy.ndarray
+        start of each node's children in `children`, one more than nodes
+    children : numpy.ndarray
+        node indices grouped by parent
+    depth : numpy.ndarray
+        replies between each node and the root
+    size : numpy.ndarray
+        nodes in the subtree of each node, itself included
+    levels : list
+        node indices at each depth, root first
+
+    Methods
+    -------
+    branching()
+        Number of direct replies to each node
+    leaves()
+        Indices of the nodes nobody replied to
+    paths()
+        Root-to-leaf paths as a padded matrix of tweet ids
+    summary()
+        Shape of the conversation
+    """
+
+    def __init__(self, conversation_id, ids, parent_ids):
+        """
+        Parameters
+        ----------
+        conversation_id : int
+            id of the tweet that started the conversation
+        ids : numpy.ndarray
+            tweet ids of the collected tweets
+        parent_ids : numpy.ndarray
+            id of the tweet each one replied to, -1 when unknown
+        """
+        self.conversation_id = int(conversation_id)
+
+        ids, first = np.unique(np.asarray(ids, dtype=np.int64), return_index=True)
+        parent_ids = np.asarray(parent_ids, dtype=np.int64)[first]
+
+        # the root goes first, whether or not it was collected
+        replies = ids != self.conversation_id
+        self.ids = np.concatenate([[self.conversation_id], ids[replies]])
+        parent_ids = parent_ids[replies]
+
+        order = np.argsort(self.ids)
+        position = np.searchsorted(self.ids, parent_ids, sorter=order)
+        position = np.minimum(position, len(self.ids) - 1)
+        candidate = order[position]
+        found = self.ids[candidate] == parent_ids
+
+        self.parent = np.concatenate([[-1], np.where(found, candidate, 0)]).astype(np.int64)
+
+        # a tweet cannot reply to a later one: cycles of bad data go to the root
+        later = self.ids[self.parent[1:]] > self.ids[1:]
+        self.parent[1:][later] = 0
+
+        counts = np.bincount(self.parent[1:], minlength=len(self.ids))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self.children = (np.argsort(self.parent[1:], kind='stable') + 1).astype(np.int64)
+
+        self.levels = self._levels()
+        self.depth = np.zeros(len(self.ids), dtype=np.int64)
+        for depth, nodes in enumerate(self.levels):
+            self.depth[nodes] = depth
+
+        self.size = np.ones(len(self.ids), dtype=np.int64)
+        for nodes in reversed(self.levels[1:]):
+            np.add.at(self.size, self.parent[nodes], self.size[nodes])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _levels(self):
+        """Node indices at each depth, walking the child offsets level by level"""
+
+        levels = [np.array([0], dtype=np.int64)]
+
+        while True:
+            starts = self.offsets[levels[-1]]
+            lengths = self.offsets[levels[-1] + 1] - starts
+            if lengths.sum() == 0:
+                return levels
+            levels.append(self.children[_ranges(starts, lengths)])
+
+    def branching(self):
+        """
+        Number of direct replies to each node
+        """
+        return np.diff(self.offsets)
+
+    def leaves(self):
+        """
+        Indices of the nodes nobody replied to
+        """
+        return np.flatnonzero(self.branching() == 0)
+
+    def paths(self):
+        """
+        Root-to-leaf paths, one row per leaf, as tweet ids padded with -1
+        """
+        leaves = self.leaves()
+        depth = self.depth[leaves]
+        paths = np.full((len(leaves), int(depth.max()) + 1 if len(leaves) else 1), -1, dtype=np.int64)
+
+        rows = np.arange(len(leaves))
+        nodes = leaves.copy()
+        for step in range(paths.shape[1]):
+            alive = depth - step >= 0
+            paths[rows[alive], (depth - step)[alive]] = self.ids[nodes[alive]]
+            nodes[alive] = np.maximum(self.parent[nodes[alive]], 0)
+
+        return paths
+
+    def summary(self):
+        """
+        Shape of the conversation: size, depth and branching
+        """
+        branching = self.branching()
+        internal = branching[branching > 0]
+
+        return {
+            'conversation_id': self.conversation_id,
+            'n_tweets': len(self.ids),
+            'n_leaves': int((branching == 0).sum()),
+            'max_depth': int(self.depth.max()),
+            'mean_depth': float(self.depth[1:].mean()) if len(self.ids) > 1 else 0.0,
+            'max_branching': int(branching.max()),
+            'mean_branching': float(internal.mean()) if len(internal) else 0.0,
+            'root_replies': int(branching[0]),
+        }
+
+
+def _ranges(starts, lengths):
+    """Concatenation of range(start, start + length) for each pair, vectorized"""
+
+    ends = np.cumsum(lengths)
+    steps = np.ones(ends[-1], dtype=np.int64)
+    nonempty = lengths > 0
+    starts, ends, lengths = starts[nonempty], ends[nonempty], lengths[nonempty]
+    steps[0] = starts[0]
+    steps[ends[:-1]] = starts[1:] - (starts[:-1] + lengths[:-1] - 1)
+
+    return np.cumsum(steps)
+
+
+def reply_parents(table):
+    """Id of the tweet each row of a table replied to, -1 when none
+
+    Parameters
+    ----------
+    table : pyarrow.Table
+        tweets with a `referenced_tweets` column
+
+    Returns
+    -------
+    parents : numpy.ndarray
+        int64 id replied to, per row
+    """
+    parents = np.full(table.num_rows, -1, dtype=np.int64)
+
+    if 'referenced_tweets' not in table.column_names or table.num_rows == 0:
+        return parents
+
+    column = table.column('referenced_tweets').combine_chunks()
+    rows = pc.list_parent_indices(column).to_numpy()
+    references = pc.list_flatten(column)
+
+    if len(references) == 0:
+        return parents
+
+    replied = pc.and_(
+        pc.fill_null(pc.equal(references.field('type'), 'replied_to'), False),
+        pc.is_valid(references.field('id'))
+    ).to_numpy(zero_copy_only=False)
+    ids = references.field('id').filter(pa.array(replied)).cast(pa.int64()).to_numpy()
+    parents[rows[replied]] = ids
+
+    return parents
+
+
+def build_tree(data, conversation_id=None):
+    """Conversation tree of the replies collected for a conversation
+
+    Parameters
+    ----------
+    data : dataframe or pyarrow.Table
+        rows of `GetRepliesAssociatedToTweet`
+    conversation_id : int
+        conversation the rows belong to, read from the rows when None
+
+    Returns
+    -------
+    tree : ConversationTree
+    """
+    table = to_table(data, TWEET_SCHEMA)
+
+    if conversation_id is None:
+        conversation_id = table.column('conversation_id').combine_chunks()[0].as_py()
+
+    ids = table.column('id').combine_chunks().to_numpy(zero_copy_only=False)
+
+    return ConversationTree(conversation_id, ids, reply_parents(table))
+
+
+def read_thread(path):
+    """Table of the columns of a `get_threads` output the tree needs"""
+
+    columns = ['id', 'conversation_id', 'referenced_tweets']
+    files = part_files(path) if os.path.isdir(path) else [path]
+    tables = [pq.read_table(name, columns=columns) for name in files]
+
+    return pa.concat_tables(tables)
+
+
+def load_tree(path):
+    """Conversation tree of a `get_threads` output, e.g. `./1234.parquet`"""
+
+    conversation_id = os.path.basename(os.path.normpath(path)).split('.')[0]
+
+    return build_tree(read_thread(path), int(conversation_id))
+
+
+def _summarize(path):
+    return load_tree(path).summary()
+
+
+def summarize_threads(paths, processes=None, chunksize=16):
+    """Shape of many conversations, built in parallel
+
+    Parameters
+    ----------
+    paths : list
+        outputs of `get_threads`, one per conversation
+    processes : int
+        worker processes, defaults to the number of CPUs
+    chunksize : int
+        conversations handed to a worker at a time
+
+    Returns
+    -------
+    summary : dataframe
+        one row per conversation: tweets, leaves, depth and branching
+    """
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        rows = list(executor.map(_summarize, paths, chunksize=chunksize))
+
+    return pd.DataFrame(rows)
@@ -0,0 +1,214 @@
+# ============================================================================
+
+# HTTP transport shared by every collector
+
+# ============================================================================
+import time
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from .RateLimitTweetPle import RateLimiter, TokenPool
+from .MetricsTweetPle import get_metrics
+from .RetryTweetPle import RetryPolicy, classify_status
+
+API_URL = 'https://api.twitter.com'
+
+
+class Transport:
+
+    """Pooled HTTP transport shared by collectors and streamers
+
+    ...
+    Attributes
+    ----------
+    base_url : str
+        host requests are sent to, replaces `https://api.twitter.com` so
+        calls can be pointed at a local stand-in server
+    timeout : float
+        seconds to wait for the server before giving up
+    session : requests.Session
+        session holding the keep-alive connection pool
+    rate_limiter : RateLimiter
+        per-endpoint scheduler every request waits on
+    max_retries : int
+        times a request throttled with a 429, failed with a 5xx or timed
+        out (or, with a TokenPool, sent with a revoked token) is sent again
+    retry : RetryPolicy
+        failures retried and the jittered wait before each retry
+
+    Methods
+    -------
+    headers()
+        Authorization headers for a bearer token
+    resolve()
+        Rewrites a Twitter API url against `base_url`
+    get()
+        Sends a GET request through the connection pool
+    close()
+        Closes pooled connections
+    """
+
+    def __init__(self, base_url=API_URL, pool_connections=10, pool_maxsize=32, timeout=60, rate_limiter=None, max_retries=5, retry=None):
+        """
+        Parameters
+        ----------
+        base_url : str
+            host requests are sent to
+            Defaults to `https://api.twitter.com`
+        pool_connections : int
+            number of hosts to keep pools for
+        pool_maxsize : int
+            maximum number of keep-alive connections per host
+        timeout : float
+            seconds to wait for the server before giving up
+        rate_limiter : RateLimiter
+            scheduler requests wait on, defaults to a new one
+        max_retries : int
+            times a request failing transiently is sent again
+        retry : RetryPolicy
+            failures retried and the wait before each retry, defaults to
+            a new one
+        """
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.max_retries = max_retries
+        self.retry = retry or RetryPolicy()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize
+
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._headers = {}
+
+    def headers(self, bearer_token):
+        """
+        Authorization headers for a bearer token (or a TokenPool), built
+        once per token
+        """
+        if isinstance(bearer_token, TokenPool):
+            # the token is only chosen when the request is sent
+            return self._headers.setdefault(bearer_token, {"Authorization": bearer_token})
+
+        if bearer_token not in self._headers:
+            self._headers[bearer_token] = {
+                "Authorization": "Bearer {}".format(bearer_token)
+            }
+
+        return self._headers[bearer_token]
+
+    def resolve(self, url):
+        """
+        Rewrite a Twitter API url against `base_url`
+        """
+        if url.startswith(API_URL):
+            return self.base_url + url[len(API_URL):]
+
+        return url
+
+    def get(self, url, headers=None, params=None):
+        """
+        Send a GET request through the connection pool once its endpoint's
+        rate-limit bucket allows it, retrying requests throttled with a 429
+        at once (the rate limiter already waits for the window to reset) and
+        5xx responses and timeouts after a jittered backoff. Permanent
+        failures (401, 403, 404...) are returned straight away
+
+        With a TokenPool as Authorization, every attempt goes out with the
+        pool's token that has the most requests left, and tokens the API
+        rejects as unauthorized are dropped from the pool.
+        """
+        credential = headers.get('Authorization') if headers else None
+        pool = credential if isinstance(credential, TokenPool) else None
+        metrics = get_metrics()
+
+        for attempt in range(self.max_retries + 1):
+
+            start = time.perf_counter()
+
+            if pool is not None:
+                credentials = pool.credentials()
+                if not credentials:
+                    raise RuntimeError('every bearer token of the pool was revoked')
+                credential = self.rate_limiter.acquire_any(url, credentials)
+                headers = dict(headers, Authorization=credential)
+            else:
+                self.rate_limiter.acquire(url, credential)
+
+            sent = time.perf_counter()
+
+            try:
+                response = self.session.get(
+
+                    self.resolve(url),
+                    headers=headers,
+                    params=params,
+                    timeout=self.timeout
+
+                )
+            except (requests.Timeout, requests.ConnectionError):
+                if metrics is not None:
+                    metrics.request(url, 'timeout', time.perf_counter() - sent, 0, sent - start, attempt > 0)
+                if attempt == self.max_retries or not self.retry.retryable('timeout'):
+                    raise
+                time.sleep(self.retry.delay(attempt))
+                continue
+
+            if metrics is not None:
+                metrics.request(url, response.status_code, time.perf_counter() - sent,
+                                len(response.content), sent - start, attempt > 0)
+
+            self.rate_limiter.update(url, response, credential)
+
+            if pool is not None and response.status_code == 401:
+                pool.revoke(credential)
+                if len(pool):
+                    continue
+
+            kind = classify_status(response.status_code)
+
+            if kind == 'rate_limited':
+                continue
+
+            if self.retry.retryable(kind) and attempt < self.max_retries:
+                time.sleep(self.retry.delay(attempt))
+                continue
+
+            break
+
+        return response
+
+    def close(self):
+        """
+        Close pooled connections
+        """
+        self.session.close()
+
+
+_transport = None
+
+
+def get_transport():
+    """Returns the transport shared by every collector, creating it on first use"""
+
+    global _transport
+
+    if _transport is None:
+        _transport = Transport()
+
+    return _transport
+
+
+def set_transport(transport):
+    """Replaces the shared transport, e.g. to point every collector at a local server"""
+
+    global _transport
+
+    _transport = transport
+
+    return transport
@@ -3,14 +3,25 @@
 # ============================================================================
 
 import logging
-import tqdm
 import time
 import validators
 
-from tqdm import tqdm
 from datetime import date
-from .TwitterFullArchive import GetStatsFromTweets, GetTweetsFromUser, GetStatsFromUsers, GetInteractionsAssociatedToLink, GetFollowers, GetTweetplerInteracting, GetRepliesAssociatedToTweet
-from .AuxTweetPle import df_tweets_stats, df_users_stats, roundup, aggregate_twitter_metrics, twitter_df
+from .TwitterFullArchive import GetStatsFromTweets, GetTweetsFromUser, GetTweetsFromUsers, GetStatsFromUsers, GetInteractionsAssociatedToLink, GetInteractionsAssociatedToLinks, GetFollowers, GetTweetplerInteracting, GetRepliesAssociatedToTweet, TWEET_LOOKUP_PARAMS, USER_LOOKUP_PARAMS
+from .AuxTweetPle import df_tweets_stats, df_users_stats, roundup, aggregate_twitter_metrics, twitter_df, concat_frames, pack_queries, INCLUDES
+from .TransportTweetPle import get_transport
+from .RateLimitTweetPle import token_pool
+from .ConcurrencyTweetPle import run_concurrently
+from .SinkTweetPle import ParquetSink, write_parquet
+from .SchemaTweetPle import TWEET_SCHEMA, USER_SCHEMA, conform
+from .CheckpointTweetPle import CheckpointStore, open_checkpoint
+from .CacheTweetPle import open_cache
+from .GraphTweetPle import open_graph
+from .SeenTweetPle import open_seen, drop_repeated
+from .PipelineTweetPle import open_pipeline, close_pipeline
+from .PlanTweetPle import QueryPlanner
+from .DatasetTweetPle import open_dataset, run_key
+from .RetryTweetPle import open_dead_letters, record_failure
 
 
 class TweepleStreamer:
@@ -26,8 +37,57 @@ class TweepleStreamer:
     save : Boolean
         To save information
         Defaults to False
-    bearer_token : str
-        Bearer token
+    bearer_token : str, list or TokenPool
+        Bearer token, or several pooled into a TokenPool: each request goes
+        out with the token that has the most requests left
+    transport : Transport
+        Pooled HTTP transport shared by every call
+        Defaults to the package-wide transport
+    concurrency : int
+        Number of ids (or batches of ids) requested at once
+        Defaults to 1
+    flush_pages : int
+        Pages kept in memory before they are written to disk
+        Defaults to 50
+    checkpoint : str or CheckpointStore
+        SQLite journal of pagination progress; reruns resume each id where
+        it stopped instead of starting over
+        Defaults to None (no checkpoints)
+    crawl : str
+        Label of the crawl in the checkpoint journal: a rerun with the same
+        label resumes it, one with a new label collects every id again
+        Defaults to the date the streamer is created
+    cache : str or ResponseCache
+        On-disk cache of looked-up users; users looked up within its TTL are
+        served locally and only the rest is requested
+        Defaults to None (no cache)
+    graph : str or FollowerGraph
+        Follower-graph store `followers_lookup` adds its results to: edges
+        are kept once as sorted id arrays, profiles once per user, and
+        recrawls are recorded as added and removed edges. The per-account
+        outputs are removed once they are in the store
+        Defaults to None (one Parquet output per account)
+    seen : Boolean, str or SeenIndex
+        Index of the users already looked up (`seen_users.npy` in
+        `path_save`); `user_lookup` skips them, and each run adds its users
+        as a new part of the saved output
+        Defaults to False (every id is requested)
+    pipeline : int or Pipeline
+        Normalize and write pages on this many worker threads (or on the
+        given Pipeline) while the next pages are fetched; the threads
+        started for a number are stopped when each collection returns
+        Defaults to None (pages are written between fetches)
+    dataset : str or TweetDataset
+        Write every output to a dataset partitioned by kind of collection
+        and date (`kind=followers/date=2022-01-31/783214.parquet`) instead
+        of `path_save`; each `user_lookup` run is a new key of kind `users`
+        Defaults to None (flat files in `path_save`)
+    dead_letters : Boolean, str or DeadLetters
+        File (`dead_letters.jsonl` for True) the ids that failed are
+        recorded in, with why they failed (e.g. `not_found`, `suspended`,
+        `server_error`); ids that succeed on a later run are marked resolved,
+        so `DeadLetters.pending()` gives what a replay should collect
+        Defaults to None (failures are only logged)
 
     Methods
     -------
@@ -37,12 +97,25 @@ class TweepleStreamer:
         Followers lookup
     """
 
-    def __init__(self, ids, bearer_token, save=False, path_save='./'):
-        self.bearer_token = bearer_token
+    def __init__(self, ids, bearer_token, save=False, path_save='./', transport=None, concurrency=1, flush_pages=50, checkpoint=None, cache=None, graph=None, seen=False, pipeline=None, dataset=None, dead_letters=None, crawl=None):
+        self.bearer_token = token_pool(bearer_token)
         self.ids = ids
         self.file_name = 'tweeplers'
         self.path_save = path_save
         self.save = save
+        self.transport = transport or get_transport()
+        self.concurrency = concurrency
+        self.flush_pages = flush_pages
+        self.checkpoint = open_checkpoint(checkpoint)
+        self.sink_mode = 'w' if self.checkpoint is None else 'a'
+        self.crawl = crawl or str(date.today())
+        self.cache = open_cache(cache)
+        self.graph = open_graph(graph)
+        self.pipeline = pipeline
+        self.seen = open_seen(seen, f'{path_save}seen_users.npy')
+        self.dropped = {'duplicates': [], 'seen': []}
+        self.dataset = open_dataset(dataset)
+        self.dead_letters = open_dead_letters(dead_letters)
 
     def user_lookup(self):
         """Retrieves tweetples' information
@@ -54,21 +127,51 @@ class TweepleStreamer:
 
         df_stats = df_users_stats()
 
-        end = roundup(len(self.ids)) + 100
+        ids, self.dropped = drop_repeated(self.ids, self.seen)
+        logging.info("Ids dropped: {} repeated, {} already collected".format(
+            len(self.dropped['duplicates']), len(self.dropped['seen'])))
+        if self.cache is not None:
+            # cached ids go last, so they fill whole batches that need no call
+            missing, cached = self.cache.partition(
+                '/2/users', ids, USER_LOOKUP_PARAMS)
+            ids = missing + cached
+
+        end = roundup(len(ids)) + 100
         bounds = list(range(0, end, 100))
-        for prev, curr in tqdm(zip(bounds, bounds[1:])):
-            stat = GetStatsFromUsers(self.ids[prev:curr], self.bearer_token)
-            df_stats = df_stats.append(
-                stat.main(),
-                ignore_index=True
-            )
+
+        missing = []
+
+        def lookup(bound):
+            prev, curr = bound
+            collector = GetStatsFromUsers(
+                ids[prev:curr], self.bearer_token, self.transport, self.cache)
+            df = collector.main()
+            missing.extend(collector.errors)
+            return df
+
+        df_stats = conform(concat_frames(
+            run_concurrently(lookup, zip(bounds, bounds[1:]), self.concurrency),
+            blank=df_stats
+        ), USER_SCHEMA)
+        record_missing(self.dead_letters, 'users', missing, df_stats['id'])
         if self.save:
-            df_stats.to_parquet(f'{self.path_save}{self.file_name}.parquet')
+            save_lookup(df_stats, self.lookup_path('users'), USER_SCHEMA, self.seen is not None or self.dataset is not None)
+        if self.seen is not None:
+            self.seen.add(df_stats['id'])
         logging.info("Done in {} seconds".format(
             str(time.time() - start_time)))
 
         return df_stats
 
+    def lookup_path(self, kind):
+        """Output of a lookup run: `{path_save}tweeplers.parquet`, or a new
+        key of kind in the dataset"""
+
+        if self.dataset is None:
+            return f'{self.path_save}{self.file_name}.parquet'
+
+        return self.dataset.path(kind, run_key())
+
     def followers_lookup(self):
         """Retrieves followers' information
         ...
@@ -77,19 +180,51 @@ class TweepleStreamer:
         logging.basicConfig(filename=f'{self.file_name}_followers.log', level=logging.INFO)
         start_time = time.time()
         not_scraped = []
+        pipeline = open_pipeline(self.pipeline)
+
+        def lookup(id_user):
+            sink = ParquetSink(
+                output_path(self.path_save, id_user, self.dataset, 'followers'), self.flush_pages, USER_SCHEMA, mode=self.sink_mode,
+                pipeline=pipeline)
+            collector = GetFollowers(
+                id_user, self.bearer_token, self.transport, sink, self.checkpoint, self.crawl)
+            rows = collector.main()
+            sink.close()
+            return sink, collector.job, rows
+
+        def failed(id_user):
+            not_scraped.append(id_user)
+            kind = record_failure(self.dead_letters, 'followers', id_user)
+            logging.exception(
+                "Failed to retrieve followers from {} ({})".format(id_user, kind))
 
-        for id_user in tqdm(self.ids):
-
-            try:
-
-                df = GetFollowers(id_user, self.bearer_token).main()
-                df.to_parquet(f"{self.path_save}{id_user}.parquet")
-
-            except:
-                time.sleep(60)
-                pass
+        try:
+            results = run_concurrently(lookup, self.ids, self.concurrency, failed)
+        finally:
+            close_pipeline(pipeline, self.pipeline)
+
+        if self.graph is not None:
+            # one update for the whole crawl, so each edge array is rewritten once;
+            # failed accounts are left out, and so are accounts whose output this
+            # crawl already ingested: their output was reset, it is not empty.
+            # Accounts left with an empty output lost every follower
+            collected = []
+            for id_user, result in zip(self.ids, results):
+                if result is None:
+                    continue
+                sink, job, rows = result
+                if self.checkpoint is None or self.checkpoint.get(ingested_job(job)) is None:
+                    collected.append((id_user, sink, job, rows))
+            changes = self.graph.ingest(
+                [sink.path for _, sink, _, _ in collected], accounts=[id_user for id_user, _, _, _ in collected])
+            for _, sink, job, rows in collected:
+                if self.checkpoint is not None:
+                    self.checkpoint.finish(ingested_job(job), 0, rows)
+                sink.reset()
+            logging.info(f"Follower graph: {len(self.graph)} edges, {len(changes)} changes")
 
         logging.info(f"Ids not scraped: {not_scraped}")
+        settle(self.dead_letters, 'followers', self.ids, not_scraped)
         logging.info("Done in {} seconds".format(
             str(time.time() - start_time)))
 
@@ -101,22 +236,30 @@ class TweepleStreamer:
         logging.basicConfig(filename=f'{self.file_name}_liking_users.log', level=logging.INFO)
         start_time = time.time()
         not_scraped = []
+        pipeline = open_pipeline(self.pipeline)
+
+        def lookup(id_tweet):
+            sink = ParquetSink(
+                output_path(self.path_save, id_tweet, self.dataset, 'liking_users'), self.flush_pages, USER_SCHEMA,
+                mode=self.sink_mode, pipeline=pipeline)
+            GetTweetplerInteracting(
+                id_tweet, self.bearer_token, 'liking_users', self.transport, sink, self.checkpoint, self.crawl
+            ).main()
+            sink.close()
 
-        for id_tweet in tqdm(self.ids):
-
-            try:
-
-                df = GetTweetplerInteracting(
-                    id_tweet, self.bearer_token, 'liking_users'
-                ).main()
-                df.to_parquet(f"{self.path_save}{id_tweet}.parquet")
-
-            except:
+        def failed(id_tweet):
+            not_scraped.append(id_tweet)
+            kind = record_failure(self.dead_letters, 'liking_users', id_tweet)
+            logging.exception(
+                "Failed to retrieve users interacting with {} ({})".format(id_tweet, kind))
 
-                time.sleep(11)
-                pass
+        try:
+            run_concurrently(lookup, self.ids, self.concurrency, failed)
+        finally:
+            close_pipeline(pipeline, self.pipeline)
 
         logging.info(f"Tweet Ids not scraped: {not_scraped}")
+        settle(self.dead_letters, 'liking_users', self.ids, not_scraped)
         logging.info("Done in {} seconds".format(
             str(time.time() - start_time)))
 
@@ -128,22 +271,30 @@ class TweepleStreamer:
         logging.basicConfig(filename=f'{self.file_name}_retweeted_by.log', level=logging.INFO)
         start_time = time.time()
         not_scraped = []
+        pipeline = open_pipeline(self.pipeline)
+
+        def lookup(id_tweet):
+            sink = ParquetSink(
+                output_path(self.path_save, id_tweet, self.dataset, 'retweeted_by'), self.flush_pages, USER_SCHEMA,
+                mode=self.sink_mode, pipeline=pipeline)
+            GetTweetplerInteracting(
+                id_tweet, self.bearer_token, 'retweeted_by', self.transport, sink, self.checkpoint, self.crawl
+            ).main()
+            sink.close()
 
-        for id_tweet in tqdm(self.ids):
-
-            try:
-
-                df = GetTweetplerInteracting(
-                    id_tweet, self.bearer_token, 'retweeted_by'
-                ).main()
-                df.to_parquet(f"{self.path_save}{id_tweet}.parquet")
-
-            except:
+        def failed(id_tweet):
+            not_scraped.append(id_tweet)
+            kind = record_failure(self.dead_letters, 'retweeted_by', id_tweet)
+            logging.exception(
+                "Failed to retrieve users interacting with {} ({})".format(id_tweet, kind))
 
-                time.sleep(11)
-                pass
+        try:
+            run_concurrently(lookup, self.ids, self.concurrency, failed)
+        finally:
+            close_pipeline(pipeline, self.pipeline)
 
         logging.info(f"Tweet Ids not scraped: {not_scraped}")
+        settle(self.dead_letters, 'retweeted_by', self.ids, not_scraped)
         logging.info("Done in {} seconds".format(
             str(time.time() - start_time)))
 
@@ -159,14 +310,83 @@ class TweetStreamer:
         List of tweets, handles or links
     path_save:str or None = '.'):
         Path to save data collected
-    bearer_token : str
-        Bearer token
+    bearer_token : str, list or TokenPool
+        Bearer token, or several pooled into a TokenPool: each request goes
+        out with the token that has the most requests left
     start_time : timestamp
         Start date to retrieve information from
         Defaults  to `2006-03-26T00:00:00Z`
     end_time : timestamp
         End date to retrieve information from
         Defaults to `today`
+    transport : Transport
+        Pooled HTTP transport shared by every call
+        Defaults to the package-wide transport
+    concurrency : int
+        Number of handles, links or batches of tweets requested at once
+        Defaults to 1
+    flush_pages : int
+        Pages of a handle kept in memory before they are written to disk
+        Defaults to 50
+    checkpoint : str or CheckpointStore
+        SQLite journal of pagination progress; reruns resume each handle
+        where it stopped instead of starting over
+        Defaults to None (no checkpoints)
+    cache : str or ResponseCache
+        On-disk cache of looked-up tweets; tweets looked up within its TTL
+        are served locally and only the rest is requested
+        Defaults to None (no cache)
+    incremental : Boolean
+        Keep the newest tweet collected from each handle in the checkpoint
+        journal (`tweetple_checkpoints.sqlite` when no `checkpoint` is
+        given); later runs only collect newer tweets, appended to each
+        handle's output. Handles are then neither packed nor windowed
+        Defaults to False
+    side_tables : Boolean
+        Also write the users, referenced tweets, media and places expanded
+        with each handle's tweets, deduplicated, next to its output (e.g.
+        `zorroyanez.users.parquet`). Not available for packed handles
+        Defaults to False
+    windows : int or list
+        Time windows the search of each handle or link is split into and
+        run concurrently, or explicit (start_time, end_time) windows
+        Defaults to 1 (the whole range at once)
+    pack : Boolean
+        Search as many handles or links as fit `max_query_length` with a
+        single OR query, then split the tweets back out per handle or link
+        Defaults to False
+    max_query_length : int
+        Longest query the API accepts
+        Defaults to 1024
+    seen : Boolean, str or SeenIndex
+        Index of the tweets already looked up (`seen_tweets.npy` in
+        `path_save`); `streamer_tweetids` skips them, and each run adds its
+        tweets as a new part of the output
+        Defaults to False (every id is requested)
+    pipeline : int or Pipeline
+        Normalize and write pages on this many worker threads (or on the
+        given Pipeline) while the next pages are fetched; the threads
+        started for a number are stopped when each collection returns
+        Defaults to None (pages are written between fetches)
+    planner : Boolean or QueryPlanner
+        Count the tweets of every handle or link first (`/2/tweets/counts/all`):
+        those without tweets, or beyond the planner's `cap`, are not
+        searched, and each of the others is searched over windows holding
+        about the same number of pages instead of `windows`. The estimate is
+        kept in `plan`. Not used with `pack` or `incremental`
+        Defaults to None (no planning)
+    dataset : str or TweetDataset
+        Write every output to a dataset partitioned by kind of collection
+        and date (`kind=handles/date=2022-01-31/zorroyanez.parquet`) instead
+        of `path_save`; each `streamer_tweetids` or `streamer_links` run is
+        a new key of kind `tweetids` or `links` rather than a rewrite of
+        `tweets.parquet`
+        Defaults to None (flat files in `path_save`)
+    dead_letters : Boolean, str or DeadLetters
+        File (`dead_letters.jsonl` for True) the handles, tweets and links
+        that failed are recorded in, with why they failed; those that
+        succeed on a later run are marked resolved
+        Defaults to None (failures are only logged)
 
     Methods
     -------
@@ -180,14 +400,36 @@ class TweetStreamer:
         Execute the streamer
     """
 
-    def __init__(self, data, bearer_token, path_save: str or None = './', start_time="2006-03-26T00:00:00Z", end_time=str(date.today())+'T00:00:00Z'):
-        self.bearer_token = bearer_token
+    def __init__(self, data, bearer_token, path_save: str or None = './', start_time="2006-03-26T00:00:00Z", end_time=str(date.today())+'T00:00:00Z', transport=None, concurrency=1, flush_pages=50, checkpoint=None, windows=1, pack=False, max_query_length=1024, cache=None, incremental=False, side_tables=False, seen=False, pipeline=None, planner=None, dataset=None, dead_letters=None):
+        self.bearer_token = token_pool(bearer_token)
+        self.windows = windows
+        self.pack = pack
+        self.max_query_length = max_query_length
         self.column_link = 'links.streamed'
         self.data = data
         self.file_name = 'tweets'
         self.path_save = path_save
         self.start_time = start_time
         self.end_time = end_time
+        self.transport = transport or get_transport()
+        self.concurrency = concurrency
+        self.flush_pages = flush_pages
+        self.incremental = incremental
+        self.side_tables = side_tables
+        if incremental and checkpoint is None:
+            checkpoint = CheckpointStore()
+        self.checkpoint = open_checkpoint(checkpoint)
+        self.sink_mode = 'w' if self.checkpoint is None else 'a'
+        self.cache = open_cache(cache)
+        self.seen = open_seen(seen, f"{path_save or './'}seen_tweets.npy")
+        self.pipeline = pipeline
+        self.dropped = {'duplicates': [], 'seen': []}
+        if planner is True:
+            planner = QueryPlanner(self.bearer_token, start_time, end_time, self.transport)
+        self.planner = planner or None
+        self.plan = None
+        self.dataset = open_dataset(dataset)
+        self.dead_letters = open_dead_letters(dead_letters)
 
     def streamer_handles(self):
         """Retrieves tweets from a list of Twitter handles
@@ -198,17 +440,112 @@ class TweetStreamer:
             filename='streamer_handles.log', level=logging.INFO)
         start_time = time.time()
         search_url = "https://api.twitter.com/2/tweets/search/all"
-        for handle in tqdm(self.data):
-            try:
-                stat = GetTweetsFromUser(
-                    handle, self.bearer_token, self.start_time, self.end_time, search_url).main()
-                stat.to_parquet(self.path_save + handle + '.parquet')
-            except:
-                logging.exception(
-                    "Failed to retrieve tweets from {}".format(handle))
+
+        if self.pack and not self.incremental:
+            self.streamer_packed_handles(search_url)
+            logging.info("Done in {} seconds".format(
+                str(time.time() - start_time)))
+            return
+
+        windows = self.plan_windows('(from:{})')
+        pipeline = open_pipeline(self.pipeline)
+
+        def collect(handle):
+            sink = ParquetSink(output_path(self.path_save, handle, self.dataset, 'handles'), self.flush_pages, TWEET_SCHEMA,
+                               mode=self.sink_mode, pipeline=pipeline)
+            side_sinks = open_side_sinks(self.path_save, handle, self.side_tables, self.sink_mode, self.dataset, 'handles')
+            GetTweetsFromUser(
+                handle, self.bearer_token, self.start_time, self.end_time, search_url, self.transport, sink, self.checkpoint, windows.get(handle, self.windows), self.incremental, side_sinks).main()
+            for output in [sink] + list(side_sinks.values()):
+                output.close()
+
+        not_scraped = []
+
+        def failed(handle):
+            not_scraped.append(handle)
+            kind = record_failure(self.dead_letters, 'handles', handle)
+            logging.exception(
+                "Failed to retrieve tweets from {} ({})".format(handle, kind))
+
+        handles = [handle for handle in self.data if windows.get(handle, self.windows)]
+        try:
+            run_concurrently(collect, handles, self.concurrency, failed)
+        finally:
+            close_pipeline(pipeline, self.pipeline)
+        logging.info(f"Handles not scraped: {not_scraped}")
+        settle(self.dead_letters, 'handles', handles, not_scraped)
         logging.info("Done in {} seconds".format(
             str(time.time() - start_time)))
 
+    def plan_windows(self, query):
+        """Windows of every handle or link, planned from their counts
+        ...
+
+        Returns
+        -------
+        windows : dict
+            handle or link -> its windows, [] for those without tweets and
+            None for those beyond the cap; empty when there is no planner.
+            Items whose counts failed are left out, so they are searched
+            over the unplanned windows
+        """
+        if self.planner is None or self.pack or self.incremental:
+            return {}
+
+        self.plan = self.planner.plan_queries([query.format(item) for item in self.data])
+        self.plan.insert(0, 'item', list(self.data))
+
+        planned = self.plan['error'].isna()
+        searched = planned & (self.plan['tweets'] > 0)
+        if 'within_cap' in self.plan.columns:
+            searched &= self.plan['within_cap']
+
+        logging.info("Plan: {} tweets in {} requests, about {:.0f} seconds".format(
+            self.plan['tweets'].sum(), self.plan['requests'].sum(), self.plan['seconds'].sum()))
+        logging.info(f"Without tweets: {self.plan.loc[self.plan['tweets'] == 0, 'item'].tolist()}")
+        logging.info(f"Not searched: {self.plan.loc[planned & ~searched, 'item'].tolist()}")
+        logging.info(f"Not planned: {self.plan.loc[~planned, ['item', 'error']].values.tolist()}")
+
+        return {
+            item: windows if keep else ([] if tweets == 0 else None)
+            for item, windows, tweets, keep, known in zip(
+                self.plan['item'], self.plan['windows'], self.plan['tweets'], searched, planned)
+            if known
+        }
+
+    def streamer_packed_handles(self, search_url):
+        """Retrieves tweets from handles packed into OR queries, one output
+        per handle
+        ...
+
+        """
+
+        def collect(packed):
+            _, handles = packed
+            stat = GetTweetsFromUsers(
+                handles, self.bearer_token, self.start_time, self.end_time, search_url, self.transport, self.windows).main()
+            for handle, tweets in stat.groupby('handle'):
+                sink = ParquetSink(output_path(self.path_save, handle, self.dataset, 'handles'), self.flush_pages, TWEET_SCHEMA)
+                sink.write(tweets.reset_index(drop=True))
+                sink.close()
+
+        not_scraped = []
+
+        def failed(packed):
+            # every handle of the pack failed with it
+            _, handles = packed
+            not_scraped.extend(handles)
+            kind = record_failure(self.dead_letters, 'handles', handles[0])
+            for handle in handles[1:]:
+                record_failure(self.dead_letters, 'handles', handle)
+            logging.exception(
+                "Failed to retrieve tweets from {} ({})".format(handles, kind))
+
+        packs = pack_queries(self.data, 'from:{}', self.max_query_length)
+        run_concurrently(collect, packs, self.concurrency, failed)
+        logging.info(f"Handles not scraped: {not_scraped}")
+        settle(self.dead_letters, 'handles', self.data, not_scraped)
+
     def streamer_tweetids(self):
         """Retrieves stats from a list of tweets
         ...
@@ -218,20 +555,49 @@ class TweetStreamer:
             filename='streamer_tweetids.log', level=logging.INFO)
         start_time = time.time()
         df_stats = df_tweets_stats()
-        end = roundup(len(self.data))+100
+        ids, self.dropped = drop_repeated(self.data, self.seen)
+        logging.info("Ids dropped: {} repeated, {} already collected".format(
+            len(self.dropped['duplicates']), len(self.dropped['seen'])))
+        if self.cache is not None:
+            # cached ids go last, so they fill whole batches that need no call
+            missing, cached = self.cache.partition(
+                '/2/tweets', ids, TWEET_LOOKUP_PARAMS)
+            ids = missing + cached
+        end = roundup(len(ids))+100
         bounds = list(range(0, end, 100))
-        for prev, curr in tqdm(zip(bounds, bounds[1:])):
-            stat = GetStatsFromTweets(self.data[prev:curr], self.bearer_token)
-            df_stats = df_stats.append(
-                stat.main(),
-                ignore_index=True
-            )
-        df_stats.to_parquet(f'{self.path_save}{self.file_name}.parquet')
+
+        missing = []
+
+        def lookup(bound):
+            prev, curr = bound
+            collector = GetStatsFromTweets(
+                ids[prev:curr], self.bearer_token, self.transport, self.cache)
+            df = collector.main()
+            missing.extend(collector.errors)
+            return df
+
+        df_stats = conform(concat_frames(
+            run_concurrently(lookup, zip(bounds, bounds[1:]), self.concurrency),
+            blank=df_stats
+        ), TWEET_SCHEMA)
+        record_missing(self.dead_letters, 'tweetids', missing, df_stats['id'])
+        save_lookup(df_stats, self.lookup_path('tweetids'), TWEET_SCHEMA, self.seen is not None or self.dataset is not None)
+        if self.seen is not None:
+            self.seen.add(df_stats['id'])
         logging.info("Done in {} seconds".format(
             str(time.time() - start_time)))
 
         return df_stats
 
+    def lookup_path(self, kind):
+        """Output of a lookup run: `{path_save}tweets.parquet`, or a new
+        key of kind in the dataset"""
+
+        if self.dataset is None:
+            return f'{self.path_save}{self.file_name}.parquet'
+
+        return self.dataset.path(kind, run_key())
+
     def streamer_links(self):
         """Retrieves tweets containing links
         ...
@@ -240,15 +606,66 @@ class TweetStreamer:
 
         search_url = "https://api.twitter.com/2/tweets/search/all"
         df_stats = twitter_df(self.column_link)
-        for url in tqdm(self.data):
-            time.sleep(1)
-            stat = GetInteractionsAssociatedToLink(
-                url, self.bearer_token, self.column_link, self.start_time, self.end_time, search_url
+
+        windows = self.plan_windows('(url:"{}")')
+
+        def collect(url):
+            collector = GetInteractionsAssociatedToLink(
+                url, self.bearer_token, self.column_link, self.start_time, self.end_time, search_url, self.transport, windows.get(url, self.windows)
             )
-            df_stats = df_stats.append(stat.main(), ignore_index=True)
-        df_stats.to_parquet(f'{self.path_save}{self.file_name}.parquet')
-        stats = aggregate_twitter_metrics(df_stats, self.column_link)
-        stats.to_parquet(f'{self.path_save}agg_stats.parquet')
+            if collector.windows:
+                return collector.main()
+            # nothing to search: the link still gets its blank row
+            df = collector.create_dataframe().reindex([0])
+            df[self.column_link], df['date_consulted'] = url, str(date.today())
+            return df
+
+        def collect_packed(packed):
+            _, urls = packed
+            return GetInteractionsAssociatedToLinks(
+                urls, self.bearer_token, self.column_link, self.start_time, self.end_time, search_url, self.transport, self.windows
+            ).main()
+
+        not_scraped = []
+
+        def failed(url):
+            not_scraped.append(url)
+            kind = record_failure(self.dead_letters, 'links', url)
+            logging.exception(
+                "Failed to retrieve tweets sharing {} ({})".format(url, kind))
+
+        def failed_packed(packed):
+            # every link of the pack failed with it
+            _, urls = packed
+            not_scraped.extend(urls)
+            kind = record_failure(self.dead_letters, 'links', urls[0])
+            for url in urls[1:]:
+                record_failure(self.dead_letters, 'links', url)
+            logging.exception(
+                "Failed to retrieve tweets sharing {} ({})".format(urls, kind))
+
+        if self.pack:
+            urls = list(self.data)
+            packs = pack_queries(urls, 'url:"{}"', self.max_query_length)
+            results = run_concurrently(collect_packed, packs, self.concurrency, failed_packed)
+        else:
+            urls = [url for url in self.data if windows.get(url, self.windows) is not None]
+            results = run_concurrently(collect, urls, self.concurrency, failed)
+
+        logging.info(f"Links not scraped: {not_scraped}")
+        settle(self.dead_letters, 'links', urls, not_scraped)
+
+        df_stats = conform(concat_frames(results, blank=df_stats), TWEET_SCHEMA)
+        if self.dataset is None:
+            write_parquet(df_stats, f'{self.path_save}{self.file_name}.parquet', TWEET_SCHEMA)
+            stats = aggregate_twitter_metrics(f'{self.path_save}{self.file_name}.parquet', self.column_link)
+            stats.to_parquet(f'{self.path_save}agg_stats.parquet')
+        else:
+            key = run_key()
+            path = self.dataset.path('links', key)
+            ParquetSink(path, schema=TWEET_SCHEMA).write(df_stats)
+            stats = aggregate_twitter_metrics(path, self.column_link)
+            ParquetSink(self.dataset.path('link_stats', key)).write(stats)
 
     def main(self):
         """Run tweets wrapper
@@ -270,16 +687,130 @@ class TweetStreamer:
             self.streamer_handles()
 
 
-def get_threads(conversation_ids, bearer_token, path_save):
-    """Retrieves Twitter conversations"""
+def save_lookup(df, path, schema, append=False):
+    """Writes the result of a lookup to path
 
-    for i, conversation_id in enumerate(conversation_ids):
-        print(i, conversation_id)
-        try:
-            df = GetRepliesAssociatedToTweet(
-                conversation_id, bearer_token
-            ).main()
-            df.to_parquet(f'{path_save}{conversation_id}.parquet')
-        except:
-            pass
-        time.sleep(3)
+    By default the output is replaced. With a seen index a run only holds
+    the ids new to it, and in a dataset each run has its own key, so with
+    `append` its rows are added as a new part of the output.
+    """
+    if append:
+        ParquetSink(path, schema=schema, mode='a').write(df)
+    else:
+        write_parquet(df, path, schema)
+
+
+def ingested_job(job):
+    """Checkpoint key recording that the output of job is in the follower graph"""
+
+    return 'graph:' + job
+
+
+def settle(dead_letters, collection, items, failed):
+    """Marks the items of collection that did not fail as resolved"""
+
+    if dead_letters is not None:
+        failed = set(failed)
+        dead_letters.resolve(collection, [item for item in items if item not in failed])
+
+
+def record_missing(dead_letters, collection, errors, found):
+    """Records the ids a lookup could not return, resolving those it did"""
+
+    for id, kind, detail in errors:
+        logging.info("Id {} not returned: {} ({})".format(id, kind, detail))
+        if dead_letters is not None:
+            dead_letters.add(collection, id, kind, 200, detail)
+
+    if dead_letters is not None:
+        dead_letters.resolve(collection, [str(id) for id in found.dropna()])
+
+
+def output_path(path_save, key, dataset=None, kind=None, table=None):
+    """Where the output of key goes
+
+    `{path_save}{key}.parquet` (`{path_save}{key}.{table}.parquet` for a
+    side table), or the directory of key under kind (`{kind}_{table}`) in
+    the dataset.
+    """
+    if dataset is not None:
+        return dataset.path(kind if table is None else f'{kind}_{table}', key)
+
+    if table is None:
+        return f'{path_save}{key}.parquet'
+
+    return f'{path_save}{key}.{table}.parquet'
+
+
+def open_side_sinks(path_save, key, enabled=True, mode='w', dataset=None, kind=None):
+    """Sinks of the side tables written next to the output of key
+
+    One ParquetSink per expansion (users, tweets, media, places), e.g.
+    `zorroyanez.users.parquet`, or kind `handles_users` in a dataset; empty
+    when side tables are off.
+    """
+    if not enabled:
+        return {}
+
+    schemas = {'users': USER_SCHEMA, 'tweets': TWEET_SCHEMA}
+
+    return {
+        table: ParquetSink(output_path(path_save, key, dataset, kind, table), schema=schemas.get(table), mode=mode)
+        for table in INCLUDES
+    }
+
+
+def get_threads(conversation_ids, bearer_token, path_save, transport=None, concurrency=1, flush_pages=50, checkpoint=None, incremental=False, side_tables=False, pipeline=None, dataset=None, dead_letters=None, crawl=None):
+    """Retrieves Twitter conversations, `concurrency` of them at once
+
+    `bearer_token` may be a list of tokens, pooled so each request goes out
+    with the token that has the most requests left.
+
+    With a `checkpoint` (SQLite path or CheckpointStore), reruns of the same
+    `crawl` (defaults to today's date) resume each conversation where it
+    stopped; a new crawl collects them again. With `incremental`, reruns only collect
+    replies posted since the previous run and append them to the output.
+    With `side_tables`, the users, referenced tweets, media and places of
+    each conversation are written, deduplicated, next to it. With `pipeline`
+    (a number of workers or a Pipeline), pages are normalized and written
+    on worker threads while the next ones are fetched. With `dataset` (a
+    directory or TweetDataset), conversations are written under kind
+    `threads` of the dataset instead of `path_save`. With `dead_letters` (a
+    path, True or DeadLetters), conversations that fail are recorded there,
+    with why they failed, to be replayed later.
+    """
+
+    transport = transport or get_transport()
+    bearer_token = token_pool(bearer_token)
+    if incremental and checkpoint is None:
+        checkpoint = CheckpointStore()
+    checkpoint = open_checkpoint(checkpoint)
+    sink_mode = 'w' if checkpoint is None else 'a'
+    crawl = crawl or str(date.today())
+    opened = open_pipeline(pipeline)
+    dataset = open_dataset(dataset)
+    dead_letters = open_dead_letters(dead_letters)
+    not_scraped = []
+
+    def collect(conversation_id):
+        sink = ParquetSink(output_path(path_save, conversation_id, dataset, 'threads'), flush_pages, TWEET_SCHEMA,
+                           mode=sink_mode, pipeline=opened)
+        side_sinks = open_side_sinks(path_save, conversation_id, side_tables, sink_mode, dataset, 'threads')
+        GetRepliesAssociatedToTweet(
+            conversation_id, bearer_token, transport, sink, checkpoint, incremental, side_sinks, crawl=crawl
+        ).main()
+        for output in [sink] + list(side_sinks.values()):
+            output.close()
+
+    def failed(conversation_id):
+        not_scraped.append(conversation_id)
+        kind = record_failure(dead_letters, 'threads', conversation_id)
+        logging.exception(
+            "Failed to retrieve conversation {} ({})".format(conversation_id, kind))
+
+    try:
+        run_concurrently(collect, conversation_ids, concurrency, failed)
+    finally:
+        close_pipeline(opened, pipeline)
+    logging.info(f"Conversations not scraped: {not_scraped}")
+    settle(dead_letters, 'threads', conversation_ids, not_scraped)
@@ -4,16 +4,133 @@
 
 # ============================================================================
 
-import requests
+import copy
 import pandas as pd
-import time
 
+from abc import ABC, abstractmethod
 from tqdm import tqdm
 from pandas import json_normalize
 from datetime import date
+from .TransportTweetPle import get_transport
+from .AuxTweetPle import PageBuffer, concat_frames, split_time_range, or_query, normalize_link, match_links
+from .ConcurrencyTweetPle import run_concurrently
+from .CheckpointTweetPle import resume
+from .CacheTweetPle import cached_lookup
+from .DecodeTweetPle import TWEET, USER, read_json, records_to_table, add_constants, drop_duplicates, concat_tables
+from .SchemaTweetPle import TWEET_SCHEMA, USER_SCHEMA, blank_frame, conform, to_table
+from .RetryTweetPle import CollectionError, check_page, page_errors
+
+# Fields requested by the tweet and user lookups; they are also part of the
+# key their responses are cached under.
+TWEET_LOOKUP_PARAMS = {
+    'tweet.fields': 'attachments,author_id,context_annotations,conversation_id,created_at,entities,geo,id,in_reply_to_user_id,lang,possibly_sensitive,public_metrics,referenced_tweets,reply_settings,source,text,withheld',
+    'user.fields': 'created_at,description,entities,id,location,name,pinned_tweet_id,profile_image_url,protected,public_metrics,url,username,verified,withheld',
+    'media.fields': 'duration_ms,height,media_key,non_public_metrics,organic_metrics,preview_image_url,promoted_metrics,public_metrics,type,url,width',
+    'place.fields': 'contained_within,country,country_code,full_name,geo,id,name,place_type'
+}
+
+USER_LOOKUP_PARAMS = {
+    'user.fields': 'created_at,description,entities,id,location,name,pinned_tweet_id,profile_image_url,protected,public_metrics,url,username,verified,withheld'
+}
+
+
+class Paginated(ABC):
+
+    """Lazy iteration over the pages of a collection
+
+    `main()` returns once the last page is in. `iter_pages()` instead fetches
+    a page only when the previous one has been consumed: breaking out of the
+    loop (or closing the generator) stops the collection without another
+    call, and memory stays bounded by a page. After each page `next_token`
+    holds the token of the following one, to resume there later with
+    `token=`. Iteration runs over the whole range sequentially, ignoring
+    `windows`, sinks and checkpoints.
+
+    Collectors provide `page_request()`, the url, headers and parameters of
+    the first page, and `page_buffer()`, the `PageBuffer` normalizing their
+    records like `main()` does.
 
+    ...
+    Attributes
+    ----------
+    token_param : str
+        parameter the pagination token is sent in
+    next_token : str or None
+        token of the page following the last one yielded, None at the end
+    status : int or None
+        status code of the last page
+
+    Methods
+    -------
+    iter_pages()
+        Decoded responses, one page at a time
+    iter_records()
+        Records of every few pages, as a dataframe (or table)
+    """
+
+    token_param = 'next_token'
+
+    @abstractmethod
+    def page_request(self):
+        """
+        (url, headers, parameters) of the first page
+        """
+
+    @abstractmethod
+    def page_buffer(self, status):
+        """
+        PageBuffer normalizing the records of the pages
+        """
+
+    def iter_pages(self, token=None, max_pages=None):
+        """
+        Decoded responses, one page at a time, starting after token
+        (defaults to the first page) and stopping after max_pages
+        """
+        url, headers, query = self.page_request()
+        self.next_token = token
+        fetched = 0
+
+        while max_pages is None or fetched < max_pages:
+            if self.next_token is not None:
+                query[self.token_param] = self.next_token
 
-class TwitterObject:
+            response = self.transport.get(url, headers=headers, params=query)
+            page = check_page(response, read_json(response))
+            fetched += 1
+
+            self.status = response.status_code
+            self.next_token = page.get('meta', {}).get('next_token')
+
+            yield page
+
+            if self.next_token is None:
+                return
+
+    def iter_records(self, token=None, max_pages=None, pages_per_batch=1):
+        """
+        Records of every `pages_per_batch` pages as they arrive, a dataframe
+        (or a `pyarrow.Table` with `arrow`) with the columns `main()` gives
+        """
+        pages = None
+
+        for page in self.iter_pages(token, max_pages):
+            if pages is None:
+                pages = self.page_buffer(self.status)
+            elif 'response' in pages.columns:
+                pages.columns['response'] = self.status
+
+            pages.add(page.get('data', []), self.next_token)
+
+            if len(pages) and pages.pages % pages_per_batch == 0:
+                yield pages.frame()
+                pages.records = []
+
+        if pages is not None and len(pages):
+            yield pages.frame()
+
+
+class TwitterObject(Paginated):
 
     """Generic class to represent a Twitter object
 
@@ -22,6 +139,8 @@ class TwitterObject:
     ----------
     bearer_token : str
         credentials for the Twitter developer app
+    bearer_tokens : list
+        every credential available; time windows are spread across them
     search_url : str
         name of column in which the link will be stored
     start_time : datetime
@@ -30,6 +149,22 @@ class TwitterObject:
         end date of scrape
     search_url : str
         endpoint we want to retrieve information from
+    transport : Transport
+        pooled HTTP transport used for every call
+    sink : ParquetSink or None
+        where pages are streamed to instead of being kept in memory
+    checkpoint : CheckpointStore or None
+        journal pagination progress is recorded in
+    side_sinks : dict
+        expansion (users, tweets, media, places) -> ParquetSink its
+        deduplicated side table is streamed to
+    windows : int or list
+        number of time windows start_time..end_time is split into and
+        searched concurrently, or explicit (start_time, end_time) windows
+    unique : str or list
+        column(s) results of several windows are deduplicated on
+    arrow : Boolean
+        decode pages straight into Arrow and return a `pyarrow.Table`
 
     Methods
     -------
@@ -43,51 +178,61 @@ class TwitterObject:
         Defines the query's parameters
     call()
         Api call   
+    split()
+        Copies of the collector restricted to each time window
+    call_windows()
+        Searches every time window concurrently and merges the results
+    search_query()
+        Search query of the collection
+    iter_pages()
+        Pages of the search, fetched as they are consumed
+    iter_records()
+        Records of the search, page by page
 
     """
 
-    def __init__(self, bearer_token, start_time, end_time, search_url):
+    def __init__(self, bearer_token, start_time, end_time, search_url, transport=None, sink=None, checkpoint=None, windows=1, side_sinks=None):
         """
         Initialize the object's attributes
         """
-        self.bearer_token = bearer_token
+        if isinstance(bearer_token, (list, tuple)):
+            self.bearer_tokens = list(bearer_token)
+        else:
+            self.bearer_tokens = [bearer_token]
+        self.bearer_token = self.bearer_tokens[0]
+        self.windows = windows
+        self.unique = 'id'
         self.search_url = search_url
         self.start_time = start_time
         self.end_time = end_time
+        self.transport = transport or get_transport()
+        self.sink = sink
+        self.checkpoint = checkpoint
+        self.side_sinks = side_sinks or {}
+        self.arrow = False
 
     def create_headers(self):
         """
         Create headers for call
         """
-        headers = {"Authorization": "Bearer {}".format(self.bearer_token)}
+        headers = self.transport.headers(self.bearer_token)
 
         return headers
 
     def connect_to_endpoint(self, headers, params):
         """
-        Connect to Twitters's endpoint
+        Connect to Twitters's endpoint. Transient failures are retried by
+        the transport; a response still failing raises a CollectionError
         """
-        time.sleep(1)
-
-        while True:
-
-            try:
-
-                response = requests.get(
+        response = self.transport.get(
 
-                    self.search_url,
-                    headers=headers,
-                    params=params
-
-                )
-
-            except response.status_code != 200:
-
-                time.sleep(60)
+            self.search_url,
+            headers=headers,
+            params=params
 
-                continue
+        )
 
-            break
+        check_page(response)
 
         return response
 
@@ -115,38 +260,107 @@ class TwitterObject:
 
         return query
 
-    def call(self, json_response, query, headers):
+    @abstractmethod
+    def search_query(self):
+        """
+        Search query of the collection, e.g. `(from:zorroyanez)`
+        """
 
-        df = json_normalize(json_response['data']).sort_index(axis=1)
+    def page_request(self):
+        return self.search_url, self.create_headers(), {'query': self.search_query(), **self.query()}
 
-        while 'next_token' in json_response['meta'].keys():
+    def page_columns(self, status):
+        return {'date_consulted': str(date.today()), 'response': status}
 
-            time.sleep(1)
+    def page_buffer(self, status):
+        return PageBuffer(unique='id', columns=self.page_columns(status), layout=TWEET if self.arrow else None,
+                          schema=TWEET_SCHEMA)
+
+    def call(self, json_response, query, headers, pages=None):
+
+        if pages is None:
+            pages = PageBuffer(sink=self.sink, side_sinks=self.side_sinks, layout=TWEET if self.arrow else None,
+                               schema=TWEET_SCHEMA)
+
+        pages.add(json_response['data'], json_response['meta'].get('next_token'), json_response.get('includes'))
+
+        while 'next_token' in json_response['meta'].keys():
 
             self.paginate(json_response, query)
 
-            response = requests.request(
+            response = self.transport.get(
 
-                "get",
                 self.search_url,
                 headers=headers,
                 params=query
 
             )
 
-            json_response.update(response.json())
+            json_response.update(pages.read(response))
 
-            df = df.append(
-                json_normalize(json_response['data']).sort_index(axis=1)
-            )
+        df = pages.finish()
+
+        return df
 
-        df.reset_index(
+    def split(self):
+        """
+        Copies of the collector restricted to each time window, spread
+        round-robin across the available bearer tokens
+        """
+        if isinstance(self.windows, int):
+            bounds = split_time_range(self.start_time, self.end_time, self.windows)
+        else:
+            bounds = list(self.windows)
+
+        collectors = []
+
+        for i, (start_time, end_time) in enumerate(bounds):
+            collector = copy.copy(self)
+            collector.start_time, collector.end_time = start_time, end_time
+            collector.bearer_token = self.bearer_tokens[i % len(self.bearer_tokens)]
+            collector.windows = 1
+            collectors.append(collector)
 
-            drop=True,
-            inplace=True
+        return collectors
 
+    def call_windows(self, method='main'):
+        """
+        Search every time window concurrently with `method` and merge the
+        results, deduplicated on `unique`. With a sink, windows stream into
+        it directly.
+        """
+        collectors = self.split()
+
+        if self.sink is not None and self.checkpoint is not None:
+            jobs = [collector.job for collector in collectors]
+            states = [self.checkpoint.get(job) for job in jobs]
+            if all(state is None for state in states):
+                for sink in [self.sink] + list(self.side_sinks.values()):
+                    sink.reset()
+            # register every window, so none of them clears the shared sink
+            for job, state in zip(jobs, states):
+                if state is None:
+                    self.checkpoint.save(job, None, 0, 0)
+
+        results = run_concurrently(
+            lambda collector: getattr(collector, method)(), collectors, len(collectors), progress=False
         )
 
+        if self.sink is not None:
+            return sum(results)
+
+        if self.arrow:
+            return drop_duplicates(concat_tables(results), self.unique)
+
+        # categories of the windows differ, so they are encoded again
+        df = conform(concat_frames(results), TWEET_SCHEMA)
+
+        if 'id' in df.columns:
+            found = df['id'].notna()
+            if found.any():
+                df = df[found]
+            df = df.drop_duplicates(subset=self.unique).reset_index(drop=True)
+
         return df
 
 
@@ -170,6 +384,8 @@ class GetInteractionsAssociatedToLink(TwitterObject):
         bearer token
     search_url : str
         endpoint we want to retrieve information from
+    transport : Transport
+        pooled HTTP transport used for every call
 
     Methods
     -------
@@ -179,7 +395,7 @@ class GetInteractionsAssociatedToLink(TwitterObject):
         Creates empty dataframe
     """
 
-    def __init__(self, url, bearer_token, column_link, start_time, end_time,  search_url):
+    def __init__(self, url, bearer_token, column_link, start_time, end_time,  search_url, transport=None, windows=1):
         """
         Parameters
         ----------
@@ -193,9 +409,14 @@ class GetInteractionsAssociatedToLink(TwitterObject):
             earliest date to retrieve data from
         end_time : timestamp
             latest date to retrieve data from
+        transport : Transport
+            pooled HTTP transport, defaults to the shared one
+        windows : int or list
+            time windows searched concurrently
+            Defaults to 1 (the whole range at once)
         """
 
-        super().__init__(bearer_token, start_time, end_time, search_url)
+        super().__init__(bearer_token, start_time, end_time, search_url, transport, windows=windows)
         self.url = url
         self.column_link = column_link
 
@@ -207,14 +428,21 @@ class GetInteractionsAssociatedToLink(TwitterObject):
         dataframe
             A empty dataframe
         """
-        stats = pd.DataFrame(
+        stats = blank_frame(
             columns=[
                 'author_id', 'created_at', 'entities.annotations', 'entities.hashtags', 'entities.mentions', 'entities.urls', 'id', 'lang', 'possibly_sensitive', 'public_metrics.like_count', 'public_metrics.quote_count',  'public_metrics.reply_count', 'public_metrics.retweet_count', 'referenced_tweets', 'reply_settings', 'source', 'text', self.column_link, 'date_consulted'
-            ]
+            ],
+            schema=TWEET_SCHEMA
         )
 
         return stats
 
+    def search_query(self):
+        return '(url:"' + self.url + '")'
+
+    def page_columns(self, status):
+        return {self.column_link: self.url, **super().page_columns(status)}
+
     def main(self):
         """Executes query to Twitter's API.
 
@@ -223,11 +451,104 @@ class GetInteractionsAssociatedToLink(TwitterObject):
         dataframe
             A dataframe with engagement metrics associated to searched link
         """
+        if self.windows != 1:
+            return self.call_windows()
+
+        headers = self.create_headers()
+
+        query = {
+
+            **{"query": self.search_query()},
+            **self.query()
+
+        }
+
+        try:
+
+            response = self.connect_to_endpoint(
+
+                headers,
+                query
+
+            )
+
+        except CollectionError as error:
+
+            if error.transient:
+                raise
+
+            # the link still gets its blank row, with the status it failed with
+            df = self.create_dataframe().reindex([0])
+            df[self.column_link], df['date_consulted'], df['response'] = self.url, str(date.today()), error.status
+
+            return df
+
+        json_response = read_json(response)
+
+        try:
+
+            df = self.call(json_response, query, headers)
+
+        except KeyError:
+
+            # no tweet shares the link
+            df = self.create_dataframe().reindex([0])
+
+        df[self.column_link], df['date_consulted'], df['response'] = self.url, str(
+            date.today()), response.status_code
+
+        return df
+
+
+class GetInteractionsAssociatedToLinks(GetInteractionsAssociatedToLink):
+
+    """Historical Twitter interactions associated to several links at once
+
+    The links are packed into a single `url:"a" OR url:"b" ...` query and
+    the tweets are split back out per link through their `entities.urls`,
+    giving the same rows as one `GetInteractionsAssociatedToLink` per link.
+
+    ...
+
+    Attributes
+    ----------
+    urls : list
+        links we want to retrieve engagements from, packed in one query
+
+    Methods
+    -------
+    main()
+        Executes the packed query, one blank row per link nobody shared
+    shared()
+        Tweets sharing the links, one row per tweet and link
+    """
+
+    def __init__(self, urls, bearer_token, column_link, start_time, end_time, search_url, transport=None, windows=1):
+        super().__init__(None, bearer_token, column_link, start_time, end_time, search_url, transport, windows)
+        self.urls = list(urls)
+        self.unique = ['id', column_link]
+        self.status = None
+
+    def search_query(self):
+        return or_query(self.urls, 'url:"{}"')
+
+    def page_columns(self, status):
+        # tweets of the packed query are not split per link
+        return TwitterObject.page_columns(self, status)
+
+    def shared(self):
+        """Executes the packed query and splits the tweets per link.
+
+        Returns
+        -------
+        dataframe
+            A dataframe with one row per tweet and link it shares
+        """
         headers = self.create_headers()
 
         query = {
 
-            **{"query": '(url:"' + self.url+'")'},
+            **{"query": self.search_query()},
             **self.query()
 
         }
@@ -238,25 +559,65 @@ class GetInteractionsAssociatedToLink(TwitterObject):
 
         )
 
-        json_response = response.json()
+        self.status = response.status_code
+
+        json_response = read_json(response)
 
         try:
 
             df = self.call(json_response, query, headers)
 
-        except:
+        except KeyError:
 
-            df = self.create_dataframe()
+            # no tweet shares the links
+            df = self.create_dataframe().iloc[0:0]
 
-            df = df.append(pd.Series(), ignore_index=True)
+        links = {normalize_link(url): url for url in self.urls}
 
-        df[self.column_link], df['date_consulted'], df['response'] = self.url, str(
-            date.today()), response.status_code
+        if 'entities.urls' in df.columns and len(df):
+            df[self.column_link] = df['entities.urls'].map(
+                lambda entities: match_links(entities, links)
+            )
+            df = df.explode(self.column_link)
+            df = df[df[self.column_link].notna()].reset_index(drop=True)
+        else:
+            df = df.iloc[0:0].copy()
+            df[self.column_link] = None
+
+        df['date_consulted'], df['response'] = str(date.today()), response.status_code
 
         return df
 
+    def main(self):
+        """Executes query to Twitter's API.
+
+        Returns
+        -------
+        dataframe
+            A dataframe with engagement metrics associated to each link, one
+            blank row for links nobody shared
+        """
+        if self.windows != 1:
+            df = self.call_windows('shared')
+            status = df['response'].iloc[0] if len(df) else None
+        else:
+            df = self.shared()
+            status = self.status
+
+        shared = set(df[self.column_link])
+        missing = [url for url in self.urls if url not in shared]
+
+        if not missing:
+            return df
+
+        blank = self.create_dataframe().reindex(range(len(missing)))
+        blank[self.column_link] = missing
+        blank['date_consulted'], blank['response'] = str(date.today()), status
+
+        return conform(concat_frames([df, blank]), TWEET_SCHEMA)
 
-class GetFollowers:
+
+class GetFollowers(Paginated):
 
     """Get Followers from an specific Twitter user
     This call is restricted to 15 calls every 15 minutes.
@@ -267,46 +628,97 @@ class GetFollowers:
         List of ids we want to retrieve information from
     bearer_token : str
         Bearer token
+    transport : Transport
+        pooled HTTP transport used for every call
+    sink : ParquetSink or None
+        where pages are streamed to instead of being kept in memory
+    checkpoint : CheckpointStore or None
+        journal pagination progress is recorded in
+    crawl : str
+        label of the crawl in the checkpoint journal, so an interrupted
+        crawl resumes while a new one collects the followers again
+        Defaults to today's date
 
     Methods
     -------
     main()
         Execute call to retrieve followers
+    iter_pages()
+        Pages of followers, fetched as they are consumed
+    iter_records()
+        Followers, page by page
     """
 
-    def __init__(self, id_user, bearer_token):
+    token_param = 'pagination_token'
+
+    def __init__(self, id_user, bearer_token, transport=None, sink=None, checkpoint=None, crawl=None):
 
         self.bearer_token = bearer_token
         self.id_user = id_user
+        self.transport = transport or get_transport()
+        self.sink = sink
+        self.checkpoint = checkpoint
+        self.crawl = crawl or str(date.today())
+        self.job = 'followers:{}:{}'.format(id_user, self.crawl)
         self.search_url = "https://api.twitter.com/2/users/{}/followers".\
             format(
                 id_user
             )
 
+    def page_request(self):
+        query = {'max_results': 1000, 'user.fields': 'created_at,description,entities,id,location,name,pinned_tweet_id,profile_image_url,protected,public_metrics,url,username,verified,withheld'}
+
+        return self.search_url, self.transport.headers(self.bearer_token), query
+
+    def page_buffer(self, status):
+        return PageBuffer(normalize=False, columns={
+            'author_id_following': self.id_user,
+            'date_consulted': str(date.today()),
+            'response': status
+        }, schema=USER_SCHEMA)
+
     def main(self):
+        """Executes query to Twitter's API.
 
-        query = {'max_results': 1000, 'user.fields': 'created_at,description,entities,id,location,name,pinned_tweet_id,profile_image_url,protected,public_metrics,url,username,verified,withheld'}
+        Returns
+        -------
+        dataframe or int
+            A dataframe with the followers, or the number of rows written
+            when a sink is given
+        """
+
+        _, headers, query = self.page_request()
+
+        state = resume(self.checkpoint, self.job, self.sink)
+
+        if state is not None and state['done']:
+            return state['rows']
 
-        headers = {"Authorization": "Bearer {}".format(self.bearer_token)}
+        if state is not None and state['token']:
+            query.update({'pagination_token': state['token']})
 
-        response = requests.get(
+        response = self.transport.get(
             self.search_url,
             headers=headers,
             params=query
         )
-        json_response = response.json()
+        json_response = check_page(response, read_json(response))
 
-        df = pd.DataFrame(json_response['data']).sort_index(axis=1)
+        pages = PageBuffer(normalize=False, sink=self.sink, columns={
+            'author_id_following': self.id_user,
+            'date_consulted': str(date.today()),
+            'response': response.status_code
+        }, checkpoint=self.checkpoint, job=self.job, state=state, schema=USER_SCHEMA)
 
-        while 'next_token' in json_response['meta'].keys():
+        pages.add(json_response.get('data', []), json_response['meta'].get('next_token'))
 
-            time.sleep(60)
+        while 'next_token' in json_response['meta'].keys():
 
             next_token = json_response["meta"]["next_token"]
 
             query.update({'pagination_token': str(next_token)})
 
-            response = requests.get(
+            response = self.transport.get(
 
                 self.search_url,
                 headers=headers,
@@ -314,67 +726,91 @@ class GetFollowers:
 
             )
 
-            json_response.update(response.json())
+            pages.columns['response'] = response.status_code
 
-            df = df.append(pd.DataFrame(
-                json_response['data']).sort_index(axis=1))
+            json_response.update(pages.read(response))
 
-        df.reset_index(
-
-            drop=True,
-            inplace=True
-
-        )
-
-        df['author_id_following'], df['date_consulted'], df['response'] = self.id_user, str(
-            date.today()), response.status_code
+        df = pages.finish()
 
         return df
 
 
-class GetTweetplerInteracting:
+class GetTweetplerInteracting(Paginated):
     """Retrieves a list of accounts that have liked or retweeted a Tweet."""
 
-    def __init__(self, id_tweet, bearer_token, type_interaction):
+    token_param = 'pagination_token'
+
+    def __init__(self, id_tweet, bearer_token, type_interaction, transport=None, sink=None, checkpoint=None, crawl=None):
         self.id_tweet = id_tweet
         self.type = type_interaction
         self.bearer_token = bearer_token
-
-    def main(self):
+        self.transport = transport or get_transport()
+        self.sink = sink
+        self.checkpoint = checkpoint
+        # a new crawl (by default, a new day) collects the users again
+        self.crawl = crawl or str(date.today())
+        self.job = '{}:{}:{}'.format(type_interaction, id_tweet, self.crawl)
 
         if self.type == 'liking_users':
             end = 'liking_users'
-            col = 'tweet_liked'
+            self.column = 'tweet_liked'
         else:
             end = 'retweeted_by'
-            col = 'tweet_retweeted'
+            self.column = 'tweet_retweeted'
 
-        url = "https://api.twitter.com/2/tweets/{}/{}".format(
+        self.search_url = "https://api.twitter.com/2/tweets/{}/{}".format(
             self.id_tweet, end)
+
+    def page_request(self):
         query = {'user.fields': 'created_at,description,entities,id,location,name,pinned_tweet_id,profile_image_url,protected,public_metrics,url,username,verified,withheld'}
 
-        response = requests.get(
+        return self.search_url, self.transport.headers(self.bearer_token), query
+
+    def page_buffer(self, status):
+        return PageBuffer(normalize=False, columns={
+            self.column: self.id_tweet,
+            'date_consulted': str(date.today()),
+            'response': status
+        }, schema=USER_SCHEMA)
+
+    def main(self):
+
+        url, headers, query = self.page_request()
+        col = self.column
+
+        state = resume(self.checkpoint, self.job, self.sink)
+
+        if state is not None and state['done']:
+            return state['rows']
+
+        if state is not None and state['token']:
+            query.update({'pagination_token': state['token']})
+
+        response = self.transport.get(
             url,
-            headers={"Authorization": "Bearer {}".format(self.bearer_token)},
+            headers=headers,
             params=query
         )
 
         response_status = [response.status_code]
 
-        json_response = response.json()
+        json_response = check_page(response, read_json(response))
 
-        df = pd.DataFrame(json_response['data']).sort_index(axis=1)
+        pages = PageBuffer(normalize=False, sink=self.sink, columns={
+            col: self.id_tweet,
+            'date_consulted': str(date.today()),
+            'response': response_status[0]
+        }, checkpoint=self.checkpoint, job=self.job, state=state, schema=USER_SCHEMA)
 
-        time.sleep(11)
+        pages.add(json_response.get('data', []), json_response['meta'].get('next_token'))
 
         while 'next_token' in json_response['meta'].keys():
             next_token = json_response["meta"]["next_token"]
             query.update({'pagination_token': str(next_token)})
-            response = requests.get(
+            response = self.transport.get(
 
                 url,
-                headers={"Authorization": "Bearer {}".format(
-                    self.bearer_token)},
+                headers=headers,
                 params=query
 
             )
@@ -382,24 +818,11 @@ class GetTweetplerInteracting:
             response_status[0] = [
                 response.status_code if response.status_code != 200 else response_status[0]][0]
 
-            json_response.update(response.json())
+            pages.columns['response'] = response_status[0]
 
-            try:
-                df = df.append(pd.DataFrame(
-                    response.json()['data']).sort_index(axis=1))
-            except:
-                pass
+            json_response.update(pages.read(response))
 
-            time.sleep(11)
-
-        df.reset_index(
-
-            drop=True,
-            inplace=True
-
-        )
-        df[col], df['date_consulted'], df['response'] = self.id_tweet, str(
-            date.today()), response_status[0]
+        df = pages.finish()
 
         return df
 
@@ -422,6 +845,20 @@ class GetTweetsFromUser(TwitterObject):
         end date of scrape
     bearer_token : str
         bearer token
+    transport : Transport
+        pooled HTTP transport used for every call
+    sink : ParquetSink or None
+        where pages are streamed to instead of being kept in memory
+    checkpoint : CheckpointStore or None
+        journal pagination progress is recorded in
+    incremental : Boolean
+        only collect tweets newer than those of the previous run
+    since_id : str or None
+        newest tweet id collected by the previous run
+    side_sinks : dict
+        expansion -> ParquetSink of its side table
+    arrow : Boolean
+        return a `pyarrow.Table` decoded straight from the pages
 
 
     Methods
@@ -431,7 +868,7 @@ class GetTweetsFromUser(TwitterObject):
 
     """
 
-    def __init__(self, user, bearer_token, start_time, end_time, search_url):
+    def __init__(self, user, bearer_token, start_time, end_time, search_url, transport=None, sink=None, checkpoint=None, windows=1, incremental=False, side_sinks=None, arrow=False):
         """
         Parameters
         ----------
@@ -445,9 +882,162 @@ class GetTweetsFromUser(TwitterObject):
             end date of scrape
         bearer_token : str
             bearer token
+        transport : Transport
+            pooled HTTP transport, defaults to the shared one
+        sink : ParquetSink
+            where pages are streamed to, defaults to keeping them in memory
+        checkpoint : CheckpointStore
+            journal pagination progress is recorded in, to resume the
+            collection where an interrupted run stopped
+        windows : int or list
+            time windows searched concurrently, ignored by incremental
+            collections
+            Defaults to 1 (the whole range at once)
+        incremental : Boolean
+            keep the newest tweet id collected in the checkpoint store and,
+            on the next run, only ask for tweets posted after it
+            (`since_id`), appending them to the sink. Requires `checkpoint`
+            Defaults to False
+        side_sinks : dict
+            expansion (users, tweets, media, places) -> ParquetSink its
+            deduplicated side table is streamed to, next to `sink`
+        arrow : Boolean
+            decode pages straight into Arrow, against a fixed layout, and
+            return a `pyarrow.Table` (written as is to `sink`)
+            Defaults to False
         """
-        super().__init__(bearer_token, start_time, end_time, search_url)
+        super().__init__(bearer_token, start_time, end_time, search_url, transport, sink, checkpoint, windows, side_sinks)
         self.user = user
+        self.arrow = arrow
+        self.incremental = incremental and checkpoint is not None
+        self.since_id = None
+
+    @property
+    def job(self):
+        """
+        Key of the collection in the checkpoint store
+        """
+        if self.since_id is not None:
+            return 'tweets:{}:since:{}:{}'.format(self.user, self.since_id, self.end_time)
+
+        return 'tweets:{}:{}:{}'.format(self.user, self.start_time, self.end_time)
+
+    @property
+    def since_key(self):
+        """
+        Key of the handle's since id in the checkpoint store
+        """
+        return 'handle:{}'.format(self.user)
+
+    def search_query(self):
+        return '(from:' + self.user + ')'
+
+    def page_columns(self, status):
+        return {'handle': self.user, **super().page_columns(status)}
+
+    def main(self):
+        """Executes query to Twitter's API.
+
+        Returns
+        -------
+        dataframe or int
+            A dataframe with Tweets twitted by user, or the number of rows
+            written when a sink is given
+        """
+        if self.incremental:
+            self.since_id = self.checkpoint.since(self.since_key)
+        elif self.windows != 1:
+            return self.call_windows()
+
+        headers = self.create_headers()
+
+        query = {
+
+            **{"query": self.search_query()},
+            **self.query()
+
+        }
+
+        if self.since_id is not None:
+            del query['start_time']
+            query['since_id'] = self.since_id
+
+        state = resume(self.checkpoint, self.job, self.sink, self.since_id is not None, self.side_sinks)
+
+        if state is not None and state['done']:
+            if self.incremental:
+                self.checkpoint.advance(self.since_key)
+            return state['rows']
+
+        if state is not None and state['token']:
+            query.update({'next_token': state['token']})
+
+        response = self.connect_to_endpoint(
+
+            headers,
+            query
+
+        )
+
+        json_response = read_json(response)
+
+        pages = PageBuffer(sink=self.sink, unique='id', columns={
+            'handle': self.user,
+            'date_consulted': str(date.today()),
+            'response': response.status_code
+        }, checkpoint=self.checkpoint, job=self.job, state=state, side_sinks=self.side_sinks,
+            layout=TWEET if self.arrow else None, schema=TWEET_SCHEMA)
+
+        if not self.incremental:
+            return self.call(json_response, query, headers, pages)
+
+        if state is None or not state['token']:
+            # the first page holds the newest tweet of the collection
+            self.checkpoint.hold(self.since_key, json_response['meta'].get('newest_id'))
+
+        if 'data' in json_response or self.since_id is None:
+            df = self.call(json_response, query, headers, pages)
+        else:
+            # nothing posted since the previous run
+            df = pages.finish()
+
+        self.checkpoint.advance(self.since_key)
+
+        return df
+
+
+class GetTweetsFromUsers(GetTweetsFromUser):
+
+    """Historical Tweets from several Twitter users at once
+
+    The handles are packed into a single `from:a OR from:b ...` query and
+    each tweet is assigned back to its handle through `author_id` and the
+    `users` expansion, giving the same rows as one `GetTweetsFromUser` per
+    handle.
+
+    ...
+
+    Attributes
+    ----------
+    users : list
+        users' handles, packed in one query
+
+    Methods
+    -------
+    main()
+        Executes the packed query and labels each tweet with its handle
+    """
+
+    def __init__(self, users, bearer_token, start_time, end_time, search_url, transport=None, windows=1):
+        super().__init__(None, bearer_token, start_time, end_time, search_url, transport, windows=windows)
+        self.users = list(users)
+
+    def search_query(self):
+        return or_query(self.users, 'from:{}')
+
+    def page_columns(self, status):
+        # tweets of the packed query are not labelled with their handle
+        return TwitterObject.page_columns(self, status)
 
     def main(self):
         """Executes query to Twitter's API.
@@ -455,13 +1045,17 @@ class GetTweetsFromUser(TwitterObject):
         Returns
         -------
         dataframe
-            A dataframe with Tweets twitted by user
+            A dataframe with Tweets twitted by the users, `handle` telling
+            whose they are
         """
+        if self.windows != 1:
+            return self.call_windows()
+
         headers = self.create_headers()
 
         query = {
 
-            **{"query": '(from:' + self.user+')'},
+            **{"query": self.search_query()},
             **self.query()
 
         }
@@ -473,14 +1067,17 @@ class GetTweetsFromUser(TwitterObject):
 
         )
 
-        json_response = response.json()
+        json_response = read_json(response)
 
-        df = self.call(json_response, query, headers)
+        pages = PageBuffer(unique='id', includes=['users'], schema=TWEET_SCHEMA)
 
-        df['handle'], df['date_consulted'], df['response'] = self.user, str(
-            date.today()), response.status_code
+        df = self.call(json_response, query, headers, pages)
+
+        usernames = {int(user['id']): user['username'].lower() for user in pages.included['users']}
+        handles = {user.lower(): user for user in self.users}
 
-        df = df.drop_duplicates(subset='id').reset_index(drop=True)
+        df['handle'] = df['author_id'].map(usernames).map(handles)
+        df['date_consulted'], df['response'] = str(date.today()), response.status_code
 
         return df
 
@@ -493,42 +1090,56 @@ class GetStatsFromTweets():
     -----------
     ** tweets_ids (list): Twitter ids we want to retrieve engagements from.
                           List of max 100 ids.
+    ** cache (ResponseCache): serves tweets looked up less than `ttl` ago,
+                          only the rest is requested.
+    ** arrow (bool): return a pyarrow.Table decoded against a fixed layout.
+    ** errors (list): (id, failure class, detail) of the ids the API could
+                          not return, e.g. deleted or suspended ones.
     Output:
     -----------
     ** data: Json object with the result of the call to the api.
     """
 
-    def __init__(self, tweets_ids, bearer_token):
+    def __init__(self, tweets_ids, bearer_token, transport=None, cache=None, arrow=False):
         self.bearer_token = bearer_token
         self.tweets_ids = tweets_ids
-        self.params = {
-            'tweet.fields': 'attachments,author_id,context_annotations,conversation_id,created_at,entities,geo,id,in_reply_to_user_id,lang,possibly_sensitive,public_metrics,referenced_tweets,reply_settings,source,text,withheld',
-            'user.fields': 'created_at,description,entities,id,location,name,pinned_tweet_id,profile_image_url,protected,public_metrics,url,username,verified,withheld',
-            'media.fields': 'duration_ms,height,media_key,non_public_metrics,organic_metrics,preview_image_url,promoted_metrics,public_metrics,type,url,width',
-            'place.fields': 'contained_within,country,country_code,full_name,geo,id,name,place_type'
-        }
+        self.errors = []
+        self.transport = transport or get_transport()
+        self.cache = cache
+        self.arrow = arrow
+        self.params = dict(TWEET_LOOKUP_PARAMS)
 
     def create_headers(self, bearer_token):
-        headers = {"Authorization": "Bearer {}".format(self.bearer_token)}
+        headers = self.transport.headers(self.bearer_token)
         return headers
 
     def connect_to_endpoint(self, headers, tweets_ids):
-        time.sleep(1)
         url = "https://api.twitter.com/2/tweets?ids={}".format(
             ",".join(tweets_ids))
-        response = requests.get(
+        response = self.transport.get(
             url,
             headers=headers,
             params=self.params
         )
-        return(response.json())
+        check_page(response)
+        page = read_json(response)
+        self.errors.extend(page_errors(page))
+        return page
 
     def main(self):
         headers = self.create_headers(self.bearer_token)
-        data = self.connect_to_endpoint(headers, self.tweets_ids)
-        data = json_normalize(data['data'])
+        if self.cache is not None:
+            data = cached_lookup(
+                self.cache, '/2/tweets', self.tweets_ids, self.params,
+                lambda ids: self.connect_to_endpoint(headers, ids)
+            )
+        else:
+            data = self.connect_to_endpoint(headers, self.tweets_ids).get('data', [])
+        if self.arrow:
+            return to_table(add_constants(records_to_table(data, TWEET), {'date_consulted': str(date.today())}), TWEET_SCHEMA)
+        data = json_normalize(data)
         data['date_consulted'] = str(date.today())
-        return data
+        return conform(data, TWEET_SCHEMA)
 
 
 class GetStatsFromTweet():
@@ -539,37 +1150,38 @@ class GetStatsFromTweet():
     Params:
     -----------
     ** tweet_id (str): Twitter id we want to retrieve engagements from
+    ** cache (ResponseCache): serves tweets looked up less than `ttl` ago
     Output:
     -----------
     ** data: Json object with the result of the call to the api.
     """
 
-    def __init__(self, tweet_id, bearer_token):
+    def __init__(self, tweet_id, bearer_token, transport=None, cache=None):
         self.bearer_token = bearer_token
         self.tweet_id = tweet_id
-        self.params = {
-            'tweet.fields': 'attachments,author_id,context_annotations,conversation_id,created_at,entities,geo,id,in_reply_to_user_id,lang,possibly_sensitive,public_metrics,referenced_tweets,reply_settings,source,text,withheld',
-            'user.fields': 'created_at,description,entities,id,location,name,pinned_tweet_id,profile_image_url,protected,public_metrics,url,username,verified,withheld',
-            'media.fields': 'duration_ms,height,media_key,non_public_metrics,organic_metrics,preview_image_url,promoted_metrics,public_metrics,type,url,width',
-            'place.fields': 'contained_within,country,country_code,full_name,geo,id,name,place_type'
-        }
+        self.transport = transport or get_transport()
+        self.cache = cache
+        self.params = dict(TWEET_LOOKUP_PARAMS)
 
     def create_headers(self, bearer_token):
-        headers = {"Authorization": "Bearer {}".format(self.bearer_token)}
+        headers = self.transport.headers(self.bearer_token)
         return headers
 
     def connect_to_endpoint(self, headers, tweet_id):
-        time.sleep(1)
-        response = requests.get(
+        response = self.transport.get(
             "https://api.twitter.com/2/tweets/{}".format(tweet_id),
             headers=headers,
             params=self.params
         )
-        return response.json()
+        return check_page(response, read_json(response))
 
     def main(self):
         headers = self.create_headers(self.bearer_token)
-        data = self.connect_to_endpoint(headers, self.tweet_id)
+        data = self.cache.get('/2/tweets/:id', self.tweet_id, self.params) if self.cache else None
+        if data is None:
+            data = self.connect_to_endpoint(headers, self.tweet_id)
+            if self.cache is not None and 'data' in data:
+                self.cache.put('/2/tweets/:id', self.tweet_id, self.params, data)
         data = json_normalize(data)
         data['date_consulted'] = str(date.today())
 
@@ -584,37 +1196,54 @@ class GetStatsFromUsers():
     Params:
     -----------
     ** user_ids (list): List of twitter ids we want to retrieve engagements from
+    ** cache (ResponseCache): serves users looked up less than `ttl` ago,
+                          only the rest is requested.
+    ** arrow (bool): return a pyarrow.Table decoded against a fixed layout.
+    ** errors (list): (id, failure class, detail) of the ids the API could
+                          not return, e.g. deleted or suspended ones.
     Output:
     -----------
     ** data: Json object with the result of the call to the api.
     """
 
-    def __init__(self, user_ids, bearer_token):
+    def __init__(self, user_ids, bearer_token, transport=None, cache=None, arrow=False):
         self.bearer_token = bearer_token
         self.user_ids = user_ids
-        self.params = {
-            'user.fields': 'created_at,description,entities,id,location,name,pinned_tweet_id,profile_image_url,protected,public_metrics,url,username,verified,withheld'
-        }
+        self.errors = []
+        self.transport = transport or get_transport()
+        self.cache = cache
+        self.arrow = arrow
+        self.params = dict(USER_LOOKUP_PARAMS)
 
     def create_headers(self, bearer_token):
-        headers = {"Authorization": "Bearer {}".format(self.bearer_token)}
+        headers = self.transport.headers(self.bearer_token)
         return headers
 
     def connect_to_endpoint(self, headers, user_ids):
-        time.sleep(1)
-        response = requests.get(
+        response = self.transport.get(
             "https://api.twitter.com/2/users?ids={}".format(
                 ",".join(user_ids)),
             headers=headers,
             params=self.params
         )
-        return response.json()
+        check_page(response)
+        page = read_json(response)
+        self.errors.extend(page_errors(page))
+        return page
 
     def main(self):
         headers = self.create_headers(self.bearer_token)
-        data = self.connect_to_endpoint(headers, self.user_ids)
-        data = json_normalize(data['data'])
-        return data
+        if self.cache is not None:
+            data = cached_lookup(
+                self.cache, '/2/users', self.user_ids, self.params,
+                lambda ids: self.connect_to_endpoint(headers, ids)
+            )
+        else:
+            data = self.connect_to_endpoint(headers, self.user_ids).get('data', [])
+        if self.arrow:
+            return to_table(records_to_table(data, USER), USER_SCHEMA)
+        data = json_normalize(data)
+        return conform(data, USER_SCHEMA)
 
 
 class GetStatsFromUser():
@@ -625,37 +1254,42 @@ class GetStatsFromUser():
     Params:
     -----------
     ** tweet_id (str): Twitter id we want to retrieve engagements from
+    ** cache (ResponseCache): serves users looked up less than `ttl` ago
     Output:
     -----------
     ** data: Json object with the result of the call to the api.
     """
 
-    def __init__(self, user_id, bearer_token):
+    def __init__(self, user_id, bearer_token, transport=None, cache=None):
         self.bearer_token = bearer_token
         self.user_id = user_id
-        self.params = {
-            'user.fields': 'created_at,description,entities,id,location,name,pinned_tweet_id,profile_image_url,protected,public_metrics,url,username,verified,withheld'}
+        self.transport = transport or get_transport()
+        self.cache = cache
+        self.params = dict(USER_LOOKUP_PARAMS)
 
     def create_headers(self, bearer_token):
-        headers = {"Authorization": "Bearer {}".format(self.bearer_token)}
+        headers = self.transport.headers(self.bearer_token)
         return headers
 
     def connect_to_endpoint(self, headers, user_id):
-        time.sleep(1)
-        response = requests.get(
+        response = self.transport.get(
             "https://api.twitter.com/2/users/{}".format(user_id),
             headers=headers,
             params=self.params
         )
-        return response.json()
+        return check_page(response, read_json(response))
 
     def main(self):
         headers = self.create_headers(self.bearer_token)
-        data = self.connect_to_endpoint(headers, self.user_id)
+        data = self.cache.get('/2/users/:id', self.user_id, self.params) if self.cache else None
+        if data is None:
+            data = self.connect_to_endpoint(headers, self.user_id)
+            if self.cache is not None and 'data' in data:
+                self.cache.put('/2/users/:id', self.user_id, self.params, data)
         return data
 
 
-class GetRepliesAssociatedToTweet:
+class GetRepliesAssociatedToTweet(Paginated):
 
     """Builds conversation threads from an specific conversation id
     ...
@@ -666,44 +1300,69 @@ class GetRepliesAssociatedToTweet:
         id of conversation thread we want to build
     bearer_token : str
         credentials for the Twitter developer app
+    transport : Transport
+        pooled HTTP transport used for every call
+    sink : ParquetSink or None
+        where pages are streamed to instead of being kept in memory
+    checkpoint : CheckpointStore or None
+        journal pagination progress is recorded in
+    incremental : Boolean
+        keep the newest reply collected in the checkpoint store and, on the
+        next run, only ask for replies posted after it (`since_id`),
+        appending them to the sink. Requires `checkpoint`
+    side_sinks : dict
+        expansion (users, tweets, media, places) -> ParquetSink its
+        deduplicated side table is streamed to
+    arrow : Boolean
+        decode pages straight into Arrow and return a `pyarrow.Table`
+    crawl : str
+        label of the crawl in the checkpoint journal, so an interrupted
+        crawl resumes while a new one collects the conversation again
+        Defaults to today's date
 
     Methods
     ----------
+    main()
+        Builds the conversation
+    iter_pages()
+        Pages of the conversation, fetched as they are consumed
+    iter_records()
+        Tweets of the conversation, page by page
 
     """
 
-    def __init__(self, conversation_id, bearer_token):
+    def __init__(self, conversation_id, bearer_token, transport=None, sink=None, checkpoint=None, incremental=False, side_sinks=None, arrow=False, crawl=None):
         self.bearer_token = bearer_token
         self.search_url = "https://api.twitter.com/2/tweets/search/all"
         self.conversation_id = conversation_id
+        self.transport = transport or get_transport()
+        self.sink = sink
+        self.checkpoint = checkpoint
+        self.incremental = incremental and checkpoint is not None
+        self.side_sinks = side_sinks or {}
+        self.arrow = arrow
+        self.since_key = 'conversation:{}'.format(conversation_id)
+        self.crawl = crawl or str(date.today())
+        self.job = 'replies:{}:{}'.format(conversation_id, self.crawl)
 
     def create_headers(self, bearer_token):
-        headers = {"Authorization": "Bearer {}".format(self.bearer_token)}
+        headers = self.transport.headers(self.bearer_token)
         return headers
 
     def connect_to_endpoint(self, url, headers, params):
-        time.sleep(1)
-        while True:
-            try:
-                response = requests.get(
-                    self.search_url,
-                    headers=headers,
-                    params=params
-                )
-            except response.status_code != 200:
-                time.sleep(60)
-                continue
-            break
-
-        return response.json()
+        response = self.transport.get(
+            self.search_url,
+            headers=headers,
+            params=params
+        )
+
+        return check_page(response, read_json(response))
 
     def paginate(self, json_response, query_params):
         next_token = json_response["meta"]["next_token"]
         query_params.update({'next_token': next_token})
 
-    def main(self):
-        headers = self.create_headers(self.bearer_token)
-
+    def page_request(self):
         query_params = {'query': 'conversation_id:' + str(self.conversation_id),
                         'tweet.fields': 'author_id,created_at,entities,geo,id,in_reply_to_user_id,lang,public_metrics,text,possibly_sensitive,referenced_tweets,reply_settings,source',
                         'max_results': 500,
@@ -712,34 +1371,64 @@ class GetRepliesAssociatedToTweet:
                         "start_time": "2021-01-26T00:00:00Z",
                         "end_time": str(date.today())+'T00:00:00Z'}
 
+        return self.search_url, self.create_headers(self.bearer_token), query_params
+
+    def page_buffer(self, status):
+        return PageBuffer(columns={
+            'date_consulted': str(date.today()),
+            'conversation_id': self.conversation_id
+        }, layout=TWEET if self.arrow else None, schema=TWEET_SCHEMA)
+
+    def main(self):
+        _, headers, query_params = self.page_request()
+
+        since_id = self.checkpoint.since(self.since_key) if self.incremental else None
+
+        if since_id is not None:
+            del query_params['start_time']
+            query_params['since_id'] = since_id
+            self.job = 'replies:{}:since:{}:{}'.format(
+                self.conversation_id, since_id, query_params['end_time'])
+
+        state = resume(self.checkpoint, self.job, self.sink, since_id is not None, self.side_sinks)
+
+        if state is not None and state['done']:
+            if self.incremental:
+                self.checkpoint.advance(self.since_key)
+            return state['rows']
+
+        if state is not None and state['token']:
+            query_params.update({'next_token': state['token']})
+
         json_response = self.connect_to_endpoint(
             self.search_url,
             headers,
             query_params
         )
-        try:
-            df = json_normalize(json_response['data'])
-            df = df.sort_index(axis=1)
-            while 'next_token' in json_response['meta'].keys():
-                time.sleep(1)
-                self.paginate(json_response, query_params)
-                response = requests.get(
-                    self.search_url,
-                    headers=headers,
-                    params=query_params
-                )
-                json_response.update(response.json())
-                flat = json_normalize(json_response['data'])
-                flat = flat.sort_index(axis=1)
-                df = df.append(flat)
-            df.reset_index(
-                drop=True,
-                inplace=True
-            )
-            df['date_consulted'] = str(date.today())
-            df['conversation_id'] = self.conversation_id
 
-            return df
+        if self.incremental:
+            if state is None or not state['token']:
+                # the first page holds the newest reply of the conversation
+                self.checkpoint.hold(self.since_key, json_response['meta'].get('newest_id'))
+            if 'data' not in json_response and since_id is not None:
+                # nothing posted since the previous run
+                df = PageBuffer(sink=self.sink, checkpoint=self.checkpoint, job=self.job, state=state).finish()
+                self.checkpoint.advance(self.since_key)
+                return df
+
+        pages = PageBuffer(sink=self.sink, columns={
+            'date_consulted': str(date.today()),
+            'conversation_id': self.conversation_id
+        }, checkpoint=self.checkpoint, job=self.job, state=state, side_sinks=self.side_sinks,
+            layout=TWEET if self.arrow else None, schema=TWEET_SCHEMA)
+        pages.add(json_response.get('data', []), json_response['meta'].get('next_token'), json_response.get('includes'))
+        while 'next_token' in json_response['meta'].keys():
+            self.paginate(json_response, query_params)
+            response = self.transport.get(self.search_url, headers=headers, params=query_params)
+            json_response.update(pages.read(response))
+        df = pages.finish()
 
-        except:
-            pass
+        if self.incremental:
+            self.checkpoint.advance(self.since_key)
+
+        return df
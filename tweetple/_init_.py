@@ -1,2 +1,19 @@
-from .TwitterFullArchive import TwitterObject, GetStatsFromTweets, GetTweetsFromUser, GetStatsFromUsers, GetInteractionsAssociatedToLink, GetFollowers, GetTweetplerInteracting, GetRepliesAssociatedToTweet
+from .TwitterFullArchive import TwitterObject, GetStatsFromTweets, GetTweetsFromUser, GetTweetsFromUsers, GetStatsFromUsers, GetInteractionsAssociatedToLink, GetInteractionsAssociatedToLinks, GetFollowers, GetTweetplerInteracting, GetRepliesAssociatedToTweet
 from .TweetPle import TweepleStreamer, TweetStreamer, get_threads
+from .TransportTweetPle import Transport, get_transport, set_transport
+from .RateLimitTweetPle import RateLimiter, TokenBucket, TokenPool
+from .ConcurrencyTweetPle import gather_bounded, run_concurrently
+from .AuxTweetPle import PageBuffer, concat_frames, pack_queries, split_time_range, INCLUDES, aggregate_twitter_metrics, scan_parquet
+from .SinkTweetPle import ParquetSink, read_parquet_parts
+from .CheckpointTweetPle import CheckpointStore
+from .CacheTweetPle import ResponseCache
+from .DecodeTweetPle import records_to_table, to_frame, TWEET, USER
+from .SchemaTweetPle import TWEET_SCHEMA, USER_SCHEMA, conform, to_table
+from .ThreadTweetPle import ConversationTree, build_tree, load_tree, summarize_threads
+from .GraphTweetPle import FollowerGraph
+from .SeenTweetPle import SeenIndex
+from .MetricsTweetPle import Metrics, get_metrics, set_metrics
+from .PipelineTweetPle import Pipeline
+from .PlanTweetPle import QueryPlanner, balance_windows
+from .DatasetTweetPle import TweetDataset
+from .RetryTweetPle import CollectionError, DeadLetters, RetryPolicy